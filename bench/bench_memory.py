@@ -0,0 +1,46 @@
+"""
+闭包密集的记录代码的内存占用：每个后端在单独的子进程中执行工作负载，报告峰值 RSS。
+
+    python bench/bench_memory.py [工作负载.loo ...]
+
+默认执行 ``workloads/records.loo``：记录的方法只引用构造时的几个字段，闭包如果
+引用整个定义环境，构造时的中间列表就会随记录一直存活。
+"""
+import os
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+BACKENDS = ('closure', 'bytecode', 'python')
+DEFAULT_WORKLOAD = os.path.join(BENCH_DIR, 'workloads', 'records.loo')
+
+
+def peak_rss(backend, script):
+    """返回 (峰值 RSS 的 MiB 数, 耗时)"""
+    command = [sys.executable, os.path.join(ROOT, 'loong.py'), '-b', backend, '--no-cache', script]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, cwd=ROOT)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status):
+        raise RuntimeError(f"{backend} failed on {script}")
+    # Linux 上 ru_maxrss 的单位是 KiB，macOS 上是字节
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / scale, elapsed
+
+
+def main():
+    scripts = sys.argv[1:] or [DEFAULT_WORKLOAD]
+    print(f"{'workload':<12}{'backend':<10}{'peak(MiB)':>10}{'time(s)':>10}")
+    for script in scripts:
+        name = os.path.splitext(os.path.basename(script))[0]
+        for backend in BACKENDS:
+            rss, elapsed = peak_rss(backend, os.path.abspath(script))
+            print(f"{name:<12}{backend:<10}{rss:>10.1f}{elapsed:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+pmap 在 CPU 密集的 lambda 上随工作进程数的扩展情况。
+
+    python bench/bench_pmap.py [元素个数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loong import VirtualMachine, parser
+
+SETUP = 'def fib(n): n < 2 ? n : fib(n - 1) + fib(n - 2) end 0'
+PROGRAM = 'pmap(xs, x => fib(x), workers)'
+
+
+def run(xs, workers):
+    vm = VirtualMachine()
+    vm.eval(parser.parse(SETUP))
+    vm.global_env.set('xs', xs)
+    vm.global_env.set('workers', workers)
+    tree = parser.parse(PROGRAM)
+    start = time.perf_counter()
+    result = vm.eval(tree)
+    return time.perf_counter() - start, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    xs = [20] * n
+    cpus = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+    base, expected = run(xs, 1)
+    print(f"{'workers':<10}{'time':>10}{'speedup':>10}")
+    print(f"{1:<10}{base:>9.3f}s{1:>9.1f}x")
+    for workers in counts[1:]:
+        elapsed, result = run(xs, workers)
+        assert result == expected
+        print(f"{workers:<10}{elapsed:>9.3f}s{base / elapsed:>9.1f}x")
+    if cpus == 1:
+        print("only one CPU is available; run on a multi-core machine to see scaling")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+常驻服务与冷启动 CLI 的对比：吞吐量（请求/秒）和延迟的 p50/p99。
+
+    python bench/bench_server.py [请求数] [并发数]
+
+先启动一个临时的 loongserver，用多个并发客户端发送同一个脚本，再用
+``python loong.py`` 逐个执行同一个脚本作为对照。
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from loongclient import request
+
+SCRIPT = os.path.join(BENCH_DIR, 'workloads', 'startup.loo')
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, round(p / 100 * (len(samples) - 1)))]
+
+
+def report(name, latencies, elapsed):
+    print(f"{name:<10}{len(latencies) / elapsed:>10.1f}"
+          f"{statistics.median(latencies) * 1000:>10.1f}{percentile(latencies, 99) * 1000:>10.1f}")
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def wait_for(path, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("loongserver exited during startup")
+        try:
+            request({'code': '0'}, path)
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError("loongserver did not start")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sock')
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'loongserver.py'),
+                               '--socket', path, '--workers', str(concurrency)])
+    try:
+        wait_for(path, server)
+        payload = {'file': SCRIPT, 'cwd': ROOT}
+
+        def warm():
+            response = request(payload, path)
+            assert response['ok'], response['error']
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            warm_latencies = list(executor.map(lambda _: timed(warm), range(n)))
+        warm_elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    command = [sys.executable, os.path.join(ROOT, 'loong.py'), SCRIPT]
+    cold = lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL, cwd=ROOT)
+    cold_n = max(2, n // 10)  # 冷启动慢得多，减少次数
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        cold_latencies = list(executor.map(lambda _: timed(cold), range(cold_n)))
+    cold_elapsed = time.perf_counter() - start
+
+    print(f"{'mode':<10}{'req/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}")
+    report('server', warm_latencies, warm_elapsed)
+    report('cold cli', cold_latencies, cold_elapsed)
+
+
+if __name__ == '__main__':
+    main()
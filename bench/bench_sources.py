@@ -0,0 +1,82 @@
+"""
+流式文件数据源的吞吐量和内存：统计一个生成的日志文件中 ERROR 行数的耗时，每种方式
+在单独的子进程中执行，报告 MB/s 和峰值 RSS。
+
+    python bench/bench_sources.py [日志大小(MiB)，默认 256]
+
+比较 Python 逐行读取的基准、Loong 的 ``lines`` 与 ``lines(path, 1)``（内存映射）以及
+按块读取映射的 ``chunks``（统计字节数）。峰值 RSS 应当与文件大小无关。
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+PROGRAMS = {
+    'python': None,
+    'lines': '@_; sum(lines(path) |? (l => l.startswith("ERROR")) |> (l => 1))',
+    'lines-mmap': '@_; sum(lines(path, 1) |? (l => l.startswith("ERROR")) |> (l => 1))',
+    'chunks-mmap': '@_; sum(chunks(path, 1 << 20, 1) |> (c => len(c)))',
+}
+
+
+def write_log(path, mib):
+    line = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while f.tell() < mib * 1024 * 1024:
+            f.write(''.join(f"{'ERROR' if (line + i) % 10 == 0 else 'INFO'} worker-{(line + i) % 16} "
+                            f"request {line + i} took {(line + i) % 1000} ms\n" for i in range(10000)))
+            line += 10000
+
+
+def run(name, path):
+    """在子进程中执行，打印结果和耗时"""
+    start = time.perf_counter()
+    if name == 'python':
+        with open(path, encoding='utf-8') as f:
+            count = sum(1 for line in f if line.startswith("ERROR"))
+    else:
+        sys.path.insert(0, ROOT)
+        from loong import VirtualMachine, parser
+        vm = VirtualMachine()
+        vm.global_env.set('path', path)
+        count = vm.eval(parser.parse(PROGRAMS[name]))
+    print(count, time.perf_counter() - start)
+
+
+def measure(name, path):
+    """返回 (结果, 耗时, 峰值 RSS 的 MiB 数)"""
+    command = [sys.executable, os.path.abspath(__file__), '--run', name, path]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    if os.waitstatus_to_exitcode(status):
+        raise RuntimeError(f"{name} failed")
+    count, elapsed = output.split()
+    # Linux 上 ru_maxrss 的单位是 KiB，macOS 上是字节
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return int(count), float(elapsed), usage.ru_maxrss / scale
+
+
+def main():
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], sys.argv[3])
+        return
+    mib = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'app.log')
+        write_log(path, mib)
+        size = os.path.getsize(path) / (1024 * 1024)
+        print(f"log: {size:.0f} MiB")
+        print(f"{'source':<14}{'result':>12}{'time(s)':>10}{'MB/s':>10}{'peak(MiB)':>11}")
+        for name in PROGRAMS:
+            count, elapsed, rss = measure(name, path)
+            print(f"{name:<14}{count:>12}{elapsed:>10.2f}{size / elapsed:>10.1f}{rss:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
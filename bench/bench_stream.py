@@ -0,0 +1,77 @@
+"""
+流式执行与整文件解析的比较：执行一个生成的大 .loo 文件（大量带有大列表、大字典
+字面量的顶层语句），每种方式在单独的子进程中执行，报告第一条语句开始执行的时间、
+总时间和峰值 RSS。
+
+    python bench/bench_stream.py [语句数，默认 500]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+
+def write_source(path, statements):
+    """每条语句把一个 100 行记录的列表字面量交给 add，最后一条语句返回行数"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("mark();\n")
+        for i in range(statements):
+            rows = ",\n".join(f'  {{id: {i * 100 + j}, name: "user-{j}", tags: ["a", "b", {j}], score: {j}.5}}'
+                              for j in range(100))
+            f.write(f"add([\n{rows}\n]);\n")
+        f.write("count()\n")
+
+
+def run(mode, path):
+    """在子进程中执行，打印第一条语句开始执行的时间、总时间和结果"""
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from loong import VirtualMachine
+    first = []
+    total = [0]
+    vm = VirtualMachine(use_cache=False)
+    vm.global_env.set('mark', lambda: first.append(time.perf_counter() - start))
+    vm.global_env.set('add', lambda rows: total.__setitem__(0, total[0] + len(rows)))
+    vm.global_env.set('count', lambda: total[0])
+    if mode == 'stream':
+        result = vm.process_stream(path)
+    else:
+        result = vm.process_file(path)
+    print(first[0], time.perf_counter() - start, result)
+
+
+def measure(mode, path):
+    """返回 (第一条语句的时间, 总时间, 峰值 RSS 的 MiB 数)"""
+    command = [sys.executable, os.path.abspath(__file__), '--run', mode, path]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    if os.waitstatus_to_exitcode(status):
+        raise RuntimeError(f"{mode} failed")
+    first, elapsed, _ = output.split()
+    # Linux 上 ru_maxrss 的单位是 KiB，macOS 上是字节
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return float(first), float(elapsed), usage.ru_maxrss / scale
+
+
+def main():
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], sys.argv[3])
+        return
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'config.loo')
+        write_source(path, statements)
+        print(f"source: {os.path.getsize(path) / (1024 * 1024):.1f} MiB, {statements} statements")
+        print(f"{'mode':<8}{'first(s)':>10}{'total(s)':>10}{'peak(MiB)':>11}")
+        for mode in ('file', 'stream'):
+            first, elapsed, rss = measure(mode, path)
+            print(f"{mode:<8}{first:>10.3f}{elapsed:>10.2f}{rss:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
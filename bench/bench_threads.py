@@ -0,0 +1,51 @@
+"""
+多线程嵌入的吞吐量：一个虚拟机编译一次 I/O 密集的脚本（等待 10 ms，模拟一次网络
+请求），在 1/2/4/8/16 个线程中用 ``Program.run`` 反复执行，每次使用新的环境，
+报告每秒执行次数。等待期间释放 GIL，吞吐量应当随线程数近似线性增长。
+
+    python bench/bench_threads.py [每种线程数的执行次数，默认 320] [后端，默认 closure]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from loong import VirtualMachine  # noqa: E402
+
+SOURCE = '''
+@_;
+@time;
+let request = {id: x, path: "/items/" + str(x)};
+time.sleep(0.01);
+request.id * 2
+'''
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 320
+    backend = sys.argv[2] if len(sys.argv) > 2 else 'closure'
+    vm = VirtualMachine(backend, use_cache=False)
+    program = vm.compile(SOURCE, vm.new_env({'x': 0}))
+
+    def run(i):
+        return program.run(vm.new_env({'x': i}))
+
+    print(f"backend: {backend}, {runs} runs per thread count")
+    print(f"{'threads':>8}{'time(s)':>10}{'runs/s':>10}{'speedup':>10}")
+    base = None
+    for threads in (1, 2, 4, 8, 16):
+        with ThreadPoolExecutor(threads) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(run, range(runs)))
+            elapsed = time.perf_counter() - start
+        assert results == [i * 2 for i in range(runs)]
+        rate = runs / elapsed
+        base = base or rate
+        print(f"{threads:>8}{elapsed:>10.2f}{rate:>10.1f}{rate / base:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
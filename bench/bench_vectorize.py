@@ -0,0 +1,49 @@
+"""
+比较管道中纯算术 lambda 的逐元素执行与 NumPy 向量化执行。
+
+    python bench/bench_vectorize.py [元素个数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vectorize
+from loong import VirtualMachine, parser
+
+PROGRAMS = {
+    'map': 'xs |> (x => x * 2 + 1)',
+    'filter': 'xs |? (x => x % 2 == 0)',
+    'map+filter': 'xs |> (x => x * 3 - 1) |? (x => x % 5 < 2) |> (x => x / 2)',
+}
+
+
+def run(code, xs):
+    vm = VirtualMachine()
+    vm.global_env.set('xs', xs)
+    tree = parser.parse(code)
+    start = time.perf_counter()
+    result = vm.eval(tree).force()
+    return time.perf_counter() - start, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6
+    if vectorize.np is None:
+        print("numpy is not installed; only the scalar path is available")
+        return
+    xs = list(range(n))
+    threshold = vectorize.VECTORIZE_THRESHOLD
+    print(f"{'program':<12}{'scalar':>10}{'numpy':>10}{'speedup':>10}")
+    for name, code in PROGRAMS.items():
+        vectorize.VECTORIZE_THRESHOLD = float('inf')
+        scalar_time, scalar_result = run(code, xs)
+        vectorize.VECTORIZE_THRESHOLD = threshold
+        numpy_time, numpy_result = run(code, xs)
+        assert scalar_result == numpy_result
+        print(f"{name:<12}{scalar_time:>9.3f}s{numpy_time:>9.3f}s{scalar_time / numpy_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+性能基准测试套件。
+
+    python bench/run.py [-n 次数] [-b 后端] [-o 结果.json] [--compare 基准.json] [工作负载 ...]
+
+每个工作负载先预热一次，再重复执行 n 次，报告中位数、四分位距（IQR）和最小值。
+结果默认保存到 ``bench/results/<commit>.json``。使用 ``--compare`` 与之前的结果
+比较时，只有中位数变化超过阈值、并且两次测量的四分位区间不重叠，才判定为
+退步或提升，以免把噪声当成变化。
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from loong import VirtualMachine, parser
+
+WORKLOAD_DIR = os.path.join(BENCH_DIR, 'workloads')
+EXAMPLES_DIR = os.path.join(ROOT, 'examples')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def loo_workload(name):
+    """执行 workloads/<name>.loo，包括编译，不包括解析"""
+    filename = os.path.join(WORKLOAD_DIR, f"{name}.loo")
+    with open(filename, encoding='utf-8') as f:
+        tree = parser.parse(f.read())
+
+    def setup(backend):
+        def run():
+            vm = VirtualMachine(backend, path=[WORKLOAD_DIR, EXAMPLES_DIR])
+            return vm.eval(tree)
+        return run
+    return setup
+
+
+def parse_workload(backend):
+    """只解析一个生成的大源文件"""
+    lines = [f"def f{i}(a, b): let c = a * {i} + b; c > 10 ? [c, \"s{i}\"] : {{x: c, y: b}} end"
+             for i in range(1500)]
+    source = "\n".join(lines) + "\nf1(1, 2)"
+    return lambda: parser.parse(source)
+
+
+def startup_workload(backend):
+    """启动解释器并执行一个最小的脚本"""
+    script = os.path.join(WORKLOAD_DIR, 'startup.loo')
+    command = [sys.executable, os.path.join(ROOT, 'loong.py'), '-b', backend, script]
+    return lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+
+WORKLOADS = {
+    'recursion': loo_workload('recursion'),
+    'closures': loo_workload('closures'),
+    'pipelines': loo_workload('pipelines'),
+    'interop': loo_workload('interop'),
+    'strings': loo_workload('strings'),
+    'parse': parse_workload,
+    'startup': startup_workload,
+}
+
+
+def measure(run, repeat):
+    run()  # 预热：导入模块、填充缓存
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def summarize(samples):
+    q1, median, q3 = statistics.quantiles(samples, n=4, method='inclusive')
+    return {
+        'samples': samples,
+        'min': min(samples),
+        'median': median,
+        'q1': q1,
+        'q3': q3,
+        'mean': statistics.fmean(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    """返回 'regression'、'improvement' 或 ''"""
+    ratio = new['median'] / old['median']
+    if ratio > 1 + threshold and new['q1'] > old['q3']:
+        return 'regression'
+    if ratio < 1 - threshold and new['q3'] < old['q1']:
+        return 'improvement'
+    return ''
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run the Loong benchmark suite.")
+    argparser.add_argument('workloads', nargs='*', metavar='WORKLOAD',
+                           help=f"Workloads to run (default: all of {', '.join(WORKLOADS)}).")
+    argparser.add_argument('-n', '--repeat', type=int, default=7, help="Timed runs per workload.")
+    argparser.add_argument('-b', '--backend', choices=VirtualMachine.BACKENDS, default='closure')
+    argparser.add_argument('-o', '--output', help="Result file (default: bench/results/<commit>.json).")
+    argparser.add_argument('--compare', metavar='BASELINE', help="Compare with an earlier result file.")
+    argparser.add_argument('--threshold', type=float, default=0.05,
+                           help="Relative change of the median to report (default: 0.05).")
+    args = argparser.parse_args()
+    if args.repeat < 2:
+        argparser.error("--repeat must be at least 2")
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        argparser.error(f"unknown workload(s): {', '.join(unknown)}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    print(f"{'workload':<12}{'median':>10}{'iqr':>10}{'min':>10}{'change':>10}")
+    for name in args.workloads or WORKLOADS:
+        stats = results[name] = measure(WORKLOADS[name](args.backend), args.repeat)
+        line = f"{name:<12}{stats['median']:>9.4f}s{stats['q3'] - stats['q1']:>9.4f}s{stats['min']:>9.4f}s"
+        if baseline and name in baseline:
+            change = stats['median'] / baseline[name]['median'] - 1
+            line += f"{change:>+10.1%}  {compare(baseline[name], stats, args.threshold)}"
+        print(line)
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': commit,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'repeat': args.repeat,
+            'results': results,
+        }, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
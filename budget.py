@@ -0,0 +1,137 @@
+"""
+每次求值的执行预算：步数、时限、调用深度和分配数。
+
+开启预算时，编译器像性能分析一样把每个 Loong 函数体包装一层计数代码（见
+``Budget.wrap_function``）；关闭时不做任何包装，没有额外开销。Loong 没有循环语句，
+重复执行都要经过函数调用（递归、蹦床执行的尾调用、``|>``/``|?`` 对每个元素调用的
+函数），因此在调用边界检查就能拦住失控的脚本：
+
+- ``steps``：Loong 函数调用的总次数；
+- ``seconds``：从求值开始经过的时间；
+- ``depth``：嵌套调用的深度，尾调用不增加深度；
+- ``allocations``：求值期间新增的存活内存块数（``sys.getallocatedblocks``），
+  整个进程共用这个计数，是近似值。
+
+步数和深度每次调用都检查，时限和分配数每 CHECK_INTERVAL 次调用检查一次。超出
+任何一项时抛出 BudgetExceeded，其中带有已经用掉的量。Python 函数内部的执行（例如
+``time.sleep``、对大列表的 ``sum``）不计步数，也不会被中途打断。
+
+计量状态按线程保存，多个线程可以同时在各自的预算内执行同一个 Program，但分配数
+例外：它是整个进程的计数，其他线程中同时进行的求值分配的内存也会计入。Loong 代码自己
+创建的线程和 pmap 的工作进程不受预算限制。
+"""
+import sys
+import threading
+import time
+
+# 每隔多少次调用检查一次时限和分配数
+CHECK_INTERVAL = 256
+
+
+class _Local(threading.local):
+    meter = None  # 当前线程正在进行的求值的 Meter
+
+
+class BudgetExceeded(Exception):
+    """
+    求值超出了执行预算。
+
+    :param limit: 超出的一项：'steps'、'seconds'、'depth' 或 'allocations'。
+    :param stats: 超出时已经用掉的量，键与 ``Meter.stats`` 相同。
+    """
+
+    def __init__(self, limit, stats):
+        self.limit = limit
+        self.stats = stats
+        used = ", ".join(f"{key}={value}" for key, value in stats.items())
+        super().__init__(f"execution budget exceeded: {limit} ({used})")
+
+
+class Meter:
+    """一次求值用掉的预算"""
+    __slots__ = ('budget', 'steps', 'depth', 'max_depth', 'next_check', 'start', 'blocks')
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.steps = 0
+        self.depth = 0
+        self.max_depth = 0  # 到达过的最大深度
+        self.next_check = 0
+        self.start = time.monotonic()
+        self.blocks = sys.getallocatedblocks()
+
+    def stats(self):
+        return {'steps': self.steps,
+                'seconds': round(time.monotonic() - self.start, 6),
+                'depth': self.max_depth,
+                'allocations': sys.getallocatedblocks() - self.blocks}
+
+    def check(self):
+        """步数到达 next_check 或深度超过限制时调用"""
+        budget = self.budget
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+        if budget.depth is not None and self.depth > budget.depth:
+            raise BudgetExceeded('depth', self.stats())
+        if self.steps < self.next_check:
+            return
+        if budget.steps is not None and self.steps > budget.steps:
+            raise BudgetExceeded('steps', self.stats())
+        if budget.seconds is not None and time.monotonic() - self.start > budget.seconds:
+            raise BudgetExceeded('seconds', self.stats())
+        if budget.allocations is not None and sys.getallocatedblocks() - self.blocks > budget.allocations:
+            raise BudgetExceeded('allocations', self.stats())
+        self.next_check = self.steps + CHECK_INTERVAL
+        if budget.steps is not None:
+            # 步数的限制是精确的
+            self.next_check = min(self.next_check, budget.steps + 1)
+
+
+class Budget:
+    """
+    执行预算，作为 ``VirtualMachine(budget=...)`` 传入，对每次求值分别计量。
+    为 None 的一项不限制。
+
+    :param steps: 最多调用 Loong 函数的次数。
+    :param seconds: 最长执行时间（秒）。
+    :param depth: 最大调用深度。
+    :param allocations: 最多新增的存活内存块数。
+    """
+
+    def __init__(self, steps=None, seconds=None, depth=None, allocations=None):
+        self.steps = steps
+        self.seconds = seconds
+        self.depth = depth
+        self.allocations = allocations
+        self._local = _Local()
+
+    def wrap_function(self, body):
+        """包装 ``body(env, args)``，每次调用计一步并检查预算"""
+        local = self._local
+        max_depth = sys.maxsize if self.depth is None else self.depth
+
+        def budgeted_body(env, args):
+            meter = local.meter
+            if meter is None:  # 不在求值之中，例如求值结束后才展开的惰性管道
+                return body(env, args)
+            meter.steps += 1
+            depth = meter.depth = meter.depth + 1
+            try:
+                if meter.steps >= meter.next_check or depth > max_depth or depth > meter.max_depth:
+                    meter.check()
+                return body(env, args)
+            finally:
+                meter.depth -= 1
+        return budgeted_body
+
+    def run(self, fn, *args):
+        """在新的计量中执行 ``fn(*args)``；已经在求值之中时（例如导入的模块）计入外层的计量"""
+        local = self._local
+        if local.meter is not None:
+            return fn(*args)
+        local.meter = meter = Meter(self)
+        try:
+            meter.check()
+            return fn(*args)
+        finally:
+            local.meter = None
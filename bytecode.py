@@ -0,0 +1,519 @@
+from lark.lexer import Token
+from lark.tree import Tree
+
+from loongast import Env, FuncCall, FuncDef
+from operators import DISPATCH, FAST_PATHS, UNARY_OPERATORS, PY_OPERATORS as BINARY_OPERATORS
+from pipeline import Pipeline, discard, materialize
+from profiler import lambda_name
+from records import record_type
+from rope import plain
+from resolver import STATEMENT_NODES
+
+# 操作码（按执行频率排列，解释循环中也按此顺序判断）
+LOAD_NAME = 0
+LOAD_CONST = 1
+BINARY_ENV = 2          # arg: ENV_OPERATORS 下标，可被字典的 __add__ 等重载
+BINARY = 3              # arg: PY_OPERATORS 下标
+CALL = 4                # arg: 参数个数
+JUMP_IF_FALSE = 5       # arg: 跳转目标
+JUMP = 6                # arg: 跳转目标
+RETURN = 7
+POP = 8
+GET_ITEM = 9
+GET_ATTR = 10           # arg: names 下标
+JUMP_IF_FALSE_OR_POP = 11
+JUMP_IF_TRUE_OR_POP = 12
+UNARY = 13              # arg: UN_OPERATORS 下标
+BUILD_LIST = 14         # arg: 元素个数
+BUILD_DICT = 15         # arg: consts 中记录类型的下标，键是它的 fields
+MAP = 16
+FILTER = 17
+MAKE_FUNCTION = 18      # arg: consts 中 CodeObject 的下标
+STORE_LET = 19          # arg: names 下标，检查重复定义
+STORE_DEF = 20          # arg: names 下标，不做检查
+STORE_NAME = 21         # arg: names 下标，要求变量已定义
+SET_ITEM = 22
+SET_ATTR = 23           # arg: names 下标
+UNPACK_LET = 24         # arg: consts 中名字元组的下标
+IMPORT = 25             # arg: names 下标
+IMPORT_STAR = 26        # arg: names 下标
+TAIL_CALL = 27          # arg: 参数个数，后面紧跟 RETURN
+MAKE_ASYNC_FUNCTION = 28  # arg: consts 中 (参数, 函数体语法树, 名字) 的下标
+
+OPNAMES = {value: name for name, value in globals().items()
+           if name.isupper() and isinstance(value, int)}
+
+ENV_OPERATORS = list(FAST_PATHS)
+PY_OPERATORS = list(BINARY_OPERATORS)
+UN_OPERATORS = list(UNARY_OPERATORS)
+
+
+class CodeObject:
+    """
+    编译后的字节码。
+
+    指令以 ``[op, arg, op, arg, ...]`` 的形式平铺在 ``code`` 中，
+    常量和名字分别保存在 ``consts`` 与 ``names`` 表里。
+    CodeObject 与运行时环境无关，可以缓存并重复执行。
+    """
+
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params
+        self.code = []
+        self.consts = []
+        self.names = []
+        self.freevars = ()  # 函数体引用的外层名字
+
+    def emit(self, op, arg=0):
+        self.code.extend((op, arg))
+        return len(self.code) - 1  # 参数所在位置，便于回填跳转目标
+
+    def const(self, value):
+        for i, c in enumerate(self.consts):
+            if type(c) is type(value) and c == value:
+                return i
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def name_index(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return self.names.index(name)
+
+    def dis(self, indent=""):
+        """返回可读的反汇编文本"""
+        lines = [f"{indent}code {self.name}({', '.join(self.params)}):"]
+        nested = []
+        for pc in range(0, len(self.code), 2):
+            op, arg = self.code[pc], self.code[pc + 1]
+            if op in (LOAD_NAME, GET_ATTR, STORE_LET, STORE_DEF, STORE_NAME, SET_ATTR, IMPORT, IMPORT_STAR):
+                detail = self.names[arg]
+            elif op in (LOAD_CONST, UNPACK_LET):
+                detail = repr(self.consts[arg])
+            elif op == BUILD_DICT:
+                detail = repr(self.consts[arg].fields)
+            elif op == MAKE_FUNCTION:
+                detail = self.consts[arg].name
+                nested.append(self.consts[arg])
+            elif op == BINARY_ENV:
+                detail = ENV_OPERATORS[arg]
+            elif op == BINARY:
+                detail = PY_OPERATORS[arg]
+            elif op == UNARY:
+                detail = UN_OPERATORS[arg]
+            else:
+                detail = str(arg)
+            lines.append(f"{indent}  {pc:4d} {OPNAMES[op]:<22}{detail}")
+        for code in nested:
+            lines.append(code.dis(indent + "  "))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"<code {self.name}>"
+
+
+class BytecodeCompiler:
+    """把 Lark 语法树编译为 CodeObject"""
+
+    def compile(self, node, name="<module>", params=()):
+        code = CodeObject(name, list(params))
+        self.emit_value(node, code)
+        code.emit(RETURN)
+        return code
+
+    def compile_function(self, node, name, params):
+        code = self.compile(node, name, params)
+        self.mark_tail_calls(code)
+        code.freevars = self.freevars(code)
+        return code
+
+    def freevars(self, code):
+        """函数体读取、但不在函数内定义的名字"""
+        loaded, local = set(), set(code.params)
+        ops = code.code
+        for pc in range(0, len(ops), 2):
+            op, arg = ops[pc], ops[pc + 1]
+            if op == LOAD_NAME:
+                loaded.add(code.names[arg])
+            elif op in (STORE_LET, STORE_DEF):
+                local.add(code.names[arg])
+            elif op == UNPACK_LET:
+                local.update(code.consts[arg])
+            elif op == MAKE_FUNCTION:
+                loaded.update(code.consts[arg].freevars)
+        return tuple(sorted(loaded - local))
+
+    def mark_tail_calls(self, code):
+        """窥孔优化：跳到 RETURN 的 JUMP 直接改为 RETURN，紧跟 RETURN 的 CALL 改为 TAIL_CALL"""
+        ops = code.code
+        for pc in range(0, len(ops), 2):
+            if ops[pc] == JUMP and ops[ops[pc + 1]] == RETURN:
+                ops[pc], ops[pc + 1] = RETURN, 0
+        for pc in range(0, len(ops) - 2, 2):
+            if ops[pc] == CALL and ops[pc + 2] == RETURN:
+                ops[pc] = TAIL_CALL
+
+    def emit_value(self, node, code):
+        """生成求值 node 的指令，执行后栈上恰好多出一个值"""
+        if isinstance(node, Tree) and node.data in STATEMENT_NODES:
+            self.emit(node, code)
+            code.emit(LOAD_CONST, code.const(None))
+        else:
+            self.emit(node, code)
+
+    def emit(self, node, code):
+        if node is None:
+            code.emit(LOAD_CONST, code.const(None))
+        elif isinstance(node, Tree):
+            method = getattr(self, f"emit_{node.data}", None)
+            if method is None:
+                raise SyntaxError(f"Unsupported syntax node '{node.data}'")
+            method(node, code)
+        elif node.type == 'NAME':
+            code.emit(LOAD_NAME, code.name_index(node.value))
+        elif node.type == 'NUMBER':
+            if '.' in node.value or 'e' in node.value or 'E' in node.value:
+                code.emit(LOAD_CONST, code.const(float(node.value)))
+            else:
+                code.emit(LOAD_CONST, code.const(int(node.value)))
+        elif node.type == 'STRING':
+            code.emit(LOAD_CONST, code.const(node.value[1:-1]))
+        else:
+            raise SyntaxError(f"Unsupported token '{node.type}'")
+
+    def params(self, node):
+        # 空参数列表会被 lark 解析为 [None]
+        return [param.value for param in node.children if param is not None]
+
+    def function(self, node, code, name, params):
+        func_code = self.compile_function(node, name, params)
+        code.emit(MAKE_FUNCTION, code.const(func_code))
+
+    def async_function(self, node, code, name, params):
+        # 解释循环无法在 await 处挂起，async 函数体交给闭包编译器的 AsyncCompiler
+        code.emit(MAKE_ASYNC_FUNCTION, code.const((params, node, name)))
+
+    # 语句
+
+    def emit_statements(self, node, code):
+        children = node.children
+        for child in children[:-1]:
+            self.emit(child, code)
+            if not (isinstance(child, Tree) and child.data in STATEMENT_NODES):
+                code.emit(POP)
+        self.emit_value(children[-1], code)
+
+    def emit_import_stmt(self, node, code):
+        star = len(node.children) > 1 and node.children[1] is not None and node.children[1].value == '*'
+        code.emit(IMPORT_STAR if star else IMPORT, code.name_index(node.children[0].value))
+
+    def emit_let_stmt(self, node, code):
+        self.emit(node.children[1], code)
+        code.emit(STORE_LET, code.name_index(node.children[0].value))
+
+    def emit_let_multi_stmt(self, node, code):
+        self.emit(node.children[-1], code)
+        code.emit(UNPACK_LET, code.const(tuple(name.value for name in node.children[:-1])))
+
+    def emit_assign_stmt(self, node, code):
+        target = node.children[0]
+        self.emit(node.children[1], code)
+        if isinstance(target, Token):  # name
+            code.emit(STORE_NAME, code.name_index(target.value))
+        elif target.data == 'array_access':
+            self.emit(target.children[0], code)
+            self.emit(target.children[1], code)
+            code.emit(SET_ITEM)
+        elif target.data == 'prop_access':
+            self.emit(target.children[0], code)
+            code.emit(SET_ATTR, code.name_index(target.children[1].value))
+        else:
+            raise SyntaxError(f"Cannot assign to '{target.data}'")
+
+    def emit_func_def(self, node, code):
+        name = node.children[0].value
+        self.function(node.children[2], code, name, self.params(node.children[1]))
+        code.emit(STORE_DEF, code.name_index(name))
+
+    def emit_async_func_def(self, node, code):
+        name = node.children[0].value
+        self.async_function(node.children[2], code, name, self.params(node.children[1]))
+        code.emit(STORE_DEF, code.name_index(name))
+
+    # 表达式
+
+    def emit_func_expr(self, node, code):
+        self.function(node.children[1], code, lambda_name(node), self.params(node.children[0]))
+
+    def emit_short_func_expr(self, node, code):
+        self.function(node.children[1], code, lambda_name(node), [node.children[0].value])
+
+    def emit_async_func_expr(self, node, code):
+        self.async_function(node.children[1], code, lambda_name(node), self.params(node.children[0]))
+
+    def emit_async_short_func_expr(self, node, code):
+        self.async_function(node.children[1], code, lambda_name(node), [node.children[0].value])
+
+    def emit_await_exp(self, node, code):
+        # 顶层 await 由 VirtualMachine.eval 交给闭包编译器，到达这里说明在普通函数中
+        raise SyntaxError("'await' outside async function")
+
+    def emit_func_call(self, node, code):
+        self.emit(node.children[0], code)
+        args = [arg for arg in node.children[1].children if arg is not None]
+        for arg in args:
+            self.emit(arg, code)
+        code.emit(CALL, len(args))
+
+    def emit_array_access(self, node, code):
+        self.emit(node.children[0], code)
+        self.emit(node.children[1], code)
+        code.emit(GET_ITEM)
+
+    def emit_prop_access(self, node, code):
+        self.emit(node.children[0], code)
+        code.emit(GET_ATTR, code.name_index(node.children[1].value))
+
+    def emit_list(self, node, code):
+        items = [item for item in node.children if item is not None]
+        for item in items:
+            self.emit(item, code)
+        code.emit(BUILD_LIST, len(items))
+
+    def emit_dict(self, node, code):
+        pairs = [pair for pair in node.children if pair is not None]
+        for pair in pairs:
+            self.emit(pair.children[1], code)
+        code.emit(BUILD_DICT, code.const(record_type(tuple(pair.children[0].value for pair in pairs))))
+
+    def emit_const_list(self, node, code):
+        items = node.children[0]
+        for item in items:
+            code.emit(LOAD_CONST, code.const(item))
+        code.emit(BUILD_LIST, len(items))
+
+    def emit_const_dict(self, node, code):
+        pairs = node.children[0]
+        for _, value in pairs:
+            code.emit(LOAD_CONST, code.const(value))
+        code.emit(BUILD_DICT, code.const(record_type(tuple(key for key, _ in pairs))))
+
+    def emit_literal(self, node, code):
+        code.emit(LOAD_CONST, code.const(node.children[0]))
+
+    def emit_map_expr(self, node, code):
+        self.emit(node.children[0], code)
+        self.emit(node.children[2], code)
+        code.emit(MAP if node.children[1].type == 'MAP' else FILTER)
+
+    def emit_conditional_exp(self, node, code):
+        self.emit(node.children[0], code)
+        to_else = code.emit(JUMP_IF_FALSE)
+        self.emit(node.children[1], code)
+        to_end = code.emit(JUMP)
+        code.code[to_else] = len(code.code)
+        self.emit(node.children[2], code)
+        code.code[to_end] = len(code.code)
+
+    def emit_logical_or_exp(self, node, code):
+        self.emit(node.children[0], code)
+        to_end = code.emit(JUMP_IF_TRUE_OR_POP)
+        self.emit(node.children[-1], code)
+        code.code[to_end] = len(code.code)
+
+    def emit_logical_and_exp(self, node, code):
+        self.emit(node.children[0], code)
+        to_end = code.emit(JUMP_IF_FALSE_OR_POP)
+        self.emit(node.children[-1], code)
+        code.code[to_end] = len(code.code)
+
+    def emit_binary(self, node, code):
+        self.emit(node.children[0], code)
+        self.emit(node.children[2], code)
+        op = node.children[1].value
+        if op in ENV_OPERATORS:
+            code.emit(BINARY_ENV, ENV_OPERATORS.index(op))
+        else:
+            code.emit(BINARY, PY_OPERATORS.index(op))
+
+    emit_additive_exp = emit_binary
+    emit_mult_exp = emit_binary
+    emit_bitwise_exp = emit_binary
+    emit_equality_exp = emit_binary
+    emit_relational_exp = emit_binary
+    emit_shift_expression = emit_binary
+    emit_power_exp = emit_binary
+
+    def emit_unary_exp(self, node, code):
+        self.emit(node.children[1], code)
+        code.emit(UNARY, UN_OPERATORS.index(node.children[0].value))
+
+
+class Interpreter:
+    """基于栈的字节码解释器"""
+
+    def __init__(self, vm):
+        self.vm = vm
+        self.dispatch_lookups = [DISPATCH[op].get for op in ENV_OPERATORS]
+        self.py_operators = [BINARY_OPERATORS[op] for op in PY_OPERATORS]
+        self.un_operators = [UNARY_OPERATORS[op] for op in UN_OPERATORS]
+
+    def make_function(self, code, env):
+        run = self.run
+
+        def body(env, args):
+            return run(code, Env(env, dict(zip(code.params, args))))
+        if self.vm.profiler is not None:
+            body = self.vm.profiler.wrap_function(code.name, body)
+        if self.vm.budget is not None:
+            body = self.vm.budget.wrap_function(body)
+
+        free = None
+        if code.freevars:
+            def free(env):
+                return tuple(env.lookup(name)[1] for name in code.freevars)
+        return FuncDef(code.params, body, env, free=free, source=('bytecode', code, code.freevars))
+
+    def run(self, code_object, env):
+        code = code_object.code
+        consts = code_object.consts
+        names = code_object.names
+        call = self.vm.handle_function_call
+        dispatch_lookups = self.dispatch_lookups
+        dispatch = self.vm.operators.dispatch
+        py_operators = self.py_operators
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        while True:
+            op = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+            if op == LOAD_NAME:
+                exists, value = env.lookup(names[arg])
+                if not exists:
+                    raise NameError(f"Variable '{names[arg]}' not defined in the environment.")
+                push(value)
+            elif op == LOAD_CONST:
+                push(consts[arg])
+            elif op == BINARY_ENV:
+                right = pop()
+                left = stack[-1]
+                fn = dispatch_lookups[arg]((type(left), type(right)))
+                if fn is not None:
+                    stack[-1] = fn(left, right)
+                else:
+                    stack[-1] = dispatch(ENV_OPERATORS[arg], left, right, env)
+            elif op == BINARY:
+                right = pop()
+                stack[-1] = py_operators[arg](stack[-1], right)
+            elif op == CALL:
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = []
+                stack[-1] = call(stack[-1], args, env)
+            elif op == TAIL_CALL:
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = []
+                func = pop()
+                if type(func) is FuncDef:
+                    return FuncCall(func, args)
+                return call(func, args, env)
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == RETURN:
+                return pop()
+            elif op == POP:
+                discard(pop())  # 只用于丢弃表达式语句的值
+            elif op == GET_ITEM:
+                index = pop()
+                stack[-1] = stack[-1][index]
+            elif op == GET_ATTR:
+                obj = stack[-1]
+                stack[-1] = obj[names[arg]] if isinstance(obj, dict) else getattr(obj, names[arg])
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if not stack[-1]:
+                    pc = arg
+                else:
+                    pop()
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if stack[-1]:
+                    pc = arg
+                else:
+                    pop()
+            elif op == UNARY:
+                stack[-1] = self.un_operators[arg](stack[-1])
+            elif op == BUILD_LIST:
+                if arg:
+                    items = [plain(item) for item in stack[-arg:]]
+                    del stack[-arg:]
+                else:
+                    items = []
+                push(items)
+            elif op == BUILD_DICT:
+                record = consts[arg]
+                keys = record.fields
+                if keys:
+                    values = [plain(value) for value in stack[-len(keys):]]
+                    del stack[-len(keys):]
+                else:
+                    values = []
+                push(record(zip(keys, values)))
+            elif op == MAP:
+                lmd = pop()
+                stack[-1] = Pipeline.stage(stack[-1], False, lmd, call, env)
+            elif op == FILTER:
+                lmd = pop()
+                stack[-1] = Pipeline.stage(stack[-1], True, lmd, call, env)
+            elif op == MAKE_FUNCTION:
+                push(self.make_function(consts[arg], env))
+            elif op == MAKE_ASYNC_FUNCTION:
+                params, node, name = consts[arg]
+                push(self.vm.compiler.compile_detached(params, node, env, name, True))
+            elif op == STORE_LET:
+                name = names[arg]
+                if env.defines(name):
+                    raise Exception(f"Variable '{name}' is already defined")
+                env.set(name, pop())
+            elif op == STORE_DEF:
+                env.set(names[arg], pop())
+            elif op == STORE_NAME:
+                name = names[arg]
+                value = pop()
+                # 赋值给定义该变量的环境，而不是在当前函数中新建变量
+                if not env.assign(name, value):
+                    raise Exception(f"Variable '{name}' is not defined")
+            elif op == SET_ITEM:
+                index = pop()
+                array = pop()
+                array[plain(index)] = plain(pop())
+            elif op == SET_ATTR:
+                obj = pop()
+                obj[names[arg]] = plain(pop())
+            elif op == UNPACK_LET:
+                names_ = consts[arg]
+                value = materialize(pop())
+                if not isinstance(value, list):
+                    raise TypeError(f"Expected list, got {type(value).__name__}")
+                if len(names_) != len(value):  # 检测数组长度是否匹配
+                    raise ValueError(f"Number of names ({len(names_)}) does not match number of values ({len(value)})")
+                for name, item in zip(names_, value):
+                    if env.defines(name):
+                        raise Exception(f"Variable '{name}' is already defined")
+                    env.set(name, item)
+            elif op == IMPORT:
+                self.vm.import_module(names[arg], env)
+            elif op == IMPORT_STAR:
+                self.vm.import_module(names[arg], env, True)
+            else:
+                raise RuntimeError(f"Unknown opcode {op}")
@@ -0,0 +1,85 @@
+"""
+磁盘缓存：LALR 解析表和 .loo 源文件的解析结果。
+
+解析结果保存在源文件旁的 ``__loongcache__/<name>.looc`` 中，以源码、语法
+和 lark 版本的 SHA-256 作为键，任何一项变化都会使缓存失效。
+"""
+import hashlib
+import os
+import pickle
+import threading
+
+import lark
+
+CACHE_DIR = '__loongcache__'
+CACHE_VERSION = 1
+
+
+def cache_dir_for(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+
+
+def grammar_cache(grammar_file, start='start'):
+    """返回 Lark(cache=...) 使用的解析表缓存路径，目录不可写时退回到临时目录"""
+    directory = cache_dir_for(grammar_file)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return True
+    if not os.access(directory, os.W_OK):
+        return True
+    # 不同起始符号的解析表不同，各用一个文件
+    suffix = '.lark' if start == 'start' else f'.{start}.lark'
+    return os.path.join(directory, os.path.basename(grammar_file) + suffix)
+
+
+class ParseCache:
+    """
+    以内容哈希为键的解析结果缓存。
+
+    :param grammar: 语法文本，参与缓存键的计算。
+    """
+
+    def __init__(self, grammar):
+        self.salt = f"{CACHE_VERSION}:{lark.__version__}:{hashlib.sha256(grammar.encode('utf-8')).hexdigest()}:"
+
+    def key(self, code):
+        return hashlib.sha256((self.salt + code).encode('utf-8')).hexdigest()
+
+    def path(self, filename):
+        return os.path.join(cache_dir_for(filename), os.path.basename(filename) + 'c')
+
+    def load(self, filename, key):
+        """返回缓存的语法树；缓存不存在、损坏或已过期时返回 None"""
+        try:
+            with open(self.path(filename), 'rb') as f:
+                cached_key, tree = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError, ValueError, TypeError, AttributeError):
+            return None
+        if cached_key != key:
+            return None
+        return tree
+
+    def save(self, filename, key, tree):
+        path = self.path(filename)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                pickle.dump((key, tree), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)  # 原子替换，避免并发读到写了一半的文件
+        except OSError:
+            # 缓存只是加速手段，写不进去就算了
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def parse(self, parser, filename, code):
+        """解析源码，命中缓存时直接返回缓存的语法树"""
+        key = self.key(code)
+        tree = self.load(filename, key)
+        if tree is None:
+            tree = parser.parse(code)
+            self.save(filename, key, tree)
+        return tree
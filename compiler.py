@@ -0,0 +1,649 @@
+from lark.lexer import Token
+from lark.tree import Tree
+
+from coroutines import AsyncCompiler
+from inlinecache import GETATTR, ITEM, MethodCache
+from loongast import Cell, FuncCall, FuncDef
+from operators import DISPATCH, PY_OPERATORS, UNARY_OPERATORS
+from pipeline import Pipeline, discard, materialize
+from profiler import lambda_name
+from records import record_type
+from rope import plain, plain_args
+import vectorize
+from resolver import STATEMENT_NODES, UNDEFINED, FunctionScope, GlobalScope, resolve, star_modules
+
+
+def _none(env):
+    return None
+
+
+def _global_env(env):
+    """函数栈帧 ``[closure, ...]`` 中的全局 Env"""
+    return env[0][0]
+
+
+class Compiler:
+    """
+    闭包编译器：把 Lark 语法树一次性编译为嵌套的 Python 闭包。
+
+    每个节点被编译为 ``fn(env) -> value`` 形式的函数，执行时不再需要
+    逐个比较 ``node.data``。顶层代码的 env 是全局 Env，函数体的 env 是
+    resolver 描述的列表栈帧 ``[closure, 参数..., 局部变量...]``，名字在编译期
+    解析为栈帧下标、Cell 或闭包中的下标。
+    """
+
+    def __init__(self, vm):
+        self.vm = vm
+        self.scope = None
+        self.async_compiler = AsyncCompiler(self)
+
+    def compile_program(self, node, env, is_async=False, dynamic=False):
+        """
+        编译顶层语句块，env 是执行时使用的全局环境。
+
+        is_async 为 True 时顶层可以使用 await，编译结果返回协程；dynamic 为 True 时
+        无法静态确定的全局名字推迟到运行时报错。
+        """
+        self.scope = GlobalScope(env, node, dynamic)
+        try:
+            if is_async:
+                return self.async_compiler.compile_body(node)
+            return self.compile(node)
+        finally:
+            self.scope = None
+
+    def compile(self, node):
+        if node is None:
+            return _none
+        if isinstance(node, Tree):
+            method = getattr(self, f"compile_{node.data}", None)
+            if method is None:
+                raise SyntaxError(f"Unsupported syntax node '{node.data}'")
+            return self.profiled(node.data, method(node))
+        if isinstance(node, Token):
+            method = getattr(self, f"compile_{node.type}", None)
+            if method is None:
+                raise SyntaxError(f"Unsupported token '{node.type}'")
+            return self.profiled(node.type, method(node))
+        raise TypeError(f"Cannot compile {type(node).__name__}")
+
+    def profiled(self, kind, fn):
+        """开启性能分析时为节点闭包加上计时"""
+        profiler = self.vm.profiler
+        return fn if profiler is None else profiler.wrap_node(kind, fn)
+
+    def compile_tail(self, node):
+        """
+        编译处于尾位置的节点。
+
+        尾位置上对 Loong 函数的调用不会立即执行，而是返回 FuncCall，
+        由 handle_function_call 的蹦床循环在同一个 Python 栈帧中继续执行。
+        """
+        if isinstance(node, Tree):
+            method = getattr(self, f"tail_{node.data}", None)
+            if method is not None:
+                return self.profiled(node.data, method(node))
+        return self.compile(node)
+
+    def compile_params(self, node):
+        # 空参数列表会被 lark 解析为 [None]
+        return [param.value for param in node.children if param is not None]
+
+    def compile_function(self, params, node, name="<lambda>", is_async=False):
+        """
+        在新的函数作用域中编译函数体。name 用于性能分析。
+        async 函数的函数体返回协程，不做尾调用、向量化和性能分析，也不能序列化。
+
+        :return: ``make(env)``，在定义函数的环境 env 中创建 FuncDef。
+        """
+        scope = FunctionScope(self.scope, params, node)
+        self.scope = scope
+        try:
+            if is_async:
+                stmts = self.async_compiler.compile_body(node)
+                vector = None
+            else:
+                stmts = self.compile_tail(node)
+                vector = vectorize.plan(node, params[0], self) if len(params) == 1 else None
+            free_names = tuple(sorted(scope.free))
+            free = self.compile_free(free_names)
+        finally:
+            self.scope = scope.parent
+        # 在其他进程中重建函数所需的信息，见 parallel.py
+        source = None if is_async else ('closure', params, node, free_names)
+        padding = [UNDEFINED] * scope.nlocals
+        cells = scope.cells
+        if cells:
+            def body(closure, args):
+                frame = [closure, *args, *padding]
+                for slot in cells:
+                    frame[slot] = Cell(frame[slot])
+                return stmts(frame)
+        elif padding:
+            def body(closure, args):
+                return stmts([closure, *args, *padding])
+        else:
+            def body(closure, args):
+                return stmts([closure, *args])
+        if self.vm.profiler is not None and not is_async:
+            body = self.vm.profiler.wrap_function(name, body)
+        if self.vm.budget is not None:
+            body = self.vm.budget.wrap_function(body)
+
+        # 闭包只保存函数体引用的外层局部变量的 Cell，不引用定义函数的整个栈帧
+        if self.is_global():
+            def make(env):
+                return FuncDef(params, body, (env,), vector, free, source)
+            return make
+        cell_fns = [self.compile_cell(name) for name in scope.captures]
+
+        def make(env):
+            return FuncDef(params, body, (env[0][0], *[cell(env) for cell in cell_fns]), vector, free, source)
+        return make
+
+    def compile_detached(self, params, node, env, name="<lambda>", is_async=False):
+        """在只有全局环境 env 的作用域中编译并创建函数，外层变量都按名字在 env 中查找"""
+        with self.vm.compile_lock:  # 在执行期间调用，可能与其他线程的编译同时发生
+            self.scope = GlobalScope(env, None, dynamic=True)
+            try:
+                return self.compile_function(params, node, name, is_async)(env)
+            finally:
+                self.scope = None
+
+    def compile_free(self, names):
+        """
+        在函数自己的作用域中编译读取 names 的函数，names 为空时返回 None。
+
+        :return: ``free(closure)``，closure 是 FuncDef.env。
+        """
+        if not names:
+            return None
+        loads = [self.compile_load(name) for name in names]
+
+        def free(closure):
+            frame = [closure]
+            return tuple(load(frame) for load in loads)
+        return free
+
+    def compile_cell(self, name):
+        """在定义内层函数的作用域中编译读取 name 的 Cell 的函数"""
+        depth, slot, _ = resolve(self.scope, name)
+        if depth == 0:
+            return lambda env: env[slot]
+        index = self.scope.captures[name]
+        return lambda env: env[0][index]
+
+    def is_global(self):
+        return not isinstance(self.scope, FunctionScope)
+
+    def compile_load(self, name):
+        depth, slot, scope = resolve(self.scope, name)
+        if slot is None:
+            def lookup(global_env):
+                exists, value = global_env.lookup(name)
+                if not exists:
+                    raise NameError(f"Variable '{name}' not defined in the environment.")
+                return value
+
+            # 全局名字（包括用过一次的星号导入的名字）通常就在全局 Env 这一层，先直接查字典
+            if self.is_global():
+                def load_global(env):
+                    variables = env.variables
+                    return variables[name] if name in variables else lookup(env)
+                return load_global
+
+            def load_global_from_function(env):
+                global_env = env[0][0]
+                variables = global_env.variables
+                return variables[name] if name in variables else lookup(global_env)
+
+            stars = star_modules(self.scope)
+            if not stars:
+                return load_global_from_function
+            lookup_star = self.vm.lookup_star
+
+            def load_star(env):
+                exists, value = lookup_star(stars, name)
+                return value if exists else load_global_from_function(env)
+            return load_star
+        if depth == 0 and slot not in self.scope.cells:
+            if slot <= scope.nparams:  # 参数一定已经赋值
+                return lambda env: env[slot]
+
+            def load_local(env):
+                value = env[slot]
+                if value is UNDEFINED:
+                    raise NameError(f"Variable '{name}' is used before its definition.")
+                return value
+            return load_local
+        if depth == 0:
+            get_cell = lambda env: env[slot]
+        else:
+            index = self.scope.captures[name]
+            get_cell = lambda env: env[0][index]
+        if slot <= scope.nparams:
+            return lambda env: get_cell(env).value
+
+        def load_cell(env):
+            value = get_cell(env).value
+            if value is UNDEFINED:
+                raise NameError(f"Variable '{name}' is used before its definition.")
+            return value
+        return load_cell
+
+    def compile_store(self, name):
+        """返回 ``store(env, value)``，赋值给已定义的名字"""
+        try:
+            depth, slot, _ = resolve(self.scope, name)
+        except NameError:
+            raise Exception(f"Variable '{name}' is not defined")
+        if slot is None:
+            get_env = (lambda env: env) if self.is_global() else _global_env
+
+            def store_global(env, value):
+                global_env = get_env(env)
+                exists, _ = global_env.lookup(name)
+                if not exists:
+                    raise Exception(f"Variable '{name}' is not defined")
+                global_env.set(name, value)
+            return store_global
+        if depth == 0 and slot not in self.scope.cells:
+            def store_local(env, value):
+                env[slot] = value
+            return store_local
+        get_cell = self.compile_cell(name)
+
+        def store_cell(env, value):
+            get_cell(env).value = value
+        return store_cell
+
+    def compile_define(self, name):
+        """返回 ``define(env, value)``，在当前作用域中绑定 let/def 声明的名字"""
+        if self.is_global():
+            def define_global(env, value):
+                env.set(name, value)
+            return define_global
+        slot = self.scope.slots[name]
+        if slot in self.scope.cells:
+            def define_cell(env, value):
+                env[slot].value = value
+            return define_cell
+
+        def define_local(env, value):
+            env[slot] = value
+        return define_local
+
+    # 语句
+
+    def compile_statements(self, node, compile_last=None):
+        stmts = [self.compile_statement(child) for child in node.children[:-1]]
+        stmts.append((compile_last or self.compile)(node.children[-1]))
+        if len(stmts) == 1:
+            return stmts[0]
+        init, last = stmts[:-1], stmts[-1]
+
+        def statements(env):
+            for stmt in init:
+                stmt(env)
+            return last(env)
+        return statements
+
+    def compile_statement(self, node):
+        """编译不是最后一项的语句；表达式语句的值被丢弃，其中的 Pipeline 在这里执行"""
+        fn = self.compile(node)
+        if isinstance(node, Tree) and node.data in STATEMENT_NODES:
+            return fn
+
+        def expr_stmt(env):
+            discard(fn(env))
+        return expr_stmt
+
+    def tail_statements(self, node):
+        return self.compile_statements(node, self.compile_tail)
+
+    def compile_import_stmt(self, node):
+        module_name = node.children[0].value
+        # 如果存在第二个，且为 *
+        import_all_names = (len(node.children) > 1 and node.children[1] is not None
+                            and node.children[1].value == '*')
+        vm = self.vm
+        if not self.is_global():
+            # 名字的查找方式已经由 resolver 确定，这里只需加载模块
+            define = None if import_all_names else self.compile_define(module_name)
+
+            def import_local(env):
+                module = vm.require_module(module_name)
+                if define is not None:
+                    define(env, module)
+            return import_local
+
+        def import_stmt(env):
+            vm.import_module(module_name, env, import_all_names)
+        return import_stmt
+
+    def compile_let_stmt(self, node):
+        target = node.children[0].value
+        value_fn = self.compile(node.children[1])
+        if not self.is_global():
+            # 函数内的重复定义已经在 resolver 中检查过
+            define = self.compile_define(target)
+
+            def let_local(env):
+                define(env, value_fn(env))
+            return let_local
+
+        def let_stmt(env):
+            value = value_fn(env)
+            if env.defines(target):
+                raise Exception(f"Variable '{target}' is already defined")
+            env.set(target, value)
+        return let_stmt
+
+    def compile_let_multi_stmt(self, node):
+        value_fn = self.compile(node.children[-1])
+        unpack = self.compile_unpack([name.value for name in node.children[:-1]])
+
+        def let_multi_stmt(env):
+            unpack(env, value_fn(env))
+        return let_multi_stmt
+
+    def compile_unpack(self, names):
+        """返回 ``unpack(env, value)``：把列表 value 的元素依次定义为 names，let_multi_stmt 使用"""
+        is_global = self.is_global()
+        defines = None if is_global else [self.compile_define(name) for name in names]
+
+        def unpack(env, value):
+            value = materialize(value)
+            if not isinstance(value, list):
+                raise TypeError(f"Expected list, got {type(value).__name__}")
+            if len(names) != len(value):  # 检测数组长度是否匹配
+                raise ValueError(f"Number of names ({len(names)}) does not match number of values ({len(value)})")
+            if not is_global:
+                for define, item in zip(defines, value):
+                    define(env, item)
+                return
+            for name, item in zip(names, value):
+                if env.defines(name):
+                    raise Exception(f"Variable '{name}' is already defined")
+                env.set(name, item)
+        return unpack
+
+    def compile_assign_stmt(self, node):
+        target = node.children[0]
+        value_fn = self.compile(node.children[1])
+        if isinstance(target, Token):  # name
+            name = target.value
+            store = self.compile_store(name)
+
+            def assign_name(env):
+                value = value_fn(env)
+                store(env, value)
+            return assign_name
+        if target.data == 'array_access':
+            array_fn = self.compile(target.children[0])
+            index_fn = self.compile(target.children[1])
+
+            def assign_item(env):
+                value = value_fn(env)
+                array_fn(env)[plain(index_fn(env))] = plain(value)
+            return assign_item
+        if target.data == 'prop_access':
+            obj_fn = self.compile(target.children[0])
+            prop = target.children[1].value
+
+            def assign_prop(env):
+                value = value_fn(env)
+                obj_fn(env)[prop] = plain(value)
+            return assign_prop
+        raise SyntaxError(f"Cannot assign to '{target.data}'")
+
+    def compile_func_def(self, node, is_async=False):
+        name = node.children[0].value
+        params = self.compile_params(node.children[1])
+        define = self.compile_define(name)
+        make = self.compile_function(params, node.children[2], name, is_async)
+
+        def func_def(env):
+            define(env, make(env))
+        return func_def
+
+    def compile_async_func_def(self, node):
+        return self.compile_func_def(node, True)
+
+    # 表达式
+
+    def compile_func_expr(self, node, is_async=False):
+        params = self.compile_params(node.children[0])
+        return self.compile_function(params, node.children[1], lambda_name(node), is_async)
+
+    def compile_short_func_expr(self, node, is_async=False):
+        params = [node.children[0].value]
+        return self.compile_function(params, node.children[1], lambda_name(node), is_async)
+
+    def compile_async_func_expr(self, node):
+        return self.compile_func_expr(node, True)
+
+    def compile_async_short_func_expr(self, node):
+        return self.compile_short_func_expr(node, True)
+
+    def compile_await_exp(self, node):
+        # async 函数体和顶层中的 await 由 AsyncCompiler 编译，到达这里说明在普通函数中
+        raise SyntaxError("'await' outside async function")
+
+    def compile_func_call(self, node, tail=False):
+        """
+        调用点按被调用者的类型缓存它是否是原生函数：原生函数直接调用，不经过
+        handle_function_call；Loong 函数交给蹦床，尾位置上返回 FuncCall。
+        """
+        callee = node.children[0]
+        arg_fns = [self.compile(arg) for arg in node.children[1].children if arg is not None]
+        call = self.vm.handle_function_call
+        if isinstance(callee, Tree) and callee.data == 'prop_access':
+            return self.compile_method_call(callee, arg_fns, tail)
+        func_fn = self.compile(callee)
+        native_type = None  # 上一次调用的原生函数的类型
+
+        def func_call(env):
+            nonlocal native_type
+            func = func_fn(env)
+            args = [arg(env) for arg in arg_fns]
+            if type(func) is native_type:
+                return func(*plain_args(args))
+            if type(func) is FuncDef:
+                return FuncCall(func, args) if tail else call(func, args, env)
+            if callable(func):
+                native_type = type(func)
+                return func(*plain_args(args))
+            return call(func, args, env)  # 由 handle_function_call 报告错误
+        return func_call
+
+    def tail_func_call(self, node):
+        return self.compile_func_call(node, True)
+
+    def compile_method_call(self, callee, arg_fns, tail):
+        """``obj.name(args)``：按接收者的类型在调用点的 MethodCache 中缓存取方法的方式"""
+        obj_fn = self.compile(callee.children[0])
+        name = callee.children[1].value
+        site = MethodCache(name)
+        entries, lookup = site.entries, site.lookup
+        call = self.vm.handle_function_call
+
+        def method_call(env):
+            obj = obj_fn(env)
+            args = [arg(env) for arg in arg_fns]
+            kind = entries.get(type(obj)) or lookup(type(obj))
+            if kind is ITEM:
+                func = obj[name]
+            elif kind is GETATTR:
+                func = getattr(obj, name)
+            else:  # 内置类型的方法描述符
+                return kind(obj, *plain_args(args))
+            if type(func) is FuncDef:
+                return FuncCall(func, args) if tail else call(func, args, env)
+            if callable(func):
+                return func(*plain_args(args))
+            return call(func, args, env)
+        return method_call
+
+    def compile_array_access(self, node):
+        array_fn = self.compile(node.children[0])
+        index_fn = self.compile(node.children[1])
+
+        def array_access(env):
+            return array_fn(env)[index_fn(env)]
+        return array_access
+
+    def compile_prop_access(self, node):
+        obj_fn = self.compile(node.children[0])
+        prop = node.children[1].value
+        shape = None  # 上一次遇到的字典类型，与 inlinecache.field_getter 相同，内联以省去一次调用
+
+        def prop_access(env):
+            nonlocal shape
+            obj = obj_fn(env)
+            if type(obj) is shape:
+                return obj[prop]
+            if isinstance(obj, dict):
+                shape = type(obj)
+                return obj[prop]
+            return getattr(obj, prop)
+        return prop_access
+
+    def compile_list(self, node):
+        item_fns = [self.compile(item) for item in node.children if item is not None]
+
+        def list_(env):
+            return [plain(item(env)) for item in item_fns]
+        return list_
+
+    def compile_dict(self, node):
+        pairs = [(pair.children[0].value, self.compile(pair.children[1]))
+                 for pair in node.children if pair is not None]
+        new_record = record_type(tuple(key for key, _ in pairs))
+
+        def dict_(env):
+            record = new_record()
+            for key, value_fn in pairs:
+                record[key] = plain(value_fn(env))
+            return record
+        return dict_
+
+    def compile_const_list(self, node):
+        items = node.children[0]
+
+        def const_list(env):
+            return list(items)  # 每次求值返回新的列表
+        return const_list
+
+    def compile_const_dict(self, node):
+        pairs = node.children[0]
+        record = record_type(tuple(key for key, _ in pairs))
+
+        def const_dict(env):
+            return record(pairs)
+        return const_dict
+
+    def compile_map_expr(self, node):
+        lst_fn = self.compile(node.children[0])
+        is_filter = node.children[1].type == 'FILTER'
+        lmd_fn = self.compile(node.children[2])
+        call = self.vm.handle_function_call
+        stage = Pipeline.stage
+
+        def map_expr(env):
+            return stage(lst_fn(env), is_filter, lmd_fn(env), call, env)
+        return map_expr
+
+    def compile_conditional_exp(self, node, compile_branch=None):
+        compile_branch = compile_branch or self.compile
+        cond_fn = self.compile(node.children[0])
+        then_fn = compile_branch(node.children[1])
+        else_fn = compile_branch(node.children[2])
+
+        def conditional_exp(env):
+            return then_fn(env) if cond_fn(env) else else_fn(env)
+        return conditional_exp
+
+    def tail_conditional_exp(self, node):
+        return self.compile_conditional_exp(node, self.compile_tail)
+
+    def compile_binary(self, node):
+        left_fn = self.compile(node.children[0])
+        op = node.children[1].value  # 操作符在第二个子节点
+        right_fn = self.compile(node.children[2])
+        if op in PY_OPERATORS:
+            py_op = PY_OPERATORS[op]
+
+            def binary(env):
+                return py_op(left_fn(env), right_fn(env))
+            return binary
+        # 按操作数类型对查找缓存的实现，未命中时走 Operators.dispatch
+        lookup = DISPATCH[op].get
+        dispatch = self.vm.operators.dispatch
+
+        def binary_env(env):
+            left = left_fn(env)
+            right = right_fn(env)
+            fn = lookup((type(left), type(right)))
+            if fn is not None:
+                return fn(left, right)
+            return dispatch(op, left, right, env)
+        return binary_env
+
+    compile_additive_exp = compile_binary
+    compile_mult_exp = compile_binary
+    compile_bitwise_exp = compile_binary
+    compile_equality_exp = compile_binary
+    compile_relational_exp = compile_binary
+    compile_shift_expression = compile_binary
+    compile_power_exp = compile_binary
+
+    def compile_logical_or_exp(self, node, compile_right=None):
+        left_fn = self.compile(node.children[0])
+        right_fn = (compile_right or self.compile)(node.children[-1])
+
+        def logical_or_exp(env):
+            return left_fn(env) or right_fn(env)
+        return logical_or_exp
+
+    def tail_logical_or_exp(self, node):
+        return self.compile_logical_or_exp(node, self.compile_tail)
+
+    def compile_logical_and_exp(self, node, compile_right=None):
+        left_fn = self.compile(node.children[0])
+        right_fn = (compile_right or self.compile)(node.children[-1])
+
+        def logical_and_exp(env):
+            return left_fn(env) and right_fn(env)
+        return logical_and_exp
+
+    def tail_logical_and_exp(self, node):
+        return self.compile_logical_and_exp(node, self.compile_tail)
+
+    def compile_unary_exp(self, node):
+        op = UNARY_OPERATORS[node.children[0].value]  # 操作符在第一个子节点
+        operand_fn = self.compile(node.children[1])
+
+        def unary_exp(env):
+            return op(operand_fn(env))
+        return unary_exp
+
+    def compile_literal(self, node):
+        value = node.children[0]
+        return lambda env: value
+
+    # 词法单元
+
+    def compile_NUMBER(self, token):
+        if '.' in token.value or 'e' in token.value or 'E' in token.value:
+            value = float(token.value)
+        else:
+            value = int(token.value)
+        return lambda env: value
+
+    def compile_STRING(self, token):
+        value = token.value[1:-1]
+        return lambda env: value
+
+    def compile_NAME(self, token):
+        return self.compile_load(token.value)
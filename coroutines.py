@@ -0,0 +1,277 @@
+"""
+async 函数与 await 表达式。
+
+闭包编译器把函数体编译为普通函数 ``fn(env)``，无法在中途挂起。async 函数体中
+包含 await 的节点改由 AsyncCompiler 编译为生成器函数 ``gen(env)``：子节点的值用
+``yield from`` 求出，``await x`` 变为 ``yield from x.__await__()``，把 asyncio 的
+Future 一路交给事件循环，完成后再从挂起处继续。不包含 await 的子节点仍由
+Compiler 编译为普通闭包，只有通往 await 的路径上有生成器的开销。
+
+调用 async 函数返回一个 Python 协程，可以被 await，也可以交给 ``gather`` 或
+``asyncio.create_task`` 等任何接受协程的 API。包含顶层 await 的程序由
+``VirtualMachine.eval`` 通过 ``asyncio.run`` 执行。
+"""
+import asyncio
+import inspect
+import types
+
+from lark.tree import Tree
+
+from operators import PY_OPERATORS, UNARY_OPERATORS
+from pipeline import Pipeline, discard
+from records import record_type
+from resolver import FUNCTION_NODES
+from rope import plain
+
+
+def has_await(node):
+    """node 中（不包括嵌套的函数体）是否有 await"""
+    if not isinstance(node, Tree):
+        return False
+    if node.data == 'await_exp':
+        return True
+    if node.data in FUNCTION_NODES:  # 函数体中的 await 属于该函数本身，不属于外层
+        return False
+    return any(has_await(child) for child in node.children)
+
+
+def _awaitable(value):
+    try:
+        method = type(value).__await__
+    except AttributeError:
+        raise TypeError(f"object {type(value).__name__} can't be used in 'await' expression") from None
+    return method(value)
+
+
+def _sync(fn):
+    """把普通闭包包装为生成器函数"""
+    def sync(env):
+        return fn(env)
+        yield
+    return sync
+
+
+async def gather(*aws):
+    """
+    并发等待多个协程或 Future，按参数顺序返回结果列表。
+
+    只有一个参数且它不可等待时，把它当作可迭代对象，例如 ``gather(urls |> fetch)``。
+    """
+    if len(aws) == 1 and not inspect.isawaitable(aws[0]):
+        # 解包未物化的 Pipeline 时 Python 会先迭代再取长度，导致函数被调用两次
+        aws = aws[0].force() if isinstance(aws[0], Pipeline) else aws[0]
+    return list(await asyncio.gather(*aws))
+
+
+class AsyncCompiler:
+    """
+    把包含 await 的节点编译为生成器函数，与 Compiler 共用作用域。
+
+    :param compiler: 所属的 Compiler，不包含 await 的节点交给它编译。
+    """
+
+    def __init__(self, compiler):
+        self.compiler = compiler
+
+    def compile_body(self, node):
+        """编译 async 函数体或顶层语句块，返回 ``run(env)``，调用后得到协程"""
+        gen = types.coroutine(self.compile(node))
+
+        async def run(env):
+            return await gen(env)
+        return run
+
+    def compile(self, node):
+        """返回生成器函数；不包含 await 的节点也包装为生成器函数"""
+        if not has_await(node):
+            return _sync(self.compiler.compile(node))
+        method = getattr(self, f"compile_{node.data}", None)
+        if method is None:
+            raise SyntaxError(f"'await' is not supported inside '{node.data}'")
+        return method(node)
+
+    def split(self, node):
+        """返回 (fn, is_async)：包含 await 的节点编译为生成器函数，其余编译为普通闭包"""
+        if has_await(node):
+            return self.compile(node), True
+        return self.compiler.compile(node), False
+
+    def compile_values(self, nodes):
+        """返回生成器函数，从左到右求值 nodes，得到值的列表"""
+        parts = [self.split(node) for node in nodes]
+
+        def values(env):
+            result = []
+            for fn, is_async in parts:
+                result.append((yield from fn(env)) if is_async else fn(env))
+            return result
+        return values
+
+    def compile_combine(self, nodes, combine):
+        """求值 nodes 后调用 ``combine(env, values)``"""
+        values_gen = self.compile_values(nodes)
+
+        def combined(env):
+            return combine(env, (yield from values_gen(env)))
+        return combined
+
+    # 语句
+
+    def compile_statements(self, node):
+        stmts = [self.split(child) for child in node.children]
+
+        def statements(env):
+            value = None
+            for fn, is_async in stmts:
+                discard(value)  # 之前的表达式语句的值被丢弃
+                value = (yield from fn(env)) if is_async else fn(env)
+            return value
+        return statements
+
+    def compile_let_stmt(self, node):
+        target = node.children[0].value
+        value_gen = self.compile(node.children[1])
+        if not self.compiler.is_global():
+            define = self.compiler.compile_define(target)
+
+            def let_local(env):
+                define(env, (yield from value_gen(env)))
+            return let_local
+
+        def let_stmt(env):
+            value = yield from value_gen(env)
+            if env.defines(target):
+                raise Exception(f"Variable '{target}' is already defined")
+            env.set(target, value)
+        return let_stmt
+
+    def compile_let_multi_stmt(self, node):
+        value_gen = self.compile(node.children[-1])
+        unpack = self.compiler.compile_unpack([name.value for name in node.children[:-1]])
+
+        def let_multi_stmt(env):
+            unpack(env, (yield from value_gen(env)))
+        return let_multi_stmt
+
+    def compile_assign_stmt(self, node):
+        target = node.children[0]
+        if not isinstance(target, Tree):  # name
+            store = self.compiler.compile_store(target.value)
+            value_gen = self.compile(node.children[1])
+
+            def assign(env):
+                store(env, (yield from value_gen(env)))
+            return assign
+        if target.data == 'array_access':
+            def assign_item(env, values):
+                value, array, index = values
+                array[plain(index)] = plain(value)
+            return self.compile_combine([node.children[1], *target.children], assign_item)
+        if target.data == 'prop_access':
+            prop = target.children[1].value
+
+            def assign_prop(env, values):
+                value, obj = values
+                obj[prop] = plain(value)
+            return self.compile_combine([node.children[1], target.children[0]], assign_prop)
+        raise SyntaxError(f"Cannot assign to '{target.data}'")
+
+    # 表达式
+
+    def compile_await_exp(self, node):
+        operand, is_async = self.split(node.children[0])
+
+        def await_exp(env):
+            value = (yield from operand(env)) if is_async else operand(env)
+            return (yield from _awaitable(value))
+        return await_exp
+
+    def compile_func_call(self, node):
+        call = self.compiler.vm.handle_function_call
+
+        def func_call(env, values):
+            return call(values[0], values[1:], env)
+        args = [arg for arg in node.children[1].children if arg is not None]
+        return self.compile_combine([node.children[0], *args], func_call)
+
+    def compile_array_access(self, node):
+        return self.compile_combine(node.children, lambda env, values: values[0][values[1]])
+
+    def compile_prop_access(self, node):
+        prop = node.children[1].value
+
+        def prop_access(env, values):
+            obj = values[0]
+            if isinstance(obj, dict):
+                return obj[prop]
+            return getattr(obj, prop)
+        return self.compile_combine(node.children[:1], prop_access)
+
+    def compile_list(self, node):
+        return self.compile_combine([item for item in node.children if item is not None],
+                                    lambda env, values: [plain(value) for value in values])
+
+    def compile_dict(self, node):
+        pairs = [pair for pair in node.children if pair is not None]
+        keys = tuple(pair.children[0].value for pair in pairs)
+        record = record_type(keys)
+        return self.compile_combine([pair.children[1] for pair in pairs],
+                                    lambda env, values: record(zip(keys, map(plain, values))))
+
+    def compile_map_expr(self, node):
+        is_filter = node.children[1].type == 'FILTER'
+        call = self.compiler.vm.handle_function_call
+
+        def map_expr(env, values):
+            return Pipeline.stage(values[0], is_filter, values[1], call, env)
+        return self.compile_combine([node.children[0], node.children[2]], map_expr)
+
+    def compile_binary(self, node):
+        op = node.children[1].value
+        if op in PY_OPERATORS:
+            py_op = PY_OPERATORS[op]
+            return self.compile_combine([node.children[0], node.children[2]],
+                                        lambda env, values: py_op(*values))
+        apply = self.compiler.vm.operators.apply
+        return self.compile_combine([node.children[0], node.children[2]],
+                                    lambda env, values: apply(op, *values, env))
+
+    compile_additive_exp = compile_binary
+    compile_mult_exp = compile_binary
+    compile_bitwise_exp = compile_binary
+    compile_equality_exp = compile_binary
+    compile_relational_exp = compile_binary
+    compile_shift_expression = compile_binary
+    compile_power_exp = compile_binary
+
+    def compile_unary_exp(self, node):
+        op = UNARY_OPERATORS[node.children[0].value]
+        return self.compile_combine(node.children[1:], lambda env, values: op(values[0]))
+
+    def compile_conditional_exp(self, node):
+        cond, cond_async = self.split(node.children[0])
+        then_gen = self.compile(node.children[1])
+        else_gen = self.compile(node.children[2])
+
+        def conditional_exp(env):
+            value = (yield from cond(env)) if cond_async else cond(env)
+            return (yield from (then_gen if value else else_gen)(env))
+        return conditional_exp
+
+    def compile_logical_or_exp(self, node):
+        left, left_async = self.split(node.children[0])
+        right_gen = self.compile(node.children[-1])
+
+        def logical_or_exp(env):
+            value = (yield from left(env)) if left_async else left(env)
+            return value or (yield from right_gen(env))
+        return logical_or_exp
+
+    def compile_logical_and_exp(self, node):
+        left, left_async = self.split(node.children[0])
+        right_gen = self.compile(node.children[-1])
+
+        def logical_and_exp(env):
+            value = (yield from left(env)) if left_async else left(env)
+            return value and (yield from right_gen(env))
+        return logical_and_exp
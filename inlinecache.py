@@ -0,0 +1,81 @@
+"""
+调用点的内联缓存。
+
+方法调用 ``obj.name(args)`` 在编译期为每个调用点创建一个 MethodCache，按接收者的
+类型缓存取得并调用方法的方式（最多 MAX_ENTRIES 种类型，更多时不再缓存新的类型）：
+
+- 字典（包括记录）：``obj[name]``，Loong 函数交给蹦床，原生函数直接调用；
+- 实例没有 ``__dict__`` 的内置类型（str、list、numpy 数组等）：缓存类上的方法描述符，
+  调用 ``descriptor(obj, *args)``，省去每次创建绑定方法；
+- 其他对象（模块、Python 类的实例等）：每次 ``getattr``，原生函数直接调用。
+
+属性访问 ``obj.name``（不调用）由 ``field_getter`` 记住上一次遇到的字典类型，即记录的
+shape（见 records.py），命中时直接取字典项，省去 isinstance 检查。
+
+只缓存取值的方式，不缓存取到的值。内置类型不能修改，其他类型的属性每次都重新
+查找，因此模块重新加载、属性重新赋值之后调用点总是看到新的值，不需要额外的失效检查。
+"""
+import types
+
+# 一个调用点最多缓存的接收者类型数
+MAX_ENTRIES = 4
+
+HEAPTYPE = 1 << 9  # Py_TPFLAGS_HEAPTYPE：用 class 语句等方式创建、可以修改的类型
+
+DESCRIPTORS = (types.MethodDescriptorType, types.WrapperDescriptorType)
+
+
+def static_method(cls, name):
+    """cls 是不能修改、实例没有 __dict__ 的类型时，返回类上的方法描述符，否则返回 None"""
+    if cls.__flags__ & HEAPTYPE or cls.__dictoffset__:
+        return None
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            attr = klass.__dict__[name]
+            return attr if isinstance(attr, DESCRIPTORS) else None
+    return None
+
+
+# 取方法的方式：字典用下标，其他对象用 getattr；内置类型的方法描述符直接保存在缓存中
+ITEM = 'item'
+GETATTR = 'getattr'
+
+
+class MethodCache:
+    """
+    方法调用点 ``obj.name(args)`` 的内联缓存。
+
+    ``entries`` 把接收者类型映射到 ITEM、GETATTR 或方法描述符，调用点先在其中查找，
+    未命中时调用 ``lookup``。执行调用的代码由各后端内联在调用点中。
+
+    :param name: 方法名。
+    """
+    __slots__ = ('name', 'entries')
+
+    def __init__(self, name):
+        self.name = name
+        self.entries = {}
+
+    def lookup(self, cls):
+        if issubclass(cls, dict):
+            kind = ITEM
+        else:
+            kind = static_method(cls, self.name) or GETATTR
+        if len(self.entries) < MAX_ENTRIES:  # 类型过多的调用点不再缓存新的类型
+            self.entries[cls] = kind
+        return kind
+
+
+def field_getter(name):
+    """属性访问点 ``obj.name`` 的 ``get(obj)``，缓存上一次遇到的字典类型"""
+    shape = None
+
+    def get(obj):
+        nonlocal shape
+        if type(obj) is shape:
+            return obj[name]
+        if isinstance(obj, dict):
+            shape = type(obj)
+            return obj[name]
+        return getattr(obj, name)
+    return get
@@ -1,412 +1,299 @@
 import builtins
-import argparse, os
+import argparse, asyncio, os, sys, threading
+import importlib.util
 from colorama import init
 from termcolor import colored
 from loongast import *
 from operators import Operators
+from compiler import Compiler
+from coroutines import has_await
+from bytecode import BytecodeCompiler, Interpreter
+from transpiler import Transpiler
+from cache import ParseCache, grammar_cache
+from loongbuiltins import make_builtins
+from optimizer import literal, optimize
+from streaming import parse_statement, split_statements
+from profiler import Profiler
+from budget import Budget
+from pipeline import materialize
+from rope import plain, plain_args
 
 from lark import Lark
-from lark.lexer import Token
 from lark.tree import Tree
 
 from pretty import pretty_var
 
-# Read the grammar from the external EBNF file
-with open('grammar.ebnf', 'r', encoding='utf-8') as f:
+# Read the grammar from the external EBNF file next to this module
+GRAMMAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grammar.ebnf')
+with open(GRAMMAR_FILE, 'r', encoding='utf-8') as f:
     grammar = f.read()
 
-# Create the Lark parser using the external grammar
-parser = Lark(grammar, start='start', parser='lalr')
+# Create the Lark parser using the external grammar; the LALR tables are cached on disk
+parser = Lark(grammar, start='start', parser='lalr', cache=grammar_cache(GRAMMAR_FILE))
+parse_cache = ParseCache(grammar)
+_statement_parser = None
 
-class Env:
-    def __init__(self, parent=None):
-        self.variables = {}
-        self.parent = parent
+def statement_parser():
+    """解析单条顶层语句的解析器，第一次流式执行时才创建"""
+    global _statement_parser
+    if _statement_parser is None:
+        _statement_parser = Lark(grammar, start='statement', parser='lalr',
+                                 cache=grammar_cache(GRAMMAR_FILE, 'statement'))
+    return _statement_parser
 
-    def set(self, name, value):
-        self.variables[name] = value
-
-    def lookup(self, name):
-        if name in self.variables:
-            return True, self.variables[name]
-        elif self.parent:
-            return self.parent.lookup(name)
-        else:
-            return False, None
+def loong_path():
+    """LOONGPATH 环境变量中列出的模块目录"""
+    return [p for p in os.environ.get('LOONGPATH', '').split(os.pathsep) if p]
 
 # Virtual Machine
 class VirtualMachine:
-    def __init__(self):
-        self.global_env = Env()  # Global environment
+    BACKENDS = ('closure', 'bytecode', 'python')
+
+    def __init__(self, backend='closure', use_cache=True, optimize=True, path=None, profile=False, budget=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}'")
+        self.backend = backend
+        self.use_cache = use_cache  # 是否使用 __loongcache__ 中缓存的解析结果
+        self.optimize = optimize  # 是否在编译前折叠常量
+        self.profiler = Profiler() if profile else None  # 开启时编译出的代码带有计时，见 profiler.py
+        self.budget = budget  # 每次求值的执行预算，开启时编译出的代码带有计数，见 budget.py
+        self.builtins_env = make_builtins(self)  # Loong 内置函数，可被遮蔽
+        self.global_env = Env(self.builtins_env)  # Global environment
         self.operators = Operators(self)  # 创建运算符处理器实例
+        self.compiler = Compiler(self)  # 把语法树编译为闭包
+        self.bytecode_compiler = BytecodeCompiler()  # 把语法树编译为字节码
+        self.interpreter = Interpreter(self)  # 执行字节码
+        self.transpiler = Transpiler(self)  # 把语法树翻译为 Python 代码
+        self.modules = {}  # 已加载的模块，类似 sys.modules，同一个模块只加载一次
+        # 多个线程共用一个虚拟机时，编译和加载模块需要互斥；执行编译好的代码不需要
+        self.compile_lock = threading.RLock()
+        self.import_lock = threading.RLock()
+        # 查找 .loo/.py 模块的目录，创建时转换为绝对路径，不受之后切换工作目录的影响
+        if path is None:
+            path = loong_path() + [os.getcwd()]
+        self.path = [os.path.abspath(p) for p in path]
     def process_file(self, filename, env = None, debug=False):
         if env is None:
             env = self.global_env  # Default to global environment
         # Read the file if a filename is provided
         with open(filename, 'r', encoding='utf-8') as file:
             code = file.read()
-        ast = parser.parse(code)
+        if self.use_cache:
+            ast = parse_cache.parse(parser, filename, code)
+        else:
+            ast = parser.parse(code)
         if debug:
             print(colored(ast.pretty(), 'grey'))
-        result = self.eval(ast, env)
+        result = self.eval(ast, env, debug)
         return result
     
+    def process_stream(self, filename, env=None, debug=False):
+        """逐条解析并执行文件中的顶层语句，不构造整个文件的语法树，见 streaming.py"""
+        if env is None:
+            env = self.global_env
+        if self.budget is not None:
+            # 整个文件共用一份预算，而不是每条语句一份
+            return self.budget.run(self._process_stream, filename, env, debug)
+        return self._process_stream(filename, env, debug)
+
+    def _process_stream(self, filename, env, debug):
+        with open(filename, 'r', encoding='utf-8') as file:
+            for text, lineno, last in split_statements(file):
+                ast = parse_statement(parser if last else statement_parser(), text, lineno)
+                if debug:
+                    print(colored(ast.pretty() if isinstance(ast, Tree) else ast, 'grey'))
+                if not last:
+                    ast = Tree('statements', [ast, literal(None)])
+                result = self.eval(ast, env, debug, dynamic=True)
+        return result
+
     def handle_function_call(self, func_def, arg_values, env):
         # Check if func_def is a native Python function
         if callable(func_def):
-            return func_def(*arg_values)
+            return func_def(*plain_args(arg_values))
         
-        local_env = Env(parent=func_def.env)
-        for i in range(len(func_def.params)):
-            local_env.set(func_def.params[i].value, arg_values[i])
-
-        result = None
-        for stmt in func_def.statements:
-            result = self.eval(stmt, local_env)
-        # print("return", result)
-        return result
+        # 蹦床：函数体在尾位置返回的 FuncCall 在这里继续执行，不再增加 Python 栈深度
+        while True:
+            nparams = len(func_def.params)
+            if len(arg_values) != nparams:
+                if len(arg_values) < nparams:
+                    raise TypeError(f"Function expects {nparams} arguments, got {len(arg_values)}")
+                arg_values = arg_values[:nparams]  # 忽略多余的参数
+            result = func_def.body(func_def.env, arg_values)
+            if type(result) is not FuncCall:
+                return result
+            func_def, arg_values = result.fun, result.args
+
+    def require_module(self, module_name):
+        """加载模块，找不到时抛出 ImportError"""
+        module = self.load_module(module_name)
+        if module is None:
+            raise ImportError(f"No module named '{module_name}' (search path: {os.pathsep.join(self.path)})")
+        return module
+
+    def lookup_star(self, module_names, name):
+        """在函数中星号导入的模块里查找 name，见 resolver.py；返回 (是否找到, 值)"""
+        if not name.startswith("_"):
+            for module_name in module_names:
+                module = self.modules.get(module_name)
+                if module is not None and hasattr(module, name):
+                    return True, getattr(module, name)
+        return False, None
+
+    def import_module(self, module_name, env, import_all_names=False):
+        module = self.require_module(module_name)
+        if import_all_names or module_name == '_':
+            # 名字在第一次使用时才从模块中取出
+            env.import_star(module)
+        if not import_all_names:
+            env.set(module_name, module)
+        return module
+
+    def load_module(self, module_name):
+        """加载模块并登记到 self.modules；找不到时返回 None"""
+        # 其他线程等待模块执行完，不会拿到执行了一半的模块
+        with self.import_lock:
+            return self._load_module(module_name)
+
+    def _load_module(self, module_name):
+        if module_name in self.modules:
+            return self.modules[module_name]
+        if module_name == '_':
+            module = builtins
+        else:
+            # 依次在 self.path 中查找 <name>.loo 和 <name>.py，最后尝试 Python 模块
+            for load in (self.load_loo_file, self.load_py_file, self.load_builtin_module):
+                module = load(module_name)
+                if module is not None:
+                    break
+            else:
+                return None
+        self.modules[module_name] = module
+        return module
+
+    def find_file(self, filename):
+        for directory in self.path:
+            candidate = os.path.join(directory, filename)
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def load_loo_file(self, module_name):
+        loo_file = self.find_file(f"{module_name}.loo")
+        if loo_file is None:
+            return None
+        module_env = Env(self.builtins_env)
+        module = Module(module_name, loo_file, module_env)
+        # 执行前先登记，循环导入时拿到的是尚未执行完的模块
+        self.modules[module_name] = module
+        try:
+            self.process_file(loo_file, module_env)
+        except BaseException:
+            del self.modules[module_name]
+            raise
+        return module
+
+    def load_py_file(self, module_name):
+        py_file = self.find_file(f"{module_name}.py")
+        if py_file is None:
+            return None
+        spec = importlib.util.spec_from_file_location(module_name, py_file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
 
-    def import_module_and_set_env(self, module_name, env):
-        # 检测本地目录是否有 <name>.py 文件，如有 import 之
-        py_file = f"{module_name}.py"
-        if os.path.exists(py_file):
-            spec = importlib.util.spec_from_file_location(module_name, py_file)
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-            
-            # 遍历模块中的所有名称，并在 env 中设置它们
-            for name in dir(module):
-                if not name.startswith("_"):  # 忽略私有属性
-                    env.set(name, getattr(module, name))
-            
-            return module
-
-        # 检测是否是 python 内部模块的名字，如有 import 之
+    def load_builtin_module(self, module_name):
         try:
-            module = __import__(module_name)
-            
-            # 遍历模块中的所有名称，并在 env 中设置它们
-            for name in dir(module):
-                if not name.startswith("_"):  # 忽略私有属性
-                    env.set(name, getattr(module, name))
-                    
-            return module
+            return __import__(module_name)
         except ImportError:
-            pass
+            return None
 
-        return None
+    def new_env(self, variables=None):
+        """
+        创建新的全局环境。内置名字所在的一层由所有环境共享，let 和赋值只写入新环境
+        这一层，因此创建环境不需要复制内置名字。
+        """
+        return Env(self.builtins_env, dict(variables) if variables else None)
 
-    def eval(self, node, env=None):
+    def compile(self, source, env=None, debug=False, dynamic=False):
+        """
+        把源码或语法树编译为可以重复执行的 Program。
+
+        :param env: 编译期检查名字是否存在时使用的环境，默认为 global_env；编译结果
+                    可以在任何环境中执行。
+        :param dynamic: 为 True 时不在编译期检查全局名字，见 streaming.py。
+        """
         if env is None:
-            env = self.global_env  # Default to global environment
+            env = self.global_env
+        node = parser.parse(source) if isinstance(source, str) else source
+        if node is None:
+            return Program(self, lambda env: None, False)
+
+        if self.optimize:
+            node = optimize(node)
+            if debug:
+                print(colored("optimized:", 'grey'))
+                print(colored(node.pretty(), 'grey'))
+
+        # 编译器在编译期间保存当前作用域等状态，同一个虚拟机一次只编译一个程序
+        with self.compile_lock:
+            if self.backend == 'python':
+                program, is_async = self.transpiler.compile_program(node, env, debug, dynamic)
+            elif self.backend == 'bytecode' and not has_await(node):
+                code = self.bytecode_compiler.compile(node)
+                if debug:
+                    print(colored(code.dis(), 'grey'))
+                program, is_async = (lambda env: self.interpreter.run(code, env)), False
+            else:
+                # 包含顶层 await 的程序在字节码后端中也由闭包编译器编译为协程
+                is_async = has_await(node)
+                program = self.compiler.compile_program(node, env, is_async, dynamic)
+        return Program(self, program, is_async)
 
+    def eval(self, node, env=None, debug=False, dynamic=False):
+        if env is None:
+            env = self.global_env  # Default to global environment
         if node is None:
             return None
+        return self.compile(node, env, debug, dynamic).run(env)
 
-        if isinstance(node, Tree):
-            if node.data == 'statements':
-                result = None
-                for statement in node.children:
-                    result = self.eval(statement, env)
-                return result
-            elif node.data == 'import_stmt':
-                module_name = node.children[0].value
-                # 如果存在第二个，且为 *
-                import_all_names = (len(node.children) > 1 and node.children[1].value == '*')
-                if module_name == '_':
-                    # 遍历所有内置名称并设置到 env
-                    for name in dir(builtins):
-                        if not name.startswith("_"):  # 忽略私有名称
-                            # print("load",name)
-                            env.set(name, getattr(builtins, name))
-                    env.set("_", builtins)
-                else:
-                    def import_module_and_set_env(module_name, env, import_all_names=False):
-                        # 检测本地目录是否有 <name>.loo 文件，如有 process 之
-                        module = import_loo_file(module_name, env, import_all_names)
-                        if module is not None:
-                            return module
-                        
-                        # 检测本地目录是否有 <name>.py 文件，如有 import 之
-                        module = import_py_file(module_name, env, import_all_names)
-                        if module is not None:
-                            return module
-                        
-                        # 检测是否是 python 内部模块的名字，如有 import 之
-                        module = import_builtin_module(module_name, env, import_all_names)
-                        if module is not None:
-                            return module
-                        
-                        return None
-
-                    def import_loo_file(module_name, env, import_all_names):
-                        loo_file = f"{module_name}.loo"
-                        if os.path.exists(loo_file):
-                            module = self.process_file(loo_file, env)
-                            if import_all_names:
-                                for name in dir(module):
-                                    if not name.startswith("_"):  # 忽略私有属性
-                                        env.set(name, getattr(module, name))
-                            else:
-                                env.set(module_name, module)
-                            return module
-                        return None
-
-                    def import_py_file(module_name, env, import_all_names):
-                        py_file = f"{module_name}.py"
-                        if os.path.exists(py_file):
-                            spec = importlib.util.spec_from_file_location(module_name, py_file)
-                            module = importlib.util.module_from_spec(spec)
-                            spec.loader.exec_module(module)
-                            if import_all_names:
-                                # 遍历模块中的所有名称并设置到 env
-                                for name in dir(module):
-                                    if not name.startswith("_"):  # 忽略私有属性
-                                        env.set(name, getattr(module, name))
-                            else:
-                                env.set(module_name, module)
-                            return module
-                        return None
-
-                    def import_builtin_module(module_name, env, import_all_names):
-                        try:
-                            module = __import__(module_name)
-                            if import_all_names:
-                                # 遍历模块中的所有名称并设置到 env
-                                for name in dir(module):
-                                    if not name.startswith("_"):  # 忽略私有属性
-                                        env.set(name, getattr(module, name))
-                            else:
-                                env.set(module_name, module)
-                            return module
-                        except ImportError:
-                            pass
-                        return None
-
-                    import_module_and_set_env(module_name, env, import_all_names)
-
-            elif node.data== 'let_stmt':
-                value = self.eval(node.children[1], env)
-                target = node.children[0].value
-                exists, _ = env.lookup(target)
-                if exists:
-                    raise Exception(f"Variable '{target}' is already defined")
-                # print("let", target, "=", value)
-                env.set(target, value)
-            elif node.data == 'let_multi_stmt':
-                expr = node.children[-1]
-                names = node.children[:-1]
-                value = self.eval(expr, env)
-                if not isinstance(value, list):
-                    raise TypeError(f"Expected list, got {type(value).__name__}")
-                if len(names) != len(value):  # 检测数组长度是否匹配
-                    raise ValueError(f"Number of names ({len(names)}) does not match number of values ({len(value)})")
-                for index, name in enumerate(names):
-                    exists, _ = env.lookup(name.value)
-                    if exists:
-                        raise Exception(f"Variable '{name.value}' is already defined")
-                    env.set(name.value, value[index])
-
-            elif node.data== 'assign_stmt':
-                value = self.eval(node.children[1], env)
-                target = node.children[0]
-                if isinstance(target, Token): # name
-                    exists,_ = env.lookup(target.value)
-                    if not exists:
-                        raise Exception(f"Variable '{target.value}' is not defined")
-                    print("set", target.value, "=", value)
-                    env.set(target.value, value)
-                elif isinstance(target, Tree):
-                    if target.data== 'array_access':
-                        array = self.eval(target.children[0], env)
-                        index = self.eval(target.children[1], env)
-                        array[index] = value
-                    elif target.data== 'prop_access':
-                        obj = self.eval(target.children[0], env)
-                        obj[target.children[1].value] = value
-
-            elif node.data== 'func_def':
-                env.set(node.children[0].value, FuncDef(node.children[1].children, node.children[2].children, env))
-            elif node.data== 'func_expr':
-                return FuncDef(node.children[0].children, node.children[1].children, env)
-            elif node.data== 'short_func_expr':
-                return FuncDef([node.children[0]], [node.children[1]], env)
-            elif node.data== 'func_call':
-                func_def = self.eval(node.children[0], env)
-                arg_names = node.children[1].children
-                arg_values = [self.eval(arg, env) for arg in arg_names]
-                return self.handle_function_call(func_def, arg_values, env)
-            elif node.data== 'array_access':
-                array = self.eval(node.children[0], env)
-                index = self.eval(node.children[1], env)
-                return array[index]
-            elif node.data == 'prop_access':
-                obj = self.eval(node.children[0], env)
-                if isinstance(obj, dict):
-                    return obj[node.children[1].value]
-                else:
-                    return getattr(obj, node.children[1].value)
-
-
-            elif node.data== 'list':
-                return [self.eval(item, env) for item in node.children]
-            elif node.data== 'dict':
-                d = {pair.children[0].value: self.eval(pair.children[1], env) for pair in node.children}
-                return d
-            
-            elif node.data== 'map_expr':
-                operator = node.children[1].type
-                if operator == 'MAP':
-                    lst = self.eval(node.children[0], env)
-                    lmd = self.eval(node.children[2], env)
-                    return [self.handle_function_call(lmd, [x], env) for x in lst]
-                elif operator == 'FILTER':
-                    lst = self.eval(node.children[0], env)
-                    lmd = self.eval(node.children[2], env)
-                    return [x for x in lst if self.handle_function_call(lmd, [x], env)]
-        
-            elif node.data== 'conditional_exp':
-                cond = self.eval(node.children[0], env)
-                return self.eval(node.children[1], env) if cond else self.eval(node.children[2], env)
-            
-            elif node.data == 'additive_exp':  # 加法表达式
-                left = self.eval(node.children[0], env)  # 左操作数
-                operator = node.children[1].value  # 操作符在第二个子节点
-                right = self.eval(node.children[2], env)  # 右操作数
-                if operator == '+':
-                    result = self.operators.add_operator(left, right, env)
-                elif operator == '-':
-                    result = self.operators.sub_operator(left, right, env)
-                return result
-            elif node.data == 'mult_exp':  # 乘法表达式
-                left = self.eval(node.children[0], env)
-                operator = node.children[1].value  # 操作符在第二个子节点
-                right = self.eval(node.children[2], env)
-                if operator == '*':
-                    result = self.operators.mul_operator(left, right, env)
-                elif operator == '/':
-                    result = self.operators.div_operator(left, right, env)
-                elif operator == '//':
-                    result = self.operators.floordiv_operator(left, right, env)
-                elif operator == '%':
-                    result = self.operators.mod_operator(left, right, env)
-                return result
-            elif node.data == 'bitwise_exp':  # 位运算表达式
-                left = self.eval(node.children[0], env)
-                operator = node.children[1].value  # 操作符在第二个子节点
-                right = self.eval(node.children[2], env)
-                if operator == '&':
-                    result = left & right
-                elif operator == '|':
-                    result = left | right
-                elif operator == '^':
-                    result = left ^ right
-                return result
-            elif node.data == 'equality_exp':  # 等式表达式
-                left = self.eval(node.children[0], env)
-                operator = node.children[1].value  # 操作符在第二个子节点
-                right = self.eval(node.children[2], env)
-                if operator == '==':
-                    result = left == right
-                elif operator == '!=':
-                    result = left != right
-                return result
-            elif node.data == 'relational_exp':  # 关系表达式
-                left = self.eval(node.children[0], env)
-                operator = node.children[1].value  # 操作符在第二个子节点
-                right = self.eval(node.children[2], env)
-                if operator == '<':
-                    result = left < right
-                elif operator == '>':
-                    result = left > right
-                elif operator == '<=':
-                    result = left <= right
-                elif operator == '>=':
-                    result = left >= right
-                return result
-            elif node.data == 'shift_expression':  # 移位表达式
-                left = self.eval(node.children[0], env)
-                operator = node.children[1].value  # 操作符在第二个子节点
-                right = self.eval(node.children[2], env)
-                if operator == '<<':
-                    result = left << right
-                elif operator == '>>':
-                    result = left >> right
-                return result
-            elif node.data == 'logical_or_exp':  # 逻辑或表达式
-                left = self.eval(node.children[0], env)
-                if left:
-                    return left
-                return self.eval(node.children[2], env)
-            elif node.data == 'logical_and_exp':  # 逻辑与表达式
-                left = self.eval(node.children[0], env)
-                if not left:
-                    return left
-                return self.eval(node.children[2], env)
-            elif node.data == 'unary_exp':  # 一元运算符表达式
-                operator = node.children[0].value  # 操作符在第一个子节点
-                operand = self.eval(node.children[1], env)  # 操作数在第二个子节点
-                if operator == 'not':
-                    return not operand
-                elif operator == '-':
-                    return -operand
-                elif operator == '+':
-                    return +operand
-                elif operator == '~':
-                    return ~operand
-                return operand
-            elif node.data == 'postfix_exp':  # 后缀表达式
-                return self.eval(node.children[0], env)
-            elif node.data == 'primary_exp':  # 基础表达式
-                return self.eval(node.children[0], env)
-            elif node.data == 'func_call':  # 函数调用
-                func = self.eval(node.children[0], env)  # 函数名
-                args = [self.eval(arg, env) for arg in node.children[1].children]  # 函数参数
-                return func(*args)
-            elif node.data == 'array_access':  # 数组访问
-                array = self.eval(node.children[0], env)
-                index = self.eval(node.children[1], env)
-                return array[index]
-            elif node.data == 'prop_access':  # 属性访问
-                obj = self.eval(node.children[0], env)
-                property_name = node.children[1].value  # 属性名在第二个子节点
-                return obj[property_name]
-            elif node.data == 'dict':  # 字典
-                return {self.eval(k, env): self.eval(v, env) for k, v in zip(node.children[0::2], node.children[1::2])}
-            elif node.data == 'list':  # 列表
-                return [self.eval(item, env) for item in node.children]
-            elif node.data == 'let_stmt':  # 变量声明
-                target = node.children[0].value  # 目标变量
-                value = self.eval(node.children[1], env)  # 赋值表达式
-                env.set(target, value)
-                return value
-            elif node.data == 'assign_stmt':  # 变量赋值
-                target = self.eval(node.children[0], env)
-                value = self.eval(node.children[2], env)
-                if isinstance(target, list):
-                    target[node.children[1].value] = value  # 数组访问赋值
-                else:
-                    env.set(target, value)  # 普通赋值
-                return value
-            elif node.data == 'func_stmt':  # 函数定义
-                func_name = node.children[0].value
-                params = [param.value for param in node.children[1].children]
-                body = node.children[2]
-                env.set(func_name, (params, body))
-                return None
-        elif isinstance(node, Token):
-            if node.type == 'NUMBER':
-                if '.' in node.value or 'e' in node.value or 'E' in node.value:
-                    return float(node.value)
-                else:
-                    return int(node.value)
-            elif node.type == 'STRING':
-                return node.value[1:-1]
-            elif node.type == 'NAME':
-                exists, value = env.lookup(node.value)
-                if not exists:
-                    raise NameError(f"Variable '{node.value}' not defined in the environment.")
-                return value
+
+class Program:
+    """
+    ``VirtualMachine.compile`` 编译出的程序。
+
+    编译只做一次，``run`` 可以在多个线程中同时调用，每次在给定的全局环境中执行。
+    同一个环境不应该同时被多个线程使用；需要从同一个状态出发时用 ``Env.fork``
+    为每次执行复制一份。
+
+    :param vm: 编译程序的虚拟机。
+    :param code: ``code(env)`` 执行程序，is_async 时返回协程。
+    :param is_async: 程序是否包含顶层 await。
+    """
+    __slots__ = ('vm', 'code', 'is_async')
+
+    def __init__(self, vm, code, is_async):
+        self.vm = vm
+        self.code = code
+        self.is_async = is_async
+
+    def run(self, env=None):
+        """在 env 中执行程序并返回结果，env 为 None 时使用 ``vm.new_env()`` 创建的新环境"""
+        if env is None:
+            env = self.vm.new_env()
+        code = self.code
+        if self.is_async:
+            # 在新的事件循环中执行
+            code = lambda env, coroutine=code: asyncio.run(coroutine(env))
+        # 结果是未物化的 Pipeline 时物化为列表；物化在预算的计量之内进行
+        program = lambda env: plain(materialize(code(env)))
+        budget = self.vm.budget
+        if budget is not None:
+            program = lambda env, run=program: budget.run(run, env)
+        profiler = self.vm.profiler
+        if profiler is not None:
+            return profiler.run("<module>", program, env)
+        return program(env)
 
 
 def main():
@@ -414,16 +301,42 @@ def main():
     argparser = argparse.ArgumentParser(description="Run LoongVM with optional debugging.")
     argparser.add_argument('filename', nargs='?', help="The filename of the source code to execute.")
     argparser.add_argument('-d', '--debug', action='store_true', help="Enable debug mode for detailed AST output.")
+    argparser.add_argument('-b', '--backend', choices=VirtualMachine.BACKENDS, default='closure',
+                           help="Execution backend: compiled closures (default), the bytecode interpreter "
+                                "or Python code generated from the syntax tree.")
+    argparser.add_argument('--no-cache', action='store_true', help="Do not read or write cached parse trees in __loongcache__.")
+    argparser.add_argument('-I', '--path', action='append', default=[], metavar='DIR',
+                           help="Add DIR to the module search path (before LOONGPATH).")
+    argparser.add_argument('--profile', action='store_true',
+                           help="Print the slowest Loong functions and node types to stderr.")
+    argparser.add_argument('--profile-output', metavar='FILE',
+                           help="With --profile, also write collapsed stacks for flamegraph tools to FILE.")
+    argparser.add_argument('--no-optimize', action='store_true', help="Disable constant folding before compilation.")
+    argparser.add_argument('--stream', action='store_true',
+                           help="Parse and execute top-level statements one at a time instead of parsing the whole file first.")
+    argparser.add_argument('--max-steps', type=int, metavar='N', help="Stop after N Loong function calls.")
+    argparser.add_argument('--max-seconds', type=float, metavar='S', help="Stop an evaluation after S seconds.")
+    argparser.add_argument('--max-depth', type=int, metavar='N', help="Stop when calls nest deeper than N.")
+    argparser.add_argument('--max-allocations', type=int, metavar='N',
+                           help="Stop when an evaluation holds N more memory blocks than at its start (approximate).")
     
     # Parse command-line arguments
     args = argparser.parse_args()
     
     # Initialize components
     init()
-    vm = VirtualMachine()
+    # 与 Python 一样，脚本所在目录（交互模式下为当前目录）排在搜索路径最前面
+    main_dir = os.path.dirname(os.path.abspath(args.filename)) if args.filename else os.getcwd()
+    limits = (args.max_steps, args.max_seconds, args.max_depth, args.max_allocations)
+    budget = Budget(*limits) if any(limit is not None for limit in limits) else None
+    vm = VirtualMachine(args.backend, not args.no_cache, not args.no_optimize,
+                        [main_dir] + args.path + loong_path(), args.profile, budget)
     
     if args.filename:
-        result = vm.process_file(args.filename, None, args.debug)
+        if args.stream:
+            result = vm.process_stream(args.filename, None, args.debug)
+        else:
+            result = vm.process_file(args.filename, None, args.debug)
         print(pretty_var(result))
     else:
         # Interactive mode if no filename is provided
@@ -444,9 +357,14 @@ def main():
                 ast = parser.parse(text)
                 if args.debug:
                     print(colored(ast.pretty(), 'grey'))
-                result = vm.eval(ast)
+                result = vm.eval(ast, None, args.debug)
                 print(pretty_var(result))
                 # break
 
+    if vm.profiler is not None:
+        print(vm.profiler.report(), file=sys.stderr)
+        if args.profile_output:
+            vm.profiler.write_collapsed(args.profile_output)
+
 if __name__ == '__main__':
     main()
@@ -1,9 +1,12 @@
 
 
 class FuncCall:
+    __slots__ = ('fun', 'args')
+
     def __init__(self, fun, args: list):
         """
         表示函数调用的抽象语法树节点。
+        尾位置上的调用也以 FuncCall 的形式返回，交给 handle_function_call 的蹦床执行。
 
         :param fun: 被调用的函数或表达式。
         :param args: 参数列表。
@@ -16,17 +19,166 @@ class FuncCall:
 
 
 class FuncDef:
-    def __init__(self, params, statements, env):
+    __slots__ = ('params', 'body', 'env', 'vector', 'free', 'source')
+
+    def __init__(self, params, body, env, vector=None, free=None, source=None):
         """
         表示函数定义的抽象语法树节点。
         
-        :param params: 参数列表。
-        :param statements: 函数体语句列表。
+        :param params: 参数名列表。
+        :param body: 编译后的函数体闭包。
+        :param env: 调用函数体时传入的环境。闭包后端中是 ``(全局 Env, Cell...)``，
+                    只包含函数体引用的外层局部变量；其他后端中是定义函数时所在的 Env。
+        :param vector: 纯算术单参数函数的 NumPy 向量化形式（见 vectorize.py）。
+        :param free: ``free(env)`` 返回函数体引用的外层变量的当前值，没有时为 None。
+        :param source: 在其他进程中重建函数所需的可序列化信息，最后一项是外层变量名。
         """
         self.params = params
-        self.statements = statements
+        self.body = body
         self.env = env
+        self.vector = vector
+        self.free = free
+        self.source = source
+
+    def __reduce__(self):
+        # 编译出的闭包无法序列化，按 source 在目标进程中重新编译
+        from parallel import reduce_function
+        return reduce_function(self)
+
+    def free_values(self):
+        """函数体引用的外层变量的当前值"""
+        return () if self.free is None else self.free(self.env)
+
+    def __repr__(self):
+        return f"FuncDef(params={self.params})"
+
+
+class Cell:
+    """
+    被内层函数引用的局部变量的存储单元。
+
+    闭包后端中，定义变量的栈帧和引用它的闭包共享同一个 Cell，因此赋值对双方都可见，
+    而闭包不必持有整个栈帧。
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
 
     def __repr__(self):
-        return f"FuncDef(\n\tparam_list={self.params}, \n\tstatements={self.statements}\n)"
+        return f"Cell({self.value!r})"
+
+
+class Env:
+    __slots__ = ('variables', 'parent', 'shadowable', 'imports')
+
+    def __init__(self, parent=None, variables=None):
+        self.variables = {} if variables is None else variables
+        self.parent = parent
+        # 内置名字所在的环境可以被 let 遮蔽
+        self.shadowable = False
+        # 星号导入的模块，名字在第一次查找时才从模块中取出
+        self.imports = ()
+
+    def set(self, name, value):
+        self.variables[name] = value
+
+    def fork(self):
+        """
+        浅复制本层：新环境与本层共享外层和变量的值，之后在任一方中定义、赋值
+        顶层名字互不影响。
+        """
+        env = Env(self.parent, dict(self.variables))
+        env.shadowable = self.shadowable
+        if self.imports:
+            env.imports = list(self.imports)
+        return env
+
+    def import_star(self, module):
+        """把 module 的公开名字（不以 _ 开头）延迟绑定到本层"""
+        if not self.imports:
+            self.imports = []
+        self.imports.append(module)
+
+    def lookup_import(self, name):
+        """在星号导入的模块中查找 name，后导入的优先；找到后绑定到本层，下次直接命中"""
+        if name.startswith("_"):
+            return False, None
+        for module in reversed(self.imports):
+            try:
+                value = getattr(module, name)
+            except AttributeError:
+                continue
+            self.variables[name] = value
+            return True, value
+        return False, None
+
+    def lookup(self, name):
+        env = self
+        while env is not None:
+            if name in env.variables:
+                return True, env.variables[name]
+            if env.imports:
+                exists, value = env.lookup_import(name)
+                if exists:
+                    return True, value
+            env = env.parent
+        return False, None
+
+    def assign(self, name, value):
+        """
+        赋值给已定义的 name，写入定义它的那一层；只在内置名字层中找到时写入本层。
+
+        :return: name 是否已定义。
+        """
+        env = self
+        while env is not None and not env.shadowable:
+            if name in env.variables or (env.imports and env.lookup_import(name)[0]):
+                env.variables[name] = value
+                return True
+            env = env.parent
+        if not self.lookup(name)[0]:
+            return False
+        self.variables[name] = value
+        return True
 
+    def defines(self, name):
+        """用户代码是否已经定义了 name，不计可被遮蔽的内置名字"""
+        env = self
+        while env is not None:
+            if not env.shadowable:
+                if name in env.variables:
+                    return True
+                if env.imports and env.lookup_import(name)[0]:
+                    return True
+            env = env.parent
+        return False
+
+
+class Module:
+    """
+    ``.loo`` 模块。模块在自己的顶层 Env 中执行一次，定义的名字作为属性访问。
+
+    :param name: 模块名。
+    :param filename: 模块文件的路径。
+    :param env: 模块的顶层环境。
+    """
+
+    def __init__(self, name, filename, env):
+        self.__name__ = name
+        self.__file__ = filename
+        self._env = env
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        variables = self.__dict__['_env'].variables
+        if name in variables:
+            return variables[name]
+        raise AttributeError(f"module '{self.__name__}' has no attribute '{name}'")
+
+    def __dir__(self):
+        return list(self._env.variables)
+
+    def __repr__(self):
+        return f"<module '{self.__name__}' from '{self.__file__}'>"
@@ -0,0 +1,94 @@
+"""
+Loong 的内置函数。
+
+这些名字位于全局环境之上的一层 Env 中，无需导入即可使用，也可以被 let 遮蔽。
+"""
+from collections import OrderedDict
+
+from coroutines import gather
+from loongast import Env
+import parallel
+from sources import Chunks, Lines, Records
+
+
+class Memoized:
+    """
+    ``memo(f, maxsize)`` 返回的带 LRU 缓存的函数。
+
+    缓存键由参数元组和函数体引用的外层变量的当前值组成，因此外层变量被重新
+    赋值后不会返回过期结果。参数或外层变量不可哈希时直接调用，不做缓存。
+
+    :param vm: 所属的虚拟机。
+    :param func: 被缓存的 Loong 函数或 Python 可调用对象。
+    :param maxsize: 最多缓存的条目数，None 表示不限制。
+    """
+
+    def __init__(self, vm, func, maxsize=128):
+        self.vm = vm
+        self.func = func
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, args):
+        free_values = getattr(self.func, 'free_values', None)
+        try:
+            key = (args, free_values()) if free_values else args
+            hash(key)
+        except (TypeError, NameError):
+            return None
+        return key
+
+    def __call__(self, *args):
+        key = self.key(args)
+        if key is None:
+            self.misses += 1
+            return self.vm.handle_function_call(self.func, list(args), None)
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        result = self.vm.handle_function_call(self.func, list(args), None)
+        cache[key] = result
+        if self.maxsize is not None and len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return result
+
+    def cache_info(self):
+        """返回命中/未命中次数和缓存大小"""
+        return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.maxsize, 'currsize': len(self.cache)}
+
+    def cache_clear(self):
+        self.cache.clear()
+        self.hits = self.misses = 0
+
+    def __reduce__(self):
+        # 在其他进程中以空缓存重建
+        return parallel.rebuild_memo, (self.func, self.maxsize)
+
+    def __repr__(self):
+        return f"Memoized({self.func!r}, maxsize={self.maxsize})"
+
+
+def make_builtins(vm):
+    """创建虚拟机的内置名字环境"""
+
+    def memo(func, maxsize=128):
+        return Memoized(vm, func, maxsize)
+
+    def pmap(items, func, workers=None, mode='process', chunksize=None):
+        return parallel.pmap(vm, items, func, workers, mode, chunksize)
+
+    env = Env(variables={
+        'memo': memo,
+        'pmap': pmap,
+        'gather': gather,
+        'lines': Lines,
+        'chunks': Chunks,
+        'records': Records,
+    })
+    env.shadowable = True
+    return env
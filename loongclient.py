@@ -0,0 +1,57 @@
+"""
+loongserver.py 的客户端。
+
+    python loongclient.py script.loo
+    python loongclient.py -c "1 + 2"
+
+与 loong.py 一样，打印脚本的输出和最后一个表达式的值，但由常驻服务执行。出错时退出码为 1。
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+from loongserver import DEFAULT_SOCKET
+
+
+def request(payload, path=DEFAULT_SOCKET, timeout=None):
+    """发送一个请求并返回响应；timeout 为 None 时使用服务端的默认值"""
+    if timeout is not None:
+        payload = dict(payload, timeout=timeout)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(payload).encode('utf-8') + b"\n")
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("server closed the connection")
+    return json.loads(line)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Evaluate Loong code on a running loongserver.")
+    group = argparser.add_mutually_exclusive_group(required=True)
+    group.add_argument('file', nargs='?', help="Script to run.")
+    group.add_argument('-c', '--code', help="Code to evaluate.")
+    argparser.add_argument('--socket', default=DEFAULT_SOCKET, help=f"Socket path (default: {DEFAULT_SOCKET}).")
+    argparser.add_argument('--timeout', type=float, help="Per-request timeout in seconds.")
+    args = argparser.parse_args()
+
+    if args.file:
+        payload = {'file': os.path.abspath(args.file)}
+    else:
+        payload = {'code': args.code}
+    payload['cwd'] = os.getcwd()
+    try:
+        response = request(payload, args.socket, args.timeout)
+    except OSError as e:
+        sys.exit(f"cannot reach loong server at {args.socket}: {e}")
+    sys.stdout.write(response['output'])
+    if not response['ok']:
+        sys.exit(response['error'])
+    print(response['result'])
+
+
+if __name__ == '__main__':
+    main()
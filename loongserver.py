@@ -0,0 +1,208 @@
+"""
+常驻的 Loong 求值服务。
+
+    python loongserver.py [--socket PATH] [--workers N] [--timeout 秒] [-b 后端] [--max-steps N] [--max-depth N]
+
+服务在 Unix socket 上接收请求，交给一组预先启动的工作进程执行。每个工作进程
+持有一个 VirtualMachine：解析器、语法缓存和已导入的模块在请求之间保持加载，
+每个请求在新的全局环境中执行，标准输出被单独捕获。请求超时的工作进程会被
+杀掉并换成新的进程，不影响其他请求；设置了执行预算（见 budget.py）时，失控的脚本
+在预算用完时以 BudgetExceeded 结束，工作进程不需要重新启动。
+
+协议是每行一个 JSON 对象。请求::
+
+    {"file": "/abs/path/script.loo", "cwd": "/abs/path", "timeout": 5}
+    {"code": "1 + 2"}
+
+响应::
+
+    {"ok": true, "result": "3", "output": "脚本打印的内容"}
+    {"ok": false, "error": "NameError: ...", "output": "..."}
+
+客户端见 loongclient.py。本模块在服务进程中不导入 loong，只有工作进程才导入。
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import sys
+
+DEFAULT_SOCKET = os.environ.get('LOONG_SOCKET') or f"/tmp/loong-{os.getuid()}.sock"
+DEFAULT_TIMEOUT = 30.0
+STREAM_LIMIT = 2 ** 26  # 单个请求/响应行的最大长度
+
+
+class WorkerPool:
+    """
+    工作进程池。
+
+    :param size: 工作进程数。
+    :param backend: 工作进程使用的执行后端。
+    :param budget_args: 传给工作进程的执行预算参数，如 ``['--max-steps', '1000000']``。
+    """
+
+    def __init__(self, size, backend='closure', budget_args=()):
+        self.size = size
+        self.backend = backend
+        self.budget_args = list(budget_args)
+        self.idle = asyncio.Queue()
+        self.workers = set()
+
+    async def start(self):
+        for _ in range(self.size):
+            self.idle.put_nowait(await self.spawn())
+
+    async def spawn(self):
+        worker = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--worker', '--backend', self.backend, *self.budget_args,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=STREAM_LIMIT)
+        self.workers.add(worker)
+        return worker
+
+    async def replace(self, worker):
+        self.workers.discard(worker)
+        if worker.returncode is None:
+            worker.kill()
+        await worker.wait()
+        return await self.spawn()
+
+    async def run(self, request, timeout):
+        """在空闲的工作进程中执行请求，返回响应"""
+        worker = await self.idle.get()
+        try:
+            worker.stdin.write(json.dumps(request).encode('utf-8') + b"\n")
+            await worker.stdin.drain()
+            line = await asyncio.wait_for(worker.stdout.readline(), timeout)
+            if not line:
+                raise ConnectionResetError("worker exited")
+            return json.loads(line)
+        except asyncio.TimeoutError:
+            worker = await self.replace(worker)
+            return {'ok': False, 'error': f"TimeoutError: evaluation exceeded {timeout}s", 'output': ""}
+        except (ConnectionError, BrokenPipeError) as e:
+            worker = await self.replace(worker)
+            return {'ok': False, 'error': f"WorkerError: {e}", 'output': ""}
+        finally:
+            self.idle.put_nowait(worker)
+
+    async def close(self):
+        for worker in self.workers:
+            if worker.returncode is None:
+                worker.kill()
+        await asyncio.gather(*(worker.wait() for worker in self.workers))
+
+
+class Server:
+    def __init__(self, pool, timeout=DEFAULT_TIMEOUT):
+        self.pool = pool
+        self.timeout = timeout
+
+    async def handle(self, reader, writer):
+        """一个连接上可以依次发送多个请求"""
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    timeout = float(request.get('timeout') or self.timeout)
+                except (ValueError, TypeError, AttributeError) as e:
+                    response = {'ok': False, 'error': f"BadRequest: {e}", 'output': ""}
+                else:
+                    response = await self.pool.run(request, timeout)
+                writer.write(json.dumps(response).encode('utf-8') + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        await self.pool.start()
+        server = await asyncio.start_unix_server(self.handle, path, limit=STREAM_LIMIT)
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set_result, None)
+        print(f"loong server listening on {path} with {self.pool.size} workers", file=sys.stderr)
+        try:
+            async with server:
+                await stop
+        finally:
+            await self.pool.close()
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def evaluate(vm, request):
+    """在工作进程中执行一个请求"""
+    from loong import parser
+    from loongast import Env
+    from pretty import pretty_var
+
+    vm.global_env = Env(vm.builtins_env)  # 每个请求使用新的全局环境
+    cwd = request.get('cwd')
+    if cwd:
+        os.chdir(cwd)
+    if 'file' in request:
+        filename = os.path.abspath(request['file'])
+        vm.path = [os.path.dirname(filename)] + vm.base_path
+        result = vm.process_file(filename)
+    else:
+        vm.path = [os.getcwd()] + vm.base_path
+        result = vm.eval(parser.parse(request['code']))
+    return pretty_var(result)
+
+
+def worker(backend, budget=None):
+    """工作进程：从 stdin 逐行读取请求，向 stdout 逐行写出响应"""
+    from loong import VirtualMachine, loong_path
+
+    requests, responses = sys.stdin, sys.stdout
+    sys.stdin = open(os.devnull)  # 脚本不能读到协议数据
+    vm = VirtualMachine(backend, budget=budget)
+    vm.base_path = [os.path.abspath(p) for p in loong_path()]
+    # 结果的格式化（可能展开惰性管道）也计入预算
+    run = evaluate if budget is None else lambda vm, request: budget.run(evaluate, vm, request)
+    for line in requests:
+        output = sys.stdout = io.StringIO()
+        try:
+            response = {'ok': True, 'result': run(vm, json.loads(line))}
+        except Exception as e:
+            response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        finally:
+            sys.stdout = responses
+        response['output'] = output.getvalue()
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Serve Loong evaluation requests over a Unix socket.")
+    argparser.add_argument('--socket', default=DEFAULT_SOCKET, help=f"Socket path (default: {DEFAULT_SOCKET}).")
+    argparser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of worker processes.")
+    argparser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="Default per-request timeout in seconds.")
+    argparser.add_argument('-b', '--backend', choices=('closure', 'bytecode', 'python'), default='closure')
+    argparser.add_argument('--max-steps', type=int, metavar='N', help="Per-request limit on Loong function calls.")
+    argparser.add_argument('--max-depth', type=int, metavar='N', help="Per-request limit on call nesting depth.")
+    argparser.add_argument('--max-allocations', type=int, metavar='N',
+                           help="Per-request limit on additional live memory blocks (approximate).")
+    argparser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+    limits = {'--max-steps': args.max_steps, '--max-depth': args.max_depth, '--max-allocations': args.max_allocations}
+    if args.worker:
+        from budget import Budget
+        budget = None
+        if any(limit is not None for limit in limits.values()):
+            budget = Budget(steps=args.max_steps, depth=args.max_depth, allocations=args.max_allocations)
+        worker(args.backend, budget)
+        return
+    budget_args = [arg for flag, limit in limits.items() if limit is not None for arg in (flag, str(limit))]
+    pool = WorkerPool(args.workers, args.backend, budget_args)
+    asyncio.run(Server(pool, args.timeout).serve(args.socket))
+
+
+if __name__ == '__main__':
+    main()
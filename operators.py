@@ -1,79 +1,180 @@
+"""
+二元/一元运算符的分派。
+
+算术运算符（``+ - * / // % **``）按 ``(type(left), type(right))`` 查找实现：
+第一次遇到某个类型对时由 ``FAST_PATHS`` 决定用哪个 Python 函数并缓存在
+``DISPATCH`` 中，之后同样类型的运算只需一次字典查找。左操作数是字典时走
+慢路径，调用字典中的 ``__add__`` 等函数，因为结果取决于字典的内容，不能缓存。
+字典字面量创建的记录（见 records.py）例外：字面量中有 ``__add__`` 等键的记录类型
+第一次参与运算后，调用方式按记录类型缓存在 ``Operators.hooks`` 中。
+字符串拼接的结果较长时是 Rope（见 rope.py），逐段拼接不再每次复制整个字符串。
+未物化的 Pipeline 参与 ``+``、``*`` 时先物化为列表，与列表的运算相同。
+
+位运算、比较和移位直接使用 Python 的语义，与类型无关，见 ``PY_OPERATORS``。
+"""
+import operator
+
+from pipeline import Pipeline, materialize
+from records import Record
+from rope import Rope, concat
+
+NUMBER = (int, float)
+
+# 不需要 env、对所有类型都直接使用 Python 语义的二元运算符
+PY_OPERATORS = {
+    '&': operator.and_,
+    '|': operator.or_,
+    '^': operator.xor,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '<<': operator.lshift,
+    '>>': operator.rshift,
+}
+
+UNARY_OPERATORS = {
+    'not': operator.not_,
+    '-': operator.neg,
+    '+': operator.pos,
+    '~': operator.invert,
+}
+
+# 可以被字典重载的运算符：运算符 -> (字典中的方法名, 错误信息中的动词)
+PROTOCOL = {
+    '+': ('__add__', 'added'),
+    '-': ('__sub__', 'subtracted'),
+    '*': ('__mul__', 'multiplied'),
+    '/': ('__div__', 'divided'),
+    '//': ('__floordiv__', 'floor divided'),
+    '%': ('__mod__', 'modulo divided'),
+    '**': ('__pow__', 'exponentiated'),
+}
+
+
+def _raise(message):
+    def fail(left, right):
+        raise TypeError(message)
+    return fail
+
+
+def _str_add(left, right):
+    return concat(left, str(right))
+
+
+def _materialized(op):
+    def apply(left, right):
+        return op(materialize(left), materialize(right))
+    return apply
+
+
+def _add(left_type, right_type):
+    if left_type is Pipeline or (right_type is Pipeline and issubclass(left_type, list)):
+        return _materialized(_add(list, list if right_type is Pipeline else right_type))
+    if issubclass(left_type, NUMBER):
+        return operator.add
+    if issubclass(left_type, (str, Rope)):
+        return concat if issubclass(right_type, (str, Rope)) else _str_add
+    if issubclass(left_type, list):
+        if issubclass(right_type, list):
+            return operator.add
+        return _raise("Cannot add non-list to a list")
+    return None
+
+
+def _mul(left_type, right_type):
+    if left_type is Pipeline or right_type is Pipeline:
+        return _materialized(operator.mul)
+    if issubclass(left_type, (int, float, str, list, Rope)):
+        return operator.mul
+    return None
+
+
+def _numeric(fn):
+    def fast_path(left_type, right_type):
+        return fn if issubclass(left_type, NUMBER) else None
+    return fast_path
+
+
+# 运算符 -> ``fast_path(left_type, right_type)``，返回 ``fn(left, right)``，没有快速路径时返回 None
+FAST_PATHS = {
+    '+': _add,
+    '-': _numeric(operator.sub),
+    '*': _mul,
+    '/': _numeric(operator.truediv),
+    '//': _numeric(operator.floordiv),
+    '%': _numeric(operator.mod),
+    '**': _numeric(operator.pow),
+}
+
+# 运算符 -> {(左操作数类型, 右操作数类型): fn(left, right)}，由 Operators.dispatch 填充
+DISPATCH = {op: {} for op in FAST_PATHS}
+
 
 class Operators:
     """处理所有运算符操作的类"""
-    
+
     def __init__(self, vm):
         self.vm = vm  # 保留对虚拟机实例的引用，用于函数调用等操作
-    
+        # (运算符, 记录类型) -> ``hook(left, right, env)``，调用记录中重载运算符的函数
+        self.hooks = {}
+
+    def dispatch(self, op, left, right, env):
+        """慢路径：为新的类型对查找并缓存快速路径，或调用字典重载的运算符"""
+        key = (type(left), type(right))
+        hook = self.hooks.get((op, key[0]))
+        if hook is not None:
+            return hook(left, right, env)
+        fn = FAST_PATHS[op](*key)
+        if fn is not None:
+            if not issubclass(key[1], Record):  # 全局的表不持有记录类型，见 records.py
+                DISPATCH[op][key] = fn
+            return fn(left, right)
+        if isinstance(left, dict):
+            method, verb = PROTOCOL[op]
+            if isinstance(left, Record) and method in key[0].fields:
+                hook = self.hooks[(op, key[0])] = self.record_hook(method, verb)
+                return hook(left, right, env)
+            if method in left:
+                return self.vm.handle_function_call(left[method], [left, right], env)
+            raise TypeError(f"Dictionaries cannot be {verb} directly unless they implement {method}")
+        raise TypeError(f"Unsupported operand type(s) for {op}")
+
+    def record_hook(self, method, verb):
+        call = self.vm.handle_function_call
+
+        def hook(left, right, env):
+            fn = left.get(method)
+            if fn is None:  # 记录创建后删除了这个键
+                raise TypeError(f"Dictionaries cannot be {verb} directly unless they implement {method}")
+            return call(fn, [left, right], env)
+        return hook
+
+    def apply(self, op, left, right, env):
+        fn = DISPATCH[op].get((type(left), type(right)))
+        if fn is not None:
+            return fn(left, right)
+        return self.dispatch(op, left, right, env)
+
     def add_operator(self, left, right, env):
-        if isinstance(left, (int, float)):
-            return left + right
-        elif isinstance(left, str):
-            return left + str(right)
-        elif isinstance(left, list):
-            if isinstance(right, list):
-                return left + right
-            raise TypeError("Cannot add non-list to a list")
-        elif isinstance(left, dict):
-            if '__add__' in left:
-                return self.vm.handle_function_call(left['__add__'], [left, right], env)
-            raise TypeError("Dictionaries cannot be added directly unless they implement __add__")
-        raise TypeError("Unsupported operand type(s) for +")
+        return self.apply('+', left, right, env)
 
     def sub_operator(self, left, right, env):
-        if isinstance(left, (int, float)):
-            return left - right
-        elif isinstance(left, dict):
-            if '__sub__' in left:
-                return self.vm.handle_function_call(left['__sub__'], [left, right], env)
-            raise TypeError("Dictionaries cannot be subtracted directly unless they implement __sub__")
-        raise TypeError("Unsupported operand type(s) for -")
+        return self.apply('-', left, right, env)
 
     def mul_operator(self, left, right, env):
-        if isinstance(left, (int, float)):
-            return left * right
-        elif isinstance(left, str):
-            return left * right
-        elif isinstance(left, list):
-            return left * right
-        elif isinstance(left, dict):
-            if '__mul__' in left:
-                return self.vm.handle_function_call(left['__mul__'], [left, right], env)
-            raise TypeError("Dictionaries cannot be multiplied directly unless they implement __mul__")
-        raise TypeError("Unsupported operand type(s) for *")
+        return self.apply('*', left, right, env)
 
     def div_operator(self, left, right, env):
-        if isinstance(left, (int, float)):
-            return left / right
-        elif isinstance(left, dict):
-            if '__div__' in left:
-                return self.vm.handle_function_call(left['__div__'], [left, right], env)
-            raise TypeError("Dictionaries cannot be divided directly unless they implement __div__")
-        raise TypeError("Unsupported operand type(s) for /")
+        return self.apply('/', left, right, env)
 
     def floordiv_operator(self, left, right, env):
-        if isinstance(left, (int, float)):
-            return left // right
-        elif isinstance(left, dict):
-            if '__floordiv__' in left:
-                return self.vm.handle_function_call(left['__floordiv__'], [left, right], env)
-            raise TypeError("Dictionaries cannot be floor divided directly unless they implement __floordiv__")
-        raise TypeError("Unsupported operand type(s) for //")
+        return self.apply('//', left, right, env)
 
     def mod_operator(self, left, right, env):
-        if isinstance(left, (int, float)):
-            return left % right
-        elif isinstance(left, dict):
-            if '__mod__' in left:
-                return self.vm.handle_function_call(left['__mod__'], [left, right], env)
-            raise TypeError("Dictionaries cannot be modulo divided directly unless they implement __mod__")
-        raise TypeError("Unsupported operand type(s) for %")
+        return self.apply('%', left, right, env)
 
     def pow_operator(self, left, right, env):
-        if isinstance(left, (int, float)):
-            return left ** right
-        elif isinstance(left, dict):
-            if '__pow__' in left:
-                return self.vm.handle_function_call(left['__pow__'], [left, right], env)
-            raise TypeError("Dictionaries cannot be exponentiated directly unless they implement __pow__")
-        raise TypeError("Unsupported operand type(s) for **")
+        return self.apply('**', left, right, env)
@@ -0,0 +1,143 @@
+"""
+语法树优化：预先解码字面量并折叠常量子表达式。
+
+- NUMBER/STRING 词法单元变为 ``literal`` 节点，其唯一子节点是解码后的 Python 值；
+- 操作数都是字面量的算术、比较、位运算和一元运算在编译前求值；
+- 条件为字面量的 ``?:``、``and``、``or`` 直接取对应分支；
+- 元素都是不可变字面量的列表和字典变为 ``const_list``/``const_dict``，执行时
+  复制一份，保证每次求值得到新的对象。
+
+求值出错（如除以 0）或结果过大的表达式保持原样，留到运行时处理。
+"""
+from lark.lexer import Token
+from lark.tree import Tree
+
+from operators import PY_OPERATORS, UNARY_OPERATORS, Operators
+
+# 折叠结果的大小上限，避免在编译期为可能不会执行的代码分配巨大的对象
+MAX_FOLDED_SIZE = 4096
+
+BINARY_NODES = {'additive_exp', 'mult_exp', 'bitwise_exp', 'equality_exp', 'relational_exp', 'shift_expression',
+                'power_exp'}
+
+_operators = Operators(None)
+
+
+def literal(value):
+    return Tree('literal', [value])
+
+
+def is_literal(node):
+    return isinstance(node, Tree) and node.data == 'literal'
+
+
+def decode(token):
+    """解码 NUMBER/STRING 词法单元"""
+    if token.type == 'NUMBER':
+        if '.' in token.value or 'e' in token.value or 'E' in token.value:
+            return float(token.value)
+        return int(token.value)
+    return token.value[1:-1]
+
+
+def small(value):
+    if isinstance(value, int):
+        return value.bit_length() <= MAX_FOLDED_SIZE
+    if isinstance(value, str):
+        return len(value) <= MAX_FOLDED_SIZE
+    return isinstance(value, (float, bool))
+
+
+def optimize(node):
+    """返回优化后的语法树，不修改原来的树"""
+    if isinstance(node, Token):
+        if node.type in ('NUMBER', 'STRING'):
+            return literal(decode(node))
+        return node
+    if not isinstance(node, Tree):
+        return node
+    children = [optimize(child) for child in node.children]
+    method = globals().get(f"fold_{node.data}")
+    if node.data in BINARY_NODES:
+        method = fold_binary
+    if method is not None:
+        folded = method(children)
+        if folded is not None:
+            return folded
+    return Tree(node.data, children, node._meta)
+
+
+def too_large(op, left, right):
+    """在求值之前排除结果显然过大的运算，如 ``1 << 10**9``、``2 ** 10**9``、``"a" * 10**9``"""
+    if type(right) is not int or type(left) is float:
+        return False
+    if op == '<<':
+        return right > MAX_FOLDED_SIZE
+    if op == '**':
+        return type(left) is int and abs(left) > 1 and left.bit_length() * right > MAX_FOLDED_SIZE
+    if op == '*':
+        return type(left) is str and len(left) * right > MAX_FOLDED_SIZE
+    return False
+
+
+def fold_binary(children):
+    left, op, right = children
+    if not (is_literal(left) and is_literal(right)):
+        return None
+    left, op, right = left.children[0], op.value, right.children[0]
+    if too_large(op, left, right):
+        return None
+    try:
+        if op in PY_OPERATORS:
+            value = PY_OPERATORS[op](left, right)
+        else:
+            value = _operators.apply(op, left, right, None)
+    except Exception:
+        return None
+    return literal(value) if small(value) else None
+
+
+def fold_unary_exp(children):
+    op, operand = children
+    if not is_literal(operand):
+        return None
+    try:
+        value = UNARY_OPERATORS[op.value](operand.children[0])
+    except Exception:
+        return None
+    return literal(value) if small(value) else None
+
+
+def fold_conditional_exp(children):
+    cond, then, else_ = children
+    if not is_literal(cond):
+        return None
+    return then if cond.children[0] else else_
+
+
+def fold_logical_or_exp(children):
+    left, right = children[0], children[-1]
+    if not is_literal(left):
+        return None
+    return left if left.children[0] else right
+
+
+def fold_logical_and_exp(children):
+    left, right = children[0], children[-1]
+    if not is_literal(left):
+        return None
+    return right if left.children[0] else left
+
+
+def fold_list(children):
+    items = [child for child in children if child is not None]
+    if not all(is_literal(item) for item in items):
+        return None
+    return Tree('const_list', [tuple(item.children[0] for item in items)])
+
+
+def fold_dict(children):
+    pairs = [pair for pair in children if pair is not None]
+    if not all(is_literal(pair.children[1]) for pair in pairs):
+        return None
+    return Tree('const_dict', [tuple((pair.children[0].value, pair.children[1].children[0]) for pair in pairs)])
@@ -0,0 +1,132 @@
+"""
+``pmap``：在进程池或线程池中并行执行 map。
+
+进程池的每个工作进程有自己的虚拟机。Loong 函数按 ``FuncDef.source`` 序列化：
+闭包后端传递参数名、优化后的函数体语法树和外层变量名，字节码后端传递
+CodeObject；外层变量的当前值作为状态一起传递，工作进程重新编译函数并把
+这些值绑定到新的全局环境中。因此工作进程看到的是调用 pmap 时外层变量的
+快照，在工作进程中对它们赋值不会影响调用者。Python 模块按名字重新导入，
+内置函数使用工作进程自己的。
+"""
+import importlib
+import io
+import os
+import pickle
+import types
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from loongast import Env
+
+MODES = ('process', 'thread')
+
+# 工作进程中按后端创建的虚拟机
+_vms = {}
+
+
+def worker_vm(backend='closure'):
+    vm = _vms.get(backend)
+    if vm is None:
+        from loong import VirtualMachine
+        vm = _vms[backend] = VirtualMachine(backend)
+    return vm
+
+
+def _global_env(env):
+    """FuncDef.env 所在的 Env：闭包后端的 (全局 Env, Cell...) 取第一项"""
+    return env[0] if isinstance(env, tuple) else env
+
+
+def _builtins_of(env):
+    """函数定义环境所在的内置名字层"""
+    env = _global_env(env)
+    while env is not None and not env.shadowable:
+        env = env.parent
+    return {} if env is None else env.variables
+
+
+def reduce_function(func):
+    """``FuncDef.__reduce__`` 的实现"""
+    if func.source is None:
+        raise pickle.PicklingError(f"{func!r} cannot be pickled")
+    names = func.source[-1]
+    builtins = _builtins_of(func.env)
+    state = {}
+    for name, value in zip(names, func.free_values()):
+        # 内置名字在工作进程中已经存在，不需要（往往也无法）传递
+        if builtins.get(name, state) is not value:
+            state[name] = value
+    # 状态在对象创建之后才序列化，递归函数引用自身时也能正确还原
+    return rebuild_function, (func.source,), state, None, None, bind_free
+
+
+def rebuild_function(source):
+    vm = worker_vm(source[0])
+    env = Env(vm.builtins_env)
+    if source[0] == 'closure':
+        _, params, node, _ = source
+        return vm.compiler.compile_detached(params, node, env)
+    return vm.interpreter.make_function(source[1], env)
+
+
+def bind_free(func, state):
+    _global_env(func.env).variables.update(state)
+
+
+def rebuild_memo(func, maxsize):
+    from loongbuiltins import Memoized
+    return Memoized(worker_vm(), func, maxsize)
+
+
+class _Pickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if isinstance(obj, types.ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        return NotImplemented
+
+
+def dumps(obj):
+    buffer = io.BytesIO()
+    _Pickler(buffer).dump(obj)
+    return buffer.getvalue()
+
+
+# 工作进程中反序列化后的函数
+_func = None
+
+
+def _init_worker(payload):
+    global _func
+    _func = pickle.loads(payload)
+
+
+def _run_chunk(chunk):
+    call = worker_vm().handle_function_call
+    return [call(_func, [x], None) for x in chunk]
+
+
+def pmap(vm, items, func, workers=None, mode='process', chunksize=None):
+    """
+    并行计算 ``[func(x) for x in items]``，结果保持输入顺序。
+
+    :param items: 任意可迭代对象，会先物化为列表。
+    :param func: Loong 函数或 Python 可调用对象。
+    :param workers: 工作进程/线程数，默认为 CPU 核数。
+    :param mode: ``"process"`` 适合 CPU 密集的函数；``"thread"`` 适合 I/O 密集的
+                 原生函数，不需要序列化。
+    :param chunksize: 每个任务包含的元素个数，默认把输入分成每个工作者约 4 块。
+    """
+    if mode not in MODES:
+        raise ValueError(f"pmap mode must be one of {', '.join(MODES)}, got '{mode}'")
+    items = list(items)
+    workers = workers or os.cpu_count() or 1
+    call = vm.handle_function_call
+    if workers == 1 or len(items) < 2:
+        return [call(func, [x], None) for x in items]
+    if mode == 'thread':
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(lambda x: call(func, [x], None), items))
+    chunksize = chunksize or max(1, -(-len(items) // (workers * 4)))
+    chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+    workers = min(workers, len(chunks))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(dumps(func),)) as executor:
+        return [y for chunk in executor.map(_run_chunk, chunks) for y in chunk]
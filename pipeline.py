@@ -0,0 +1,123 @@
+import vectorize
+from rope import plain
+
+# 第一次完整迭代时最多缓存的元素个数，更长的结果（例如逐行处理大文件）不缓存
+CACHE_LIMIT = 1 << 16
+
+
+class Pipeline:
+    """
+    ``|>`` 与 ``|?`` 产生的惰性序列。
+
+    相邻的 map/filter 阶段被合并到同一个 Pipeline 中，迭代时每个元素一次走完
+    所有阶段，不产生中间列表。只有在下标访问、打印、比较、取长度或调用
+    ``force()`` 时才物化为列表，因此生成器、文件对象等可以以常数内存流过管道。
+    源是大数值列表或 NumPy 数组时，纯算术阶段交给 vectorize 整体执行。
+
+    第一次完整迭代的结果不超过 CACHE_LIMIT 个元素时缓存为列表，之后的迭代不再执行
+    各阶段，只能迭代一次的源也可以重复使用；更长的结果不缓存，以免流式处理大文件时
+    占用与文件大小成正比的内存。作为语句（结果被丢弃）时管道立即执行，见 ``discard``。
+    需要列表的地方（``let [a, b] = ...``、``+``/``*``、程序的结果）先调用
+    ``materialize`` 物化；传给 Python 函数的参数不物化，函数得到的是可迭代的管道本身。
+
+    :param source: 任意可迭代对象。
+    :param stages: ``(is_filter, func)`` 组成的元组。
+    :param call: 调用 Loong 函数的方法，即 ``vm.handle_function_call``。
+    :param env: 调用函数时传递的环境。
+    """
+
+    def __init__(self, source, stages, call, env):
+        self.source = source
+        self.stages = stages
+        self.call = call
+        self.env = env
+        self.items = None  # 物化后的列表
+
+    @classmethod
+    def stage(cls, source, is_filter, func, call, env):
+        """在 source 之后追加一个阶段；source 是尚未物化的 Pipeline 时与之合并"""
+        if isinstance(source, Pipeline) and source.items is None:
+            return cls(source.source, source.stages + ((is_filter, func),), call, env)
+        return cls(source, ((is_filter, func),), call, env)
+
+    def __iter__(self):
+        if self.items is not None:
+            return iter(self.items)
+        return self.record()
+
+    def record(self):
+        """迭代各阶段的结果，完整迭代一次后缓存不太长的结果"""
+        items = []
+        for x in self.stream():
+            if items is not None:
+                items.append(x)
+                if len(items) > CACHE_LIMIT:
+                    items = None
+            yield x
+        if items is not None and self.items is None:
+            self.items = items
+
+    def stream(self):
+        call, env = self.call, self.env
+        # 大数值列表先尽可能用 NumPy 执行前面的阶段
+        source, stages = vectorize.apply(self.source, self.stages)
+        if not stages:
+            yield from source
+            return
+        if len(stages) == 1:
+            is_filter, func = stages[0]
+            if is_filter:
+                for x in source:
+                    if call(func, [x], env):
+                        yield x
+            else:
+                for x in source:
+                    yield plain(call(func, [x], env))
+            return
+        for x in source:
+            for is_filter, func in stages:
+                if is_filter:
+                    if not call(func, [x], env):
+                        break
+                else:
+                    x = call(func, [x], env)
+            else:
+                yield plain(x)
+
+    def force(self):
+        """物化为列表并缓存"""
+        if self.items is None:
+            source, stages = vectorize.apply(self.source, self.stages)
+            if not stages and isinstance(source, list):
+                self.items = source
+            else:
+                self.items = list(Pipeline(source, stages, self.call, self.env).stream() if stages else source)
+        return self.items
+
+    def __getitem__(self, index):
+        return self.force()[index]
+
+    def __len__(self):
+        return len(self.force())
+
+    def __eq__(self, other):
+        if isinstance(other, Pipeline):
+            other = other.force()
+        return self.force() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.force())
+
+
+def materialize(value):
+    """Pipeline 物化为列表，其他值原样返回"""
+    return value.force() if type(value) is Pipeline else value
+
+
+def discard(value):
+    """表达式语句的值被丢弃：Pipeline 在这里执行，各阶段的副作用不会丢失"""
+    if type(value) is Pipeline:
+        for _ in value:
+            pass
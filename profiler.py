@@ -0,0 +1,148 @@
+"""
+Loong 级别的性能分析器。
+
+开启分析时，编译器把每个 Loong 函数体和每个语法节点的闭包包装一层计时代码
+（见 ``Compiler.compile`` 与 ``Compiler.compile_function``）；关闭时不做任何
+包装，没有额外开销。统计结果按函数名（匿名函数为 ``<lambda:行:列>``）和
+节点类型汇总，并记录函数调用栈，可以导出为 flamegraph.pl、speedscope 等
+工具使用的 collapsed-stack 格式。
+
+尾调用由蹦床执行，被尾调用的函数在调用栈中与调用者并列而不是嵌套在其下。
+分析器不是线程安全的，pmap 工作进程中的时间不计入。
+"""
+import time
+from collections import Counter
+
+from lark.lexer import Token
+from lark.tree import Tree
+
+
+def first_token(node):
+    if isinstance(node, Token):
+        return node
+    if isinstance(node, Tree):
+        for child in node.children:
+            token = first_token(child)
+            if token is not None:
+                return token
+    return None
+
+
+def lambda_name(node):
+    """匿名函数的名字，带上其中第一个词法单元的位置"""
+    token = first_token(node)
+    if token is None or token.line is None:
+        return "<lambda>"
+    return f"<lambda:{token.line}:{token.column}>"
+
+
+class Stat:
+    """一个函数或一种节点的统计：调用次数、累计时间（递归时只算最外层）和自身时间"""
+
+    __slots__ = ('calls', 'total', 'self', 'active')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.self = 0.0
+        self.active = 0  # 正在执行的层数，用于识别递归
+
+
+class Profiler:
+    """
+    :param clock: 计时函数，默认为 ``time.perf_counter``。
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.functions = {}
+        self.nodes = {}
+        self.stacks = Counter()  # collapsed stack -> 自身时间（秒）
+        self._frames = []  # 函数调用栈：[名字, 子函数耗时]
+        self._node_times = []  # 节点栈：子节点耗时
+
+    def clear(self):
+        self.functions.clear()
+        self.nodes.clear()
+        self.stacks.clear()
+
+    def stat(self, table, key):
+        stat = table.get(key)
+        if stat is None:
+            stat = table[key] = Stat()
+        return stat
+
+    def wrap_function(self, name, body):
+        """包装 ``body(env, args)``，按函数统计时间并记录调用栈"""
+        stat = self.stat(self.functions, name)
+        frames, stacks, clock = self._frames, self.stacks, self.clock
+
+        def profiled_body(env, args):
+            frame = [name, 0.0]
+            frames.append(frame)
+            stat.calls += 1
+            stat.active += 1
+            start = clock()
+            try:
+                return body(env, args)
+            finally:
+                elapsed = clock() - start
+                stat.active -= 1
+                if not stat.active:
+                    stat.total += elapsed
+                stat.self += elapsed - frame[1]
+                stacks[";".join(f[0] for f in frames)] += elapsed - frame[1]
+                frames.pop()
+                if frames:
+                    frames[-1][1] += elapsed
+        return profiled_body
+
+    def wrap_node(self, kind, fn):
+        """包装节点闭包 ``fn(env)``，按节点类型统计时间"""
+        stat = self.stat(self.nodes, kind)
+        times, clock = self._node_times, self.clock
+
+        def profiled_node(env):
+            times.append(0.0)
+            stat.calls += 1
+            stat.active += 1
+            start = clock()
+            try:
+                return fn(env)
+            finally:
+                elapsed = clock() - start
+                stat.active -= 1
+                if not stat.active:
+                    stat.total += elapsed
+                stat.self += elapsed - times.pop()
+                if times:
+                    times[-1] += elapsed
+        return profiled_node
+
+    def run(self, name, fn, *args):
+        """以 name 作为一层调用栈执行 ``fn(*args)``，用于顶层代码"""
+        return self.wrap_function(name, lambda env, args: fn(*args))(None, args)
+
+    def table(self, stats, top):
+        rows = sorted(stats.items(), key=lambda item: item[1].self, reverse=True)[:top]
+        width = max([len(str(key)) for key, _ in rows] + [4])
+        lines = [f"{'name':<{width}} {'calls':>10} {'self(s)':>10} {'total(s)':>10}"]
+        for key, stat in rows:
+            lines.append(f"{key:<{width}} {stat.calls:>10} {stat.self:>10.4f} {stat.total:>10.4f}")
+        return "\n".join(lines)
+
+    def report(self, top=20):
+        """按自身时间排序的前 top 个函数和节点类型"""
+        parts = ["functions:", self.table(self.functions, top)]
+        if self.nodes:
+            parts += ["", "nodes:", self.table(self.nodes, top)]
+        return "\n".join(parts)
+
+    def collapsed(self):
+        """collapsed-stack 格式的文本，每行 ``a;b;c 微秒数``"""
+        return "".join(f"{stack} {round(seconds * 1e6)}\n"
+                       for stack, seconds in sorted(self.stacks.items()) if seconds > 0)
+
+    def write_collapsed(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
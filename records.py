@@ -0,0 +1,58 @@
+"""
+字典字面量的隐藏类（shape）。
+
+Loong 程序把键固定的字典字面量当作对象使用，例如 rat.loo 中的
+``{num: ..., denom: ..., __add__: ...}``。字典字面量的键在编译期就已确定，每组键
+（按书写顺序）对应一个共享的 Record 子类，即它的 shape。同一个字面量创建的所有
+记录类型相同，运算符重载等按类型缓存的查找在第一次之后只需一次字典查找。
+
+Record 仍然是 dict 的子类，数据保存在字典本身中：Python 互操作、``json``、
+``pretty_var`` 和相等比较都与普通字典一致。记录创建后增删键不会改变它的类型，
+shape 只是一个提示，按 shape 缓存的结果在使用时仍然检查字典的实际内容。属性访问
+``a.num`` 的调用点记住上一次遇到的 shape，命中时直接取字典项（见 inlinecache.py）。
+
+注册表只弱引用记录类型：编译出的代码和记录本身持有它们的类型，不再使用的 shape
+（例如 ``records()`` 读过的各种 CSV 表头）随之回收，注册表不会无限增长。
+"""
+import copyreg
+import weakref
+
+# 键元组 -> Record 子类
+_shapes = weakref.WeakValueDictionary()
+
+
+class Shape(type):
+    """记录类型的元类，使动态生成的记录类型可以按键序列化（字节码的常量表中有记录类型）"""
+
+
+class Record(dict, metaclass=Shape):
+    """由字典字面量创建的字典，具体的类型由 ``record_type`` 按键生成"""
+    __slots__ = ()
+
+    # 字面量中的键，按书写顺序
+    fields = ()
+
+    def __reduce__(self):
+        # 动态生成的子类无法按名字序列化，按当前的键重建；字典项在对象创建之后才设置，
+        # 记录间接引用自身时也能正确还原
+        return _empty_record, (tuple(self),), None, None, iter(self.items())
+
+
+def record_type(keys):
+    """返回键为 keys（元组）的记录类型，同样的键总是得到同一个类型"""
+    cls = _shapes.get(keys)
+    if cls is None:
+        # 多个线程同时创建时只保留第一个
+        cls = _shapes.setdefault(keys, type('Record', (Record,), {'__slots__': (), 'fields': keys}))
+    return cls
+
+
+def _empty_record(keys):
+    return record_type(keys)()
+
+
+def _reduce_shape(cls):
+    return 'Record' if cls is Record else (record_type, (cls.fields,))
+
+
+copyreg.pickle(Shape, _reduce_shape)
@@ -0,0 +1,241 @@
+"""
+词法地址解析：在编译期为每个名字确定 (depth, slot) 地址。
+
+``depth`` 是名字所在的作用域在第几层外层函数，``slot`` 是该作用域栈帧中的下标。
+顶层（全局）变量以及 ``@module*`` 导入的名字仍保存在以字典为后端的 Env 中，按名字查找。
+函数体中的 ``@module;`` 把模块绑定到一个局部槽位；``@module*;`` 和 ``@_;`` 导入的名字
+只有在运行时才知道，函数内没有槽位的名字先在这些模块中查找，再查找全局环境。
+
+闭包编译器的函数栈帧是定长列表 ``[closure, 参数..., 局部变量...]``。闭包不引用
+定义它的整个栈帧，而是 ``(全局 Env, Cell...)``：编译前的自由变量分析找出函数体
+引用了哪些外层局部变量（captures），以及哪些局部变量被内层函数引用（cells）。
+后者在栈帧中保存为 Cell，由定义它的函数和内层闭包共享。
+"""
+import builtins
+
+from lark.lexer import Token
+from lark.tree import Tree
+
+# 已分配但尚未执行 let 的槽位
+UNDEFINED = object()
+
+# 语句节点，其余的节点都是表达式
+STATEMENT_NODES = {'import_stmt', 'let_stmt', 'let_multi_stmt', 'assign_stmt', 'func_def', 'async_func_def'}
+
+FUNCTION_NODES = {'func_def', 'func_expr', 'short_func_expr',
+                  'async_func_def', 'async_func_expr', 'async_short_func_expr'}
+
+
+def declared_names(node):
+    """返回语句块中直接声明的名字：(let 声明的名字, def 声明的名字, import 的名字)"""
+    lets, defs, imports = [], [], []
+    if not (isinstance(node, Tree) and node.data == 'statements'):
+        return lets, defs, imports
+    for stmt in node.children:
+        if not isinstance(stmt, Tree):
+            continue
+        if stmt.data == 'let_stmt':
+            lets.append(stmt.children[0].value)
+        elif stmt.data == 'let_multi_stmt':
+            lets.extend(name.value for name in stmt.children[:-1])
+        elif stmt.data in ('func_def', 'async_func_def'):
+            defs.append(stmt.children[0].value)
+        elif stmt.data == 'import_stmt':
+            imports.append(stmt)
+    return lets, defs, imports
+
+
+def function_parts(node):
+    """返回函数节点的 (参数名列表, 函数体)"""
+    if node.data in ('func_def', 'async_func_def'):
+        params, body = node.children[1], node.children[2]
+    elif node.data in ('func_expr', 'async_func_expr'):
+        params, body = node.children
+    else:  # short_func_expr, async_short_func_expr
+        return [node.children[0].value], node.children[1]
+    return [param.value for param in params.children if param is not None], body
+
+
+def scan(node):
+    """
+    自由变量分析。
+
+    :return: (names, captured)：node 中引用的名字（不包括内部函数自己绑定的名字），
+             以及其中在内部函数中引用的名字。
+    """
+    names, captured = set(), set()
+    _scan(node, names, captured)
+    return names, captured
+
+
+def _scan(node, names, captured):
+    if isinstance(node, Token):
+        if node.type == 'NAME':
+            names.add(node.value)
+        return
+    if not isinstance(node, Tree):  # 优化后的字面量
+        return
+    kind = node.data
+    if kind in FUNCTION_NODES:
+        free = free_names(*function_parts(node))
+        names.update(free)
+        captured.update(free)
+    elif kind in ('let_stmt', 'let_multi_stmt'):
+        _scan(node.children[-1], names, captured)
+    elif kind == 'prop_access':
+        _scan(node.children[0], names, captured)
+    elif kind == 'pair':
+        _scan(node.children[1], names, captured)
+    elif kind != 'import_stmt':
+        for child in node.children:
+            _scan(child, names, captured)
+
+
+def free_names(params, body):
+    """函数体引用的外层名字"""
+    names, _ = scan(body)
+    lets, defs, _ = declared_names(body)
+    return names.difference(params, lets, defs)
+
+
+def is_star_import(stmt):
+    return len(stmt.children) > 1 and stmt.children[1] is not None and stmt.children[1].value == '*'
+
+
+# ``@_;`` 导入的名字，只计算一次
+BUILTIN_NAMES = frozenset(name for name in dir(builtins) if not name.startswith("_"))
+
+
+class GlobalScope:
+    """
+    顶层作用域，对应以字典为后端的 Env。
+
+    :param env: 编译时的全局环境，用于静态检查已存在的名字。
+    :param node: 顶层语句块。
+    :param dynamic: 为 True 时，无法静态确定的名字推迟到运行时报错。
+    """
+
+    def __init__(self, env, node, dynamic=False):
+        self.parent = None
+        self.env = env
+        self.dynamic = dynamic
+        self.names = set()
+        self.builtins = False  # 是否有 @_;
+        lets, defs, imports = declared_names(node)
+        for name in lets:
+            if name in self.names or env.defines(name):
+                raise Exception(f"Variable '{name}' is already defined")
+            self.names.add(name)
+        self.names.update(defs)
+        for stmt in imports:
+            module_name = stmt.children[0].value
+            if module_name == '_':
+                self.builtins = True
+                self.names.add('_')
+            elif is_star_import(stmt):
+                # 星号导入的名字只有在运行时才知道
+                self.dynamic = True
+            else:
+                self.names.add(module_name)
+
+    def declares(self, name):
+        return name in self.names or (self.builtins and name in BUILTIN_NAMES)
+
+    def is_visible(self, name):
+        return self.declares(name) or self.env.defines(name)
+
+    def is_defined(self, name):
+        return self.dynamic or self.declares(name) or self.env.lookup(name)[0]
+
+
+class FunctionScope:
+    """
+    函数作用域，对应一个定长列表栈帧。
+
+    :param parent: 外层作用域。
+    :param params: 参数名列表，占用槽位 1..n。
+    :param body: 函数体，其中 let/def 声明的名字和导入的模块名依次分配后续槽位。
+    """
+
+    def __init__(self, parent, params, body):
+        self.parent = parent
+        self.slots = {}
+        self.free = set()  # 编译时函数体实际解析到的外层名字
+        for name in params:
+            self.slots[name] = len(self.slots) + 1
+        self.nparams = len(self.slots)
+        self.stars = []  # 星号导入的模块名，后导入的在前
+        lets, defs, imports = declared_names(body)
+        for name in lets:
+            if name in self.slots or parent_visible(parent, name):
+                raise Exception(f"Variable '{name}' is already defined")
+            self.slots[name] = len(self.slots) + 1
+        for name in defs:
+            # def 允许重复定义和遮蔽外层名字
+            self.slots.setdefault(name, len(self.slots) + 1)
+        for stmt in imports:
+            module_name = stmt.children[0].value
+            if module_name == '_' or is_star_import(stmt):
+                self.stars.insert(0, module_name)
+            if not is_star_import(stmt):  # @_; 同时绑定 _
+                self.slots.setdefault(module_name, len(self.slots) + 1)
+        names, captured = scan(body)
+        # 被内层函数引用的局部变量保存为 Cell
+        self.cells = sorted(self.slots[name] for name in captured if name in self.slots)
+        # 引用的外层函数的局部变量，值是在闭包 (全局 Env, Cell...) 中的下标
+        self.captures = {}
+        for name in sorted(names.difference(self.slots)):
+            if function_visible(parent, name):
+                self.captures[name] = len(self.captures) + 1
+
+    @property
+    def nlocals(self):
+        return len(self.slots) - self.nparams
+
+
+def function_visible(scope, name):
+    """name 是否是外层某个函数的局部变量"""
+    while isinstance(scope, FunctionScope):
+        if name in scope.slots:
+            return True
+        scope = scope.parent
+    return False
+
+
+def parent_visible(scope, name):
+    while isinstance(scope, FunctionScope):
+        if name in scope.slots:
+            return True
+        scope = scope.parent
+    return scope.is_visible(name)
+
+
+def star_modules(scope):
+    """scope 及其外层函数中星号导入的模块名，内层的在前"""
+    stars = []
+    while isinstance(scope, FunctionScope):
+        stars.extend(scope.stars)
+        scope = scope.parent
+    return tuple(stars)
+
+
+def resolve(scope, name):
+    """
+    解析名字的地址。
+
+    :return: (depth, slot, scope)；scope 是名字所在的作用域。全局名字的 slot 为 None，
+             depth 为到达全局环境需要走的层数。
+    """
+    depth = 0
+    stars = False
+    while isinstance(scope, FunctionScope):
+        slot = scope.slots.get(name)
+        if slot is not None:
+            return depth, slot, scope
+        scope.free.add(name)
+        stars = stars or bool(scope.stars)
+        scope = scope.parent
+        depth += 1
+    if not stars and not scope.is_defined(name):
+        raise NameError(f"Variable '{name}' not defined in the environment.")
+    return depth, None, scope
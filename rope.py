@@ -0,0 +1,123 @@
+"""
+字符串拼接的 rope。
+
+Python 的 ``left + right`` 每次都复制两个字符串，Loong 程序逐段拼接输出（报表、CSV
+等）时总耗时是 O(n²)。``+`` 的结果不短于 ROPE_THRESHOLD 时不再复制，而是返回
+一个记录左右两部分的 Rope，拼接只需 O(1)。
+
+Rope 在 Loong 代码中的行为与 str 一致：比较、哈希、下标、迭代、``len`` 和方法调用
+都作用于展开后的字符串。展开在第一次需要时进行，结果缓存在 Rope 中。Rope 只存在于
+局部变量和表达式的中间结果中：放进列表、字典（字面量、下标和属性赋值、``|>`` 的
+结果）时先展开，传给 Python 函数的参数和 ``VirtualMachine.eval`` 的返回值也会先
+展开为 str。因此容器中不会有 Rope，调用 Python 函数时只需检查顶层参数，Python
+代码不会看到 Rope。
+"""
+# 拼接结果短于这个长度时直接返回 str，短字符串的复制比创建节点更快
+ROPE_THRESHOLD = 1024
+
+
+class Rope:
+    """两个字符串（或 Rope）的拼接，``flatten`` 返回对应的 str"""
+    __slots__ = ('left', 'right', 'length', 'flat')
+
+    def __init__(self, left, right, length):
+        self.left = left
+        self.right = right
+        self.length = length
+        self.flat = None
+
+    def flatten(self):
+        flat = self.flat
+        if flat is None:
+            # 左深或右深的 Rope 都可能有上万层，不能递归
+            pieces = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if type(node) is str:
+                    pieces.append(node)
+                elif node.flat is not None:
+                    pieces.append(node.flat)
+                else:
+                    stack.append(node.right)
+                    stack.append(node.left)
+            flat = self.flat = ''.join(pieces)
+            self.left, self.right = flat, ''  # 释放子节点
+        return flat
+
+    def __str__(self):
+        return self.flatten()
+
+    def __repr__(self):
+        return repr(self.flatten())
+
+    def __format__(self, spec):
+        return format(self.flatten(), spec)
+
+    def __len__(self):
+        return self.length
+
+    def __hash__(self):
+        return hash(self.flatten())
+
+    def __eq__(self, other):
+        return self.flatten() == plain(other)
+
+    def __ne__(self, other):
+        return self.flatten() != plain(other)
+
+    def __lt__(self, other):
+        return self.flatten() < plain(other)
+
+    def __le__(self, other):
+        return self.flatten() <= plain(other)
+
+    def __gt__(self, other):
+        return self.flatten() > plain(other)
+
+    def __ge__(self, other):
+        return self.flatten() >= plain(other)
+
+    def __getitem__(self, key):
+        return self.flatten()[key]
+
+    def __iter__(self):
+        return iter(self.flatten())
+
+    def __contains__(self, item):
+        return plain(item) in self.flatten()
+
+    def __mul__(self, n):
+        return self.flatten() * n
+
+    __rmul__ = __mul__
+
+    def __getattr__(self, name):
+        # 字符串方法，如 rope.upper()
+        return getattr(self.flatten(), name)
+
+    def __reduce__(self):
+        # 序列化为普通字符串，pmap 的工作进程和解析缓存中不会出现 Rope
+        return str, (self.flatten(),)
+
+
+def plain(value):
+    """Rope 展开为 str，其他值原样返回"""
+    return value.flatten() if type(value) is Rope else value
+
+
+def plain_args(args):
+    """传给 Python 函数的参数列表：其中有 Rope 时返回展开后的新列表"""
+    for value in args:
+        if type(value) is Rope:
+            return [plain(value) for value in args]
+    return args
+
+
+def concat(left, right):
+    """拼接两个 str 或 Rope"""
+    length = (left.length if type(left) is Rope else len(left)) + \
+        (right.length if type(right) is Rope else len(right))
+    if length < ROPE_THRESHOLD:
+        return left + right  # Rope 不短于 ROPE_THRESHOLD，这里两边都是 str
+    return Rope(left, right, length)
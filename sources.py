@@ -0,0 +1,189 @@
+"""
+流式的文件数据源：内置函数 ``lines``、``chunks`` 和 ``records``。
+
+它们返回惰性的、可以重复迭代的对象，每次迭代重新打开文件并逐块读取。放在
+``|>``/``|?`` 之前时整个管道以常数内存处理任意大的文件::
+
+    lines("app.log") |? (l => l.startswith("ERROR")) |> (l => l.split(" ")[2])
+
+``use_mmap`` 为真时通过内存映射读取：``chunks`` 产生映射上的 memoryview 切片，
+不复制数据；``lines`` 和 ``records`` 按块解码映射的内容，省去文件对象的缓冲区。
+处理过的页随即交还内核，映射大文件时常驻内存也不随文件大小增长。
+"""
+import csv
+import mmap
+import os
+import re
+
+from records import record_type
+
+# 按行读取映射时每次解码的字节数
+MAPPED_BLOCK = 1 << 20
+
+# 一行连同行尾；与文本模式一样，\r\n、\r 和 \n 都是行尾
+_LINE = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+
+def _mapped(f):
+    """只读映射整个文件；空文件不能映射，返回 None"""
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _release(mm, start, end):
+    """
+    处理完 [start, end) 之后让内核回收映射的这些页。只读映射的页被回收后再访问时会
+    从文件重新读入，因此这只影响内存占用，不影响仍然持有切片的代码。
+    """
+    if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+        # 缺页时内核会顺带映射相邻的页，包括前面已经回收的页，因此从前一块开始回收
+        start = max(0, start - MAPPED_BLOCK)
+        start -= start % mmap.PAGESIZE
+        if end > start:
+            mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def _line_end(mm, pos, end):
+    """[pos, end) 中最后一个行尾的下标；没有时向后找到下一个行尾，直到文件末尾返回 -1"""
+    # 只在 end - 1 之前找 \r：后面紧跟的 \n 也在块内，\r\n 的结尾由 \n 决定
+    cut = max(mm.rfind(b'\n', pos, end), mm.rfind(b'\r', pos, end - 1))
+    if cut >= 0:
+        return cut
+    newline, cr = mm.find(b'\n', end), mm.find(b'\r', end)
+    if cr < 0 or 0 <= newline <= cr + 1:
+        return newline
+    return cr
+
+
+def _mapped_blocks(mm, encoding):
+    """按块解码映射的内容，每块都在行尾结束"""
+    size = len(mm)
+    pos = 0
+    while pos < size:
+        end = min(pos + MAPPED_BLOCK, size)
+        if end < size:
+            # 一行比块还长时找到它的结尾为止
+            cut = _line_end(mm, pos, end)
+            end = size if cut < 0 else cut + 1
+        yield mm[pos:end].decode(encoding)
+        _release(mm, pos, end)
+        pos = end
+
+
+def _mapped_lines(mm, encoding):
+    for text in _mapped_blocks(mm, encoding):
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if text.endswith('\n'):
+            text = text[:-1]
+        yield from text.split('\n')
+
+
+class Source:
+    """
+    文件数据源的基类，子类实现 ``iterate(f)``（读取文件对象）和
+    ``iterate_mapped(mm)``（读取内存映射）。
+
+    :param path: 文件路径。
+    :param use_mmap: 是否通过内存映射读取。
+    :param encoding: 文本的编码，二进制的数据源忽略。
+    """
+    binary = False
+    newline = None  # 文本模式打开文件时的 newline 参数
+
+    def __init__(self, path, use_mmap=False, encoding='utf-8'):
+        self.path = path
+        self.use_mmap = bool(use_mmap)
+        self.encoding = encoding
+
+    def __iter__(self):
+        if self.binary or self.use_mmap:
+            f = open(self.path, 'rb')
+        else:
+            f = open(self.path, 'r', encoding=self.encoding, newline=self.newline)
+        # 生成器在迭代结束或被回收时关闭文件，提前结束的管道不会泄漏文件
+        with f:
+            if not self.use_mmap:
+                yield from self.iterate(f)
+                return
+            mm = _mapped(f)
+            if mm is None:
+                return
+            try:
+                yield from self.iterate_mapped(mm)
+            finally:
+                try:
+                    mm.close()
+                except BufferError:
+                    pass  # chunks 产生的切片仍在使用，映射随最后一个切片一起回收
+
+    def __repr__(self):
+        return f"{type(self).__name__.lower()}({self.path!r})"
+
+
+class Lines(Source):
+    """``lines(path, use_mmap, encoding)``：逐行产生字符串，不含行尾的换行符"""
+
+    def iterate(self, f):
+        for line in f:
+            yield line[:-1] if line.endswith('\n') else line
+
+    def iterate_mapped(self, mm):
+        return _mapped_lines(mm, self.encoding)
+
+
+class Chunks(Source):
+    """``chunks(path, size, use_mmap)``：产生最长 size 字节的块，映射时是 memoryview"""
+    binary = True
+
+    def __init__(self, path, size=1 << 16, use_mmap=False):
+        super().__init__(path, use_mmap)
+        if size <= 0:
+            raise ValueError("chunk size must be positive")
+        self.size = size
+
+    def iterate(self, f):
+        read, size = f.read, self.size
+        chunk = read(size)
+        while chunk:
+            yield chunk
+            chunk = read(size)
+
+    def iterate_mapped(self, mm):
+        view = memoryview(mm)
+        for pos in range(0, len(view), self.size):
+            yield view[pos:pos + self.size]
+            _release(mm, pos, min(pos + self.size, len(view)))
+
+
+class Records(Lines):
+    """
+    ``records(path, sep, header, use_mmap, encoding)``：按 csv 规则拆分每一行。
+
+    header 为真时第一行是字段名，之后的每一行是以字段名为键的记录（同一个文件的
+    记录共享记录类型，见 records.py），否则每一行是字段的列表。引号中的字段可以包含
+    换行符，因此交给 csv 的是带行尾的原始行，而不是 ``lines`` 拆分后的结果。
+    """
+    newline = ''  # csv 模块自己处理行尾
+
+    def __init__(self, path, sep=',', header=False, use_mmap=False, encoding='utf-8'):
+        super().__init__(path, use_mmap, encoding)
+        self.sep = sep
+        self.header = bool(header)
+
+    def rows(self, lines):
+        reader = csv.reader(lines, delimiter=self.sep)
+        if not self.header:
+            yield from reader
+            return
+        fields = tuple(next(reader, ()))
+        cls = record_type(fields)
+        for row in reader:
+            yield cls(zip(fields, row))
+
+    def iterate(self, f):
+        return self.rows(f)
+
+    def iterate_mapped(self, mm):
+        return self.rows(line for text in _mapped_blocks(mm, self.encoding) for line in _LINE.findall(text))
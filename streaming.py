@@ -0,0 +1,72 @@
+"""
+逐条解析并执行顶层语句。
+
+``process_file`` 先读入整个文件、构造整棵语法树再执行，巨大的生成文件（例如包含
+大列表、大字典字面量的配置）同时占用源码和整棵树的内存，而且整个文件解析完才
+开始执行。``split_statements`` 逐行读取源码，用一个只识别字符串、注释、括号和
+``def``/``end`` 的扫描器找出顶层语句的边界；``VirtualMachine.process_stream`` 每
+得到一条完整的语句就解析、执行，随后丢弃它的源码和语法树。
+
+Loong 的字符串和注释都不跨行，扫描器可以逐行工作。每条语句编译时之后的语句还
+没有读入，因此全局名字推迟到运行时查找：函数仍然可以调用之后才定义的函数，
+但拼错的全局名字要到执行时才报错。
+"""
+import re
+
+from lark.exceptions import UnexpectedInput
+
+# 扫描器关心的词法单元：字符串、注释、单词，其余的非空白字符逐个匹配
+TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|#.*|\w+|\S')
+OPEN = {'(', '[', '{', 'def'}
+CLOSE = {')', ']', '}', 'end'}
+
+
+def is_func_def(head):
+    """语句的前几个单词是否是 ``def name`` 或 ``async def name``，这种语句以 end 结束"""
+    if head[:1] == ['async']:
+        head = head[1:]
+    return len(head) >= 2 and head[0] == 'def' and head[1] not in OPEN and head[1] not in CLOSE
+
+
+def split_statements(lines):
+    """
+    把源码行切分为顶层语句。
+
+    :return: 生成 ``(源码, 起始行号, 是否是结尾的表达式)``，最后一项总是结尾的表达式，
+             文件以语句结束时它是空白。
+    """
+    pending = []  # 当前语句已读入的部分
+    head = []  # 当前语句的前三个词法单元
+    depth = 0
+    start = 1
+    for lineno, line in enumerate(lines, 1):
+        pos = 0
+        for match in TOKEN.finditer(line):
+            token = match.group()
+            if token[0] in '"#':
+                continue
+            if not head:
+                # 语句之前的空白和注释不保留
+                pending, pos, start = [], match.start(), lineno
+            if len(head) < 3:
+                head.append(token)
+            if token in OPEN:
+                depth += 1
+            elif token in CLOSE:
+                depth -= 1
+            if depth == 0 and (token == ';' or token == 'end' and is_func_def(head)):
+                pending.append(line[pos:match.end()])
+                yield ''.join(pending), start, False
+                pending, head, pos = [], [], match.end()
+        pending.append(line[pos:])
+    yield ''.join(pending), start, True
+
+
+def parse_statement(parser, text, lineno):
+    """解析一条语句，语法错误中的行号换算为在文件中的行号"""
+    try:
+        return parser.parse(text)
+    except UnexpectedInput as e:
+        if isinstance(e.line, int) and e.line > 0:
+            e.line += lineno - 1
+        raise
@@ -1,6 +1,27 @@
+import asyncio
+import contextlib
 import csv
+import gc
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import vectorize
+import weakref
+from optimizer import optimize
+from pretty import pretty_var
+from records import Record, record_type
+from budget import Budget, BudgetExceeded
 from loong import VirtualMachine, parser
+from loongclient import request
 from colorama import init, Fore, Style
+from lark.exceptions import UnexpectedInput
 from termcolor import colored
 
 def parse_test_cases(file_path):
@@ -43,9 +64,9 @@ def parse_test_cases(file_path):
 
     return test_cases
 
-def test_loong():
+def run_test_cases(backend):
     init()  # 初始化 colorama
-    vm = VirtualMachine()
+    vm = VirtualMachine(backend)
 
     # 从CSV文件加载测试用例
     test_cases = parse_test_cases("test_cases.tsv")
@@ -53,7 +74,7 @@ def test_loong():
     for i, test in enumerate(test_cases):
         try:
             if test["input"] == '-':
-                vm = VirtualMachine()
+                vm = VirtualMachine(backend)
                 print(colored(f"### {test['expected']} ###", 'cyan'))
                 continue
 
@@ -67,7 +88,549 @@ def test_loong():
             print(colored(f"Input: {test['input']}", 'red'))
             exit(-1)
 
-    print(colored("All test cases passed!", 'green'))
+    print(colored(f"All test cases passed! ({backend})", 'green'))
+
+def test_loong():
+    run_test_cases('closure')
+
+def test_loong_bytecode():
+    run_test_cases('bytecode')
+
+def test_loong_python():
+    run_test_cases('python')
+
+def run_differential(backends):
+    """差分测试：在多个后端上执行 test_cases.tsv，比较各后端的结果或异常类型，不看期望值"""
+    init()
+    test_cases = parse_test_cases("test_cases.tsv")
+    vms = {backend: VirtualMachine(backend) for backend in backends}
+    mismatches = []
+    for test in test_cases:
+        if test["input"] == '-':
+            vms = {backend: VirtualMachine(backend) for backend in backends}
+            continue
+        outcomes = {}
+        for backend, vm in vms.items():
+            try:
+                outcomes[backend] = repr(vm.eval(parser.parse(test["input"])))
+            except Exception as e:
+                outcomes[backend] = f"{type(e).__name__} raised"
+        if len(set(outcomes.values())) > 1:
+            mismatches.append(test["input"])
+            print(colored(f"Mismatch: {test['input']}", 'red'))
+            for backend, outcome in outcomes.items():
+                print(colored(f"  {backend}: {outcome}", 'red'))
+    if not mismatches:
+        print(colored(f"All backends agree! ({', '.join(backends)})", 'green'))
+    return mismatches
+
+def test_differential():
+    assert run_differential(VirtualMachine.BACKENDS) == []
+    # 结果不依赖进程中之前编译过的程序：缓存的代码在新的全局环境中重新检查名字
+    code = 'def f(): let x = 1; x end f()'
+    assert VirtualMachine('python').eval(parser.parse(code)) == 1
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend)
+        vm.global_env.set('x', 5)
+        try:
+            vm.eval(parser.parse(code))
+        except Exception as e:
+            assert str(e) == "Variable 'x' is already defined", backend
+        else:
+            assert False, backend
+
+def test_tail_calls():
+    # 尾递归不应该增加 Python 栈深度
+    countdown = 'def countdown(n): n == 0 ? "done" : countdown(n - 1) end countdown(1000000)'
+    assert VirtualMachine().eval(parser.parse(countdown)) == "done"
+    mutual = '''
+    def even(n): n == 0 or odd(n - 1) end
+    def odd(n): n != 0 and even(n - 1) end
+    [even(100000), odd(100001)]
+    '''
+    for backend in VirtualMachine.BACKENDS:
+        assert VirtualMachine(backend).eval(parser.parse(mutual)) == [True, True]
+
+def test_closure_capture():
+    # 闭包只持有函数体引用的外层局部变量，不持有定义它的栈帧
+    code = 'def make(n): let big = [n, n, n]; let k = n * 2; x => x + k end make(1)'
+    f = VirtualMachine().eval(parser.parse(code))
+    assert len(f.env) == 2 and f.env[1].value == 2
+    assert VirtualMachine().handle_function_call(f, [1], None) == 3
+    try:
+        VirtualMachine().eval(parser.parse('def f(): def g(): x end let y = g(); let x = 1; y end f()'))
+    except NameError:
+        pass
+    else:
+        assert False, "x is used before its definition"
+
+def test_static_name_errors():
+    # 重复定义和未定义的名字在执行前报错
+    vm = VirtualMachine()
+    for code, error in [('let a = 1; b', NameError),
+                        ('let b = 1; def f(): undefined_name end 1', NameError),
+                        ('let c = 1; def f(): let x = 1; let x = 2; x end 1', Exception)]:
+        try:
+            vm.eval(parser.parse(code))
+        except error:
+            pass
+        else:
+            assert False, f"{code} should fail"
+    assert vm.global_env.variables == {}
+
+def test_function_imports():
+    # 函数体中导入的模块和星号导入的名字只在函数内可见
+    cases = [('def f(x): @json; json.dumps([x]) end f(1)', "[1]"),
+             ('def f(x): @json*; dumps([x]) end f(1)', "[1]"),
+             ('def f(x): @_; str(len([x, x])) end f(1)', "2"),
+             ('def g(): @math; def h(y): math.sqrt(y) end h(16) end g()', 4.0),
+             ('def f(): @math*; y => sqrt(y) end f()(9)', 3.0)]
+    for backend in VirtualMachine.BACKENDS:
+        for code, expected in cases:
+            assert VirtualMachine(backend).eval(parser.parse(code)) == expected, (backend, code)
+        try:
+            VirtualMachine(backend).eval(parser.parse('def f(x): @json*; dumps([x]) end [f(1), dumps]'))
+        except NameError:
+            pass
+        else:
+            assert False, backend
+
+def test_parse_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "cached.loo")
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("1 + 2")
+        assert VirtualMachine().process_file(source) == 3
+        assert os.path.exists(os.path.join(tmp, "__loongcache__", "cached.looc"))
+        # 命中缓存
+        assert VirtualMachine().process_file(source) == 3
+        # 源码变化后缓存失效
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("3 * 4")
+        assert VirtualMachine().process_file(source) == 12
+        assert VirtualMachine(use_cache=False).process_file(source) == 12
+
+def test_vectorized_pipelines():
+    if vectorize.np is None:
+        return
+    programs = ['xs |> (x => x * 2 + 1) |? (x => x % 3 == 0)',
+                'xs |> (x => (x > 100) * (x < 900)) |> (x => ~x)',
+                'xs |> (x => x * x * x * x * x * x * x)',  # 超出 int64，必须回退
+                'xs |? (x => x > k) |> (x => x / k)',
+                'xs |> (x => x > 0 ? x : -x)',
+                # 两个分支类型不同时不能用 np.where，否则 1 会变为 1.0、True 会变为 1
+                'xs |> (x => x > 500 ? 1 : 2.5)',
+                'xs |> (x => x > 500 ? x : 0.5)',
+                'xs |> (x => x > 5 ? x > 7 : 0)']
+    threshold = vectorize.VECTORIZE_THRESHOLD
+    for code in programs:
+        results = []
+        for vectorize.VECTORIZE_THRESHOLD in (float('inf'), threshold):
+            vm = VirtualMachine()
+            vm.global_env.set('xs', list(range(-500, 1000)))
+            vm.global_env.set('k', 7)
+            results.append(vm.eval(parser.parse(code)))  # 结果中的 Pipeline 已经物化
+        assert results[0] == results[1], code
+        assert list(map(type, results[0])) == list(map(type, results[1])), code
+    vectorize.VECTORIZE_THRESHOLD = threshold
+
+def test_constant_folding():
+    tree = optimize(parser.parse('[1 + 2 * 3, 1 < 2 ? "a" : b, 0 or 5, 1 // 0]'))
+    literals = [child.children[0] for child in tree.children[0].children if child.data == 'literal']
+    assert literals == [7, "a", 5]
+    # 1 // 0 留到运行时报错
+    assert tree.children[0].children[3].data == 'mult_exp'
+    # 常量列表和字典每次求值都是新的对象
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend)
+        code = 'def f(): [1, 2] end let a = f(); a[0] = 9; def g(): {k: 1} end let d = g(); d.k = 2; [f(), g()]'
+        assert vm.eval(parser.parse(code)) == [[1, 2], {'k': 1}]
+
+def test_operator_dispatch():
+    vm = VirtualMachine()
+    for code, error in [('[1] + 2', "Cannot add non-list to a list"),
+                        ('{} - 1', "Dictionaries cannot be subtracted directly unless they implement __sub__"),
+                        ('"a" % 1', "Unsupported operand type(s) for %")]:
+        # 第二次执行走缓存的类型对，错误必须保持一致
+        for _ in range(2):
+            try:
+                vm.eval(parser.parse(code))
+            except TypeError as e:
+                assert str(e) == error, code
+            else:
+                assert False, code
+
+def test_records():
+    code = '''
+    def vec(x, y): {x: x, y: y, __add__: def (a, b): vec(a.x + b.x, a.y + b.y) end} end
+    [vec(1, 2) + vec(3, 4), vec(0, 1)]
+    '''
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend)
+        a, b = vm.eval(parser.parse(code))
+        # 同一个字面量创建的记录共享类型，仍然是普通的字典
+        assert type(a) is type(b) and isinstance(a, Record) and type(a).fields == ('x', 'y', '__add__')
+        assert json.dumps({k: a[k] for k in 'xy'}) == '{"x": 4, "y": 6}' and 'x: 4' in pretty_var(a)
+        assert ('+', type(a)) in vm.operators.hooks, backend
+        c = pickle.loads(pickle.dumps(b))
+        assert type(c) is type(b) and c['y'] == 1
+        # 记录创建后删除了重载的键，按类型缓存的调用方式也要报错
+        del b['__add__']
+        vm.global_env.set('b', b)
+        try:
+            vm.eval(parser.parse('b + b'))
+        except TypeError:
+            pass
+        else:
+            assert False, backend
+        # 同一个属性访问点依次遇到不同的 shape、普通字典和 Python 对象
+        vm.global_env.set('ns', types.SimpleNamespace(x=4))
+        vm.global_env.set('plain', {'x': 5})
+        fields = 'def get(o): o.x end [get({x: 1}), get({y: 0, x: 2}), get(ns), get(plain), get({x: 3})]'
+        assert vm.eval(parser.parse(fields)) == [1, 2, 4, 5, 3], backend
+    # 注册表只弱引用记录类型，不再使用的 shape 被回收
+    shape = weakref.ref(record_type(('only', 'here')))
+    gc.collect()
+    assert shape() is None
+    assert record_type(('x', 'y')) is record_type(('x', 'y'))
+
+def test_inline_caches():
+    code = '''
+    def point(x): {x: x, get: def (): x end, step: def (n): n == 0 ? x : point(x).step(n - 1) end} end
+    def size(v): v.__len__() end
+    def root(): ns.sqrt(16) end
+    ["abc".upper(), point(3).get(), point(1).step(10000), (items |> size).force(), root()]
+    '''
+    items = ["ab", [1, 2, 3], {1}, (1, 2), range(5), b"abcdef"]
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend)
+        ns = types.SimpleNamespace(sqrt=lambda x: x ** 0.5)
+        vm.global_env.set('ns', ns)
+        vm.global_env.set('items', items)
+        # 记录方法中的尾调用不会耗尽栈；接收者类型多于缓存容量时结果不变
+        assert vm.eval(parser.parse(code)) == ["ABC", 3, 1, [2, 3, 1, 2, 5, 6], 4.0], backend
+        # 缓存的是取值方式而不是取到的函数，重新绑定的属性立即可见
+        ns.sqrt = lambda x: -x
+        assert vm.eval(parser.parse('root()')) == -16, backend
+
+def test_ropes():
+    code = '''
+    @_; @json;
+    def build(i, acc): i == 0 ? acc : build(i - 1, str(i) + "," + acc + ";") end
+    let s = build(20000, "");
+    [s == s.upper(), s[0], len(s), json.loads(json.dumps(s)) == s, s + 1 > s]
+    '''
+    expected = "".join(f"{i}," for i in range(1, 20001)) + ";" * 20000
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend)
+        assert vm.eval(parser.parse(code)) == [True, "1", len(expected), True, True], backend
+        # 数万层的 Rope 按需展开，返回给 Python 的是 str
+        s = vm.eval(parser.parse('s'))
+        assert type(s) is str and s == expected, backend
+        vm.eval(parser.parse('let t = s + s; 0'))
+        t = pickle.loads(pickle.dumps(vm.global_env.variables['t']))
+        assert type(t) is str and t == s + s, backend
+        # 放进列表和字典的 Rope 先展开，Python 函数看到的容器中只有 str
+        stored = vm.eval(parser.parse('''
+        @_; @json; let big = "x" * 2000; let d = {}; let xs = [0];
+        d[big + "k"] = 1; d.v = big + "v"; xs[0] = big + "i";
+        [",".join([big + "a", big + "b"]), json.dumps({s: big + "1"}), ",".join(["a"] |> (x => big + x)), d, xs]
+        '''))
+        big = "x" * 2000
+        assert stored[:3] == [f"{big}a,{big}b", json.dumps({'s': big + "1"}), big + "a"], backend
+        assert [type(key) for key in stored[3]] == [str, str] and type(stored[3]['v']) is str, backend
+        assert type(stored[4][0]) is str, backend
+
+def test_sources():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "app.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write('level,msg\r\nERROR,"disk, full"\nINFO,ok\nERROR,\u9519\nWARN,"two\nlines"\rINFO,mac\n')
+        open(os.path.join(tmp, "empty.log"), "w").close()
+        for backend in VirtualMachine.BACKENDS:
+            vm = VirtualMachine(backend)
+            vm.global_env.set('path', path)
+            vm.global_env.set('empty', os.path.join(tmp, "empty.log"))
+            for use_mmap in (0, 1):
+                vm.global_env.set('m', use_mmap)
+                errors = vm.eval(parser.parse('records(path, ",", 1, m) |? (r => r.level == "ERROR") |> (r => r.msg)'))
+                assert errors == ["disk, full", "\u9519"], (backend, use_mmap)
+                # 数据源可以重复迭代，每次重新读取文件
+                source = vm.eval(parser.parse('lines(path, m)'))
+                assert list(source) == list(source) == ["level,msg", 'ERROR,"disk, full"', "INFO,ok", "ERROR,\u9519",
+                                                        'WARN,"two', 'lines"', "INFO,mac"], (backend, use_mmap)
+                # 引号中的换行属于字段，单独的 \r 与文本模式一样是行尾
+                rows = list(vm.eval(parser.parse('records(path, ",", 0, m)')))
+                assert rows[-2:] == [["WARN", "two\nlines"], ["INFO", "mac"]], (backend, use_mmap)
+                data = b"".join(vm.eval(parser.parse('chunks(path, 5, m)')))
+                assert data == open(path, "rb").read(), (backend, use_mmap)
+                assert list(vm.eval(parser.parse('lines(empty, m)'))) == []
+        # 内存映射的块是不复制数据的 memoryview
+        assert all(type(chunk) is memoryview for chunk in vm.eval(parser.parse('chunks(path, 4, 1)')))
+
+def test_streaming():
+    source = '''# 配置
+    @_;
+    def even(n): n == 0 or odd(n - 1) end
+    def odd(n): n != 0 and even(n - 1) end
+    let s = "a;b # (end"; let inc = def (x): x + 1 end;
+    let data = [1, inc(1),
+        {a: 3, b: [4, 5]}];  # 跨行的字面量
+    log.append(s);
+    [even(10), odd(7), s, data]
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "config.loo")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(source)
+        broken = os.path.join(tmp, "broken.loo")
+        with open(broken, "w", encoding="utf-8") as f:
+            f.write('log.append(1);\nlog.append(2);\nlet x = [1,\n2 2];\n0')
+        for backend in VirtualMachine.BACKENDS:
+            results = []
+            for stream in (False, True):
+                vm = VirtualMachine(backend, use_cache=False)
+                vm.global_env.set('log', [])
+                results.append(vm.process_stream(path) if stream else vm.process_file(path))
+                assert vm.global_env.variables['log'] == ["a;b # (end"], backend
+            assert results[0] == results[1] == [True, True, "a;b # (end", [1, 2, {'a': 3, 'b': [4, 5]}]], backend
+            # 语法错误之前的语句已经执行，错误的行号是在文件中的行号
+            vm = VirtualMachine(backend)
+            vm.global_env.set('log', [])
+            try:
+                vm.process_stream(broken)
+            except UnexpectedInput as e:
+                assert e.line == 4 and vm.global_env.variables['log'] == [1, 2], backend
+            else:
+                assert False, backend
+
+def test_embedding():
+    source = '@_; def f(n): n * x end let y = f(2); y = y + 1; str(y) + "!"'
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend, use_cache=False)
+        program = vm.compile(source, vm.new_env({'x': 0}))
+        results = {}
+        def worker(i):
+            # 同一个 Program 在多个线程中执行，每次使用新的环境
+            results[i] = [program.run(vm.new_env({'x': i})) for _ in range(20)]
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == {i: [f"{2 * i + 1}!"] * 20 for i in range(8)}, backend
+        # 多个线程同时编译
+        compiled = [None] * 8
+        def compile_worker(i):
+            compiled[i] = vm.compile(f'let a = {i}; a * 10').run()
+        threads = [threading.Thread(target=compile_worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert compiled == [i * 10 for i in range(8)], backend
+        # 复制的环境互不影响，赋值不再打印
+        base = vm.new_env({'x': 1})
+        vm.compile('let z = 5; 0', base).run(base)
+        left, right = base.fork(), base.fork()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            assert vm.compile('z = z + 1; z', left).run(left) == 6, backend
+        assert output.getvalue() == "", backend
+        assert vm.compile('z', right).run(right) == 5, backend
+        assert base.lookup('z') == (True, 5), backend
+
+def test_budgets():
+    newton = 'def sqrt_newton(x, g): g * g == x ? g : sqrt_newton(x, (g + x / g) / 2) end sqrt_newton(2, 1)'
+    deep = 'def deep(n): n == 0 ? 0 : 1 + deep(n - 1) end deep(k)'
+    grow = 'def grow(xs, n): xs.append([n]); grow(xs, n + 1) end grow([], 0)'
+    cases = [(Budget(steps=1000), newton, 'steps'),
+             (Budget(seconds=0.05), newton, 'seconds'),
+             (Budget(depth=50), deep, 'depth'),
+             (Budget(allocations=50000), grow, 'allocations')]
+    for backend in VirtualMachine.BACKENDS:
+        for budget, source, limit in cases:
+            vm = VirtualMachine(backend, budget=budget)
+            program = vm.compile(source, vm.new_env({'k': 0}))
+            try:
+                program.run(vm.new_env({'k': 1000}))
+            except BudgetExceeded as e:
+                assert e.limit == limit, (backend, limit)
+                assert set(e.stats) == {'steps', 'seconds', 'depth', 'allocations'}
+                if limit == 'steps':
+                    assert e.stats['steps'] == 1001, backend
+            else:
+                assert False, (backend, limit)
+        # 每次求值重新计量，预算之内的程序照常执行，管道中的调用也计入步数
+        vm = VirtualMachine(backend, budget=Budget(steps=10, depth=50))
+        program = vm.compile(deep, vm.new_env({'k': 0}))
+        assert [program.run(vm.new_env({'k': 9})) for _ in range(3)] == [9, 9, 9], backend
+        assert vm.eval(parser.parse('([1, 2, 3] |> (x => x + 1)).force()')) == [2, 3, 4], backend
+        try:
+            vm.eval(parser.parse('@_; (range(20) |> (x => x + 1)).force()'))
+        except BudgetExceeded as e:
+            assert e.stats['steps'] == 11, backend
+        else:
+            assert False, backend
+        # 作为结果返回的惰性管道在计量之内物化，不会逃出预算
+        vm = VirtualMachine(backend, budget=Budget(steps=1000))
+        try:
+            vm.eval(parser.parse('@_; range(100000) |> (x => x)'))
+        except BudgetExceeded as e:
+            assert e.limit == 'steps', backend
+        else:
+            assert False, backend
+
+def test_module_registry():
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "shared.loo"), "w", encoding="utf-8") as f:
+            f.write('let items = []; def add(x): items.append(x) end 0')
+        cwd = os.getcwd()
+        vm = VirtualMachine(path=[tmp])
+        os.chdir(tempfile.gettempdir())  # 模块查找不依赖当前目录
+        try:
+            vm.eval(parser.parse('@shared; shared.add(1)'))
+            # 第二次导入不会重新执行模块，两次导入共享同一个模块
+            assert vm.eval(parser.parse('@shared*; add(2); items')) == [1, 2]
+            assert vm.modules['shared'].items == [1, 2]
+        finally:
+            os.chdir(cwd)
+        # 星号导入的名字在第一次使用时才绑定
+        assert 'dumps' not in vm.global_env.variables
+        assert vm.eval(parser.parse('@json*; dumps([1])')) == "[1]"
+        assert 'dumps' in vm.global_env.variables and 'loads' not in vm.global_env.variables
+        try:
+            vm.eval(parser.parse('@no_such_module; 1'))
+        except ImportError:
+            pass
+        else:
+            assert False
+
+def test_pmap():
+    code = '''
+    let k = 10;
+    def fib(n): n < 2 ? n : fib(n - 1) + fib(n - 2) end
+    def make(offset): x => fib(x) * k + offset end
+    let f = make(1);
+    pmap(range(12), f, 3)
+    '''
+    expected = [fib * 10 + 1 for fib in [0, 1, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89]]
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend)
+        vm.global_env.set('range', range)
+        assert vm.eval(parser.parse(code)) == expected, backend
+        # 函数序列化后携带外层变量的快照，可以脱离原来的虚拟机执行
+        f = pickle.loads(pickle.dumps(vm.global_env.lookup('f')[1]))
+        assert vm.handle_function_call(f, [10], None) == 551
+        assert vm.eval(parser.parse('pmap(["a", "b"], x => x + "!", 2, "thread")')) == ["a!", "b!"]
+
+def test_profiler():
+    code = 'def fib(n): n < 2 ? n : fib(n - 1) + fib(n - 2) end ([1, 2] |> (x => x + 1)).force(); fib(10)'
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend, profile=True)
+        assert vm.eval(parser.parse(code)) == 55
+        profiler = vm.profiler
+        assert profiler.functions['fib'].calls == 177
+        assert profiler.functions['<lambda:1:65>'].calls == 2  # 匿名函数以源码位置命名
+        stacks = dict(line.rsplit(" ", 1) for line in profiler.collapsed().splitlines())
+        assert '<module>;fib;fib;fib' in stacks
+        assert 'fib' in profiler.report()
+    assert VirtualMachine().profiler is None
+
+def test_server():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'loong.sock')
+        server = subprocess.Popen([sys.executable, 'loongserver.py', '--socket', path, '--workers', '1'],
+                                  stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(200):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.05)
+            response = request({'code': '@_; print("hi"); let x = 2; x * 3'}, path)
+            assert response == {'ok': True, 'result': '6', 'output': 'hi\n'}
+            # 每个请求使用新的全局环境
+            response = request({'code': 'x'}, path)
+            assert not response['ok'] and response['error'].startswith('NameError')
+            # 超时的工作进程被替换，之后的请求不受影响
+            response = request({'code': 'def f(n): f(n) end f(1)'}, path, timeout=0.5)
+            assert response['error'].startswith('TimeoutError')
+            assert request({'code': '1 + 2'}, path)['result'] == '3'
+        finally:
+            server.terminate()
+            server.wait()
+        assert not os.path.exists(path)
+
+def test_async():
+    async def handle(reader, writer):
+        data = await reader.read()
+        await asyncio.sleep(0.2)
+        writer.write(data.upper())
+        await writer.drain()
+        writer.close()
+
+    code = """
+    @asyncio;
+    async def request(port, text):
+        let conn = await asyncio.open_connection("127.0.0.1", port);
+        conn[1].write(text.encode());
+        conn[1].write_eof();
+        let reply = await conn[0].read();
+        conn[1].close();
+        reply.decode()
+    end
+    let server = await asyncio.start_server(handle, "127.0.0.1", 0);
+    let port = server.sockets[0].getsockname()[1];
+    let replies = await gather(["a", "b", "c"] |> async t => await request(port, t));
+    server.close();
+    replies
+    """
+    for backend in VirtualMachine.BACKENDS:
+        vm = VirtualMachine(backend)
+        vm.global_env.set('handle', handle)
+        start = time.perf_counter()
+        assert vm.eval(parser.parse(code)) == ["A", "B", "C"], backend
+        # 三个请求并发执行，总时间接近一个请求的延迟
+        assert time.perf_counter() - start < 0.5, backend
+        # 解构赋值的值中也可以有 await，顶层和 async 函数中都一样
+        unpack = """
+        async def two(x): x * 2 end
+        async def both(): let [c, d] = await gather(two(3), two(4)); c + d end
+        let [a, b] = await gather(two(1), two(2));
+        a + b + await both()
+        """
+        assert vm.eval(parser.parse(unpack)) == 20, backend
+        try:
+            vm.eval(parser.parse('def f(x): await x end 0'))
+            assert False, "expected SyntaxError"
+        except SyntaxError as e:
+            assert "outside async function" in str(e)
 
 if __name__ == "__main__":
-    test_loong()
\ No newline at end of file
+    if sys.argv[1:2] == ['--diff']:
+        # python test_loong.py --diff [后端 ...]
+        sys.exit(1 if run_differential(sys.argv[2:] or VirtualMachine.BACKENDS) else 0)
+    test_loong()
+    test_loong_bytecode()
+    test_loong_python()
+    test_tail_calls()
+    test_static_name_errors()
+    test_function_imports()
+    test_parse_cache()
+    test_vectorized_pipelines()
+    test_constant_folding()
+    test_operator_dispatch()
+    test_module_registry()
+    test_pmap()
+    test_profiler()
+    test_server()
+    test_async()
+    test_differential()
+    test_closure_capture()
+    test_records()
+    test_inline_caches()
+    test_ropes()
+    test_sources()
+    test_streaming()
+    test_embedding()
+    test_budgets()
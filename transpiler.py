@@ -0,0 +1,558 @@
+"""
+Python 后端：把 Loong 语法树翻译为 Python ``ast.Module``，用 ``compile()`` 编译后执行。
+
+每个 Loong 函数对应一个嵌套的 Python 函数，参数和局部变量是 Python 局部变量
+（加 ``l_`` 前缀避开关键字和辅助函数），内层函数读写外层局部变量时由 Python
+的闭包单元实现，赋值时声明 ``nonlocal``，因此词法作用域与闭包后端一致。顶层
+名字仍保存在全局 Env 中，通过 ``_load``/``_let`` 等辅助函数按名字访问。
+
+算术运算符经过 ``operators.DISPATCH``，保留字符串拼接数字和字典 ``__add__``
+等重载；比较和位运算直接使用 Python 运算符。尾位置上的调用返回 FuncCall，
+由 ``handle_function_call`` 的蹦床执行，深度尾递归不会耗尽 Python 栈。async
+函数翻译为 Python 的 ``async def``。
+
+编译结果按语法树的结构缓存，同一棵树（例如同一个脚本再次执行）直接复用代码
+对象，跳过翻译和 ``compile()``；这时未定义的名字推迟到运行时才报错。
+"""
+import ast
+import threading
+from collections import OrderedDict
+
+from lark.lexer import Token
+from lark.tree import Tree
+
+from coroutines import has_await
+from inlinecache import GETATTR, ITEM, MethodCache, field_getter
+from loongast import FuncCall, FuncDef
+from operators import DISPATCH
+from pipeline import Pipeline, discard, materialize
+from profiler import first_token, lambda_name
+from records import record_type
+from rope import plain, plain_args
+from resolver import FunctionScope, GlobalScope, resolve, star_modules
+import vectorize
+
+# 缓存的代码对象个数上限
+MAX_CACHED_PROGRAMS = 256
+
+# 语法树结构 -> (代码对象, 常量表, 是否为 async 程序, 编译时对全局环境的查询)，
+# 与虚拟机无关，所有虚拟机共享
+_programs = OrderedDict()
+_programs_lock = threading.Lock()
+
+ARITHMETIC = {'+': '_add', '-': '_sub', '*': '_mul', '/': '_div', '//': '_floordiv', '%': '_mod', '**': '_pow'}
+COMPARE = {'==': ast.Eq, '!=': ast.NotEq, '<': ast.Lt, '>': ast.Gt, '<=': ast.LtE, '>=': ast.GtE}
+BITWISE = {'&': ast.BitAnd, '|': ast.BitOr, '^': ast.BitXor, '<<': ast.LShift, '>>': ast.RShift}
+UNARY = {'not': ast.Not, '-': ast.USub, '+': ast.UAdd, '~': ast.Invert}
+
+
+def tree_key(node):
+    """语法树的结构键；区分 1、1.0 和 True 等相等但类型不同的字面量"""
+    if isinstance(node, Tree):
+        return (node.data, *map(tree_key, node.children))
+    if isinstance(node, Token):
+        return (node.type, str(node))
+    if isinstance(node, tuple):
+        return ('tuple', *map(tree_key, node))
+    return (type(node).__name__, repr(node))
+
+
+class EnvQueries:
+    """
+    记录静态检查对全局环境的查询及其结果。
+
+    生成的代码与全局环境无关，但名字是否已定义的检查依赖编译时的环境；缓存的程序
+    只有在新的环境对这些查询给出相同结果时才能复用，否则重新翻译以报告同样的错误。
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.results = {}
+
+    def defines(self, name):
+        result = self.results[('defines', name)] = self.env.defines(name)
+        return result
+
+    def lookup(self, name):
+        exists, value = self.env.lookup(name)
+        self.results[('lookup', name)] = exists
+        return exists, value
+
+    def freeze(self):
+        return tuple((method, name, result) for (method, name), result in self.results.items())
+
+
+def same_queries(queries, env):
+    """env 对 queries 中每个查询的结果是否与记录的相同"""
+    for method, name, result in queries:
+        if (env.defines(name) if method == 'defines' else env.lookup(name)[0]) != result:
+            return False
+    return True
+
+
+def local(name):
+    return 'l_' + name
+
+
+def load(name):
+    return ast.Name(name, ast.Load())
+
+
+def store(name):
+    return ast.Name(name, ast.Store())
+
+
+def call(name, *args):
+    return ast.Call(load(name), list(args), [])
+
+
+def const(value):
+    return ast.Constant(value)
+
+
+def arguments(names):
+    return ast.arguments(posonlyargs=[], args=[ast.arg(name) for name in names], vararg=None,
+                         kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[])
+
+
+def function_def(name, params, body, is_async=False):
+    cls = ast.AsyncFunctionDef if is_async else ast.FunctionDef
+    return cls(name=name, args=arguments(params), body=body, decorator_list=[], returns=None, type_comment=None)
+
+
+def helpers(vm):
+    """生成代码使用的辅助函数，与虚拟机绑定"""
+    handle_call = vm.handle_function_call
+    dispatch = vm.operators.dispatch
+    profiler = vm.profiler
+    budget = vm.budget
+
+    def _load(env, name):
+        exists, value = env.lookup(name)
+        if not exists:
+            raise NameError(f"Variable '{name}' not defined in the environment.")
+        return value
+
+    def _load_star(env, stars, name):
+        exists, value = vm.lookup_star(stars, name)
+        return value if exists else _load(env, name)
+
+    def _let(env, name, value):
+        if env.defines(name):
+            raise Exception(f"Variable '{name}' is already defined")
+        env.set(name, value)
+
+    def _let_multi(env, names, value):
+        for name, item in zip(names, _unpack(value, len(names))):
+            _let(env, name, item)
+
+    def _unpack(value, n):
+        value = materialize(value)
+        if not isinstance(value, list):
+            raise TypeError(f"Expected list, got {type(value).__name__}")
+        if n != len(value):  # 检测数组长度是否匹配
+            raise ValueError(f"Number of names ({n}) does not match number of values ({len(value)})")
+        return value
+
+    def _assign(env, name, value):
+        if not env.lookup(name)[0]:
+            raise Exception(f"Variable '{name}' is not defined")
+        env.set(name, value)
+
+    def _record(record, values):
+        return record(zip(record.fields, values))
+
+    def _tail(func, args):
+        if type(func) is FuncDef:
+            return FuncCall(func, args)
+        return handle_call(func, args, None)
+
+    def _method(site, obj, args, tail):
+        kind = site.entries.get(type(obj)) or site.lookup(type(obj))
+        if kind is ITEM:
+            func = obj[site.name]
+        elif kind is GETATTR:
+            func = getattr(obj, site.name)
+        else:  # 内置类型的方法描述符
+            return kind(obj, *plain_args(args))
+        if type(func) is FuncDef:
+            return FuncCall(func, args) if tail else handle_call(func, args, None)
+        if callable(func):
+            return func(*plain_args(args))
+        return handle_call(func, args, None)
+
+    def _stage(source, is_filter, func):
+        return Pipeline.stage(source, is_filter, func, handle_call, None)
+
+    def _import(env, name, star):
+        vm.import_module(name, env, star)
+
+    def _require(name):
+        return vm.require_module(name)
+
+    def _body(impl, name):
+        def body(env, args):
+            return impl(*args)
+        if profiler is not None:
+            body = profiler.wrap_function(name, body)
+        if budget is not None:
+            body = budget.wrap_function(body)
+        return body
+
+    def arithmetic(op):
+        lookup = DISPATCH[op].get
+
+        def apply(left, right):
+            fn = lookup((type(left), type(right)))
+            if fn is not None:
+                return fn(left, right)
+            return dispatch(op, left, right, None)
+        return apply
+
+    namespace = {
+        '_call': handle_call, '_tail': _tail, '_FuncDef': FuncDef, '_body': _body,
+        '_load': _load, '_let': _let, '_let_multi': _let_multi, '_unpack': _unpack, '_assign': _assign,
+        '_method': _method, '_record': _record, '_stage': _stage, '_import': _import,
+        '_require': _require, '_load_star': _load_star, '_discard': discard, '_plain': plain,
+    }
+    namespace.update({name: arithmetic(op) for op, name in ARITHMETIC.items()})
+    return namespace
+
+
+class Transpiler:
+    """
+    把 Lark 语法树翻译为 Python 代码对象。
+
+    :param vm: 所属的虚拟机，提供函数调用、运算符重载和模块导入。
+    """
+
+    def __init__(self, vm):
+        self.vm = vm
+        self.namespace = helpers(vm)
+        self.scope = None
+        self.consts = None  # 常量表：函数的参数、函数体语法树等，生成的代码通过 _consts[i] 访问
+        self.hoisted = None  # 当前 Python 函数中等待插入到下一条语句之前的函数定义
+        self.nonlocals = None  # 当前 Python 函数中需要声明 nonlocal 的名字
+        self.counter = 0
+
+    def compile_program(self, node, env, debug=False, dynamic=False):
+        """
+        编译顶层语句块。
+
+        :return: ``(program, is_async)``；``program(env)`` 执行程序，is_async 时返回协程。
+        """
+        key = tree_key(node), dynamic  # 两种模式报告名字错误的时机不同
+        with _programs_lock:
+            entry = _programs.get(key)
+            if entry is not None:
+                _programs.move_to_end(key)
+        if entry is None or debug or not same_queries(entry[3], env):
+            queries = EnvQueries(env)
+            module, consts, is_async = self.translate(node, queries, dynamic)
+            if debug:
+                print(ast.unparse(module))
+            entry = compile(module, "<loong>", 'exec'), consts, is_async, queries.freeze()
+            with _programs_lock:
+                _programs[key] = entry
+                while len(_programs) > MAX_CACHED_PROGRAMS:
+                    _programs.popitem(last=False)
+        code, consts, is_async, _ = entry
+        namespace = dict(self.namespace, _consts=consts)
+        exec(code, namespace)
+        return namespace['__program__'], is_async
+
+    def translate(self, node, env, dynamic=False):
+        """返回 (ast.Module, 常量表, 是否为 async 程序)"""
+        is_async = has_await(node)
+        self.scope = GlobalScope(env, node, dynamic)
+        self.consts = []
+        self.counter = 0
+        try:
+            body = self.function_body(node, tail=False)
+            consts = self.consts
+        finally:
+            self.scope = self.consts = self.hoisted = self.nonlocals = None
+        program = function_def('__program__', ['env'], body, is_async)
+        module = ast.fix_missing_locations(ast.Module([program], type_ignores=[]))
+        return module, tuple(consts), is_async
+
+    def const_index(self, value):
+        self.consts.append(value)
+        return ast.Subscript(load('_consts'), const(len(self.consts) - 1), ast.Load())
+
+    def function_body(self, node, tail):
+        """翻译语句块，最后一个表达式作为返回值"""
+        outer = self.hoisted, self.nonlocals
+        self.hoisted, self.nonlocals = [], set()
+        try:
+            children = node.children if isinstance(node, Tree) and node.data == 'statements' else [node]
+            body = []
+            for child in children[:-1]:
+                body.extend(self.located(child, self.statement(child)))
+            body.extend(self.located(children[-1], [ast.Return(self.expr(children[-1], tail))]))
+            if self.nonlocals:
+                body.insert(0, ast.Nonlocal(sorted(self.nonlocals)))
+            return body
+        finally:
+            self.hoisted, self.nonlocals = outer
+
+    def located(self, node, stmts):
+        """在语句之前插入其中用到的函数定义，并标上 Loong 源码的行号"""
+        stmts = self.hoisted + stmts
+        self.hoisted.clear()
+        token = first_token(node)
+        if token is not None and token.line is not None:
+            for stmt in stmts:
+                stmt.lineno = stmt.end_lineno = token.line
+        return stmts
+
+    # 名字
+
+    def load_name(self, name):
+        depth, slot, _ = resolve(self.scope, name)
+        if slot is None:
+            stars = star_modules(self.scope)
+            if stars:
+                return call('_load_star', load('env'), const(stars), const(name))
+            return call('_load', load('env'), const(name))
+        return load(local(name))
+
+    def store_name(self, name, value):
+        """赋值给已定义的名字"""
+        try:
+            depth, slot, _ = resolve(self.scope, name)
+        except NameError:
+            raise Exception(f"Variable '{name}' is not defined")
+        if slot is None:
+            return ast.Expr(call('_assign', load('env'), const(name), value))
+        if depth:
+            self.nonlocals.add(local(name))
+        return ast.Assign([store(local(name))], value)
+
+    def define(self, name, value, check=False):
+        """在当前作用域中绑定 let/def 声明的名字；check 为 True 时在顶层检查重复定义"""
+        if isinstance(self.scope, FunctionScope):
+            return ast.Assign([store(local(name))], value)
+        if check:
+            return ast.Expr(call('_let', load('env'), const(name), value))
+        return ast.Expr(ast.Call(ast.Attribute(load('env'), 'set', ast.Load()), [const(name), value], []))
+
+    # 语句
+
+    def statement(self, node):
+        if isinstance(node, Tree):
+            method = getattr(self, f"stmt_{node.data}", None)
+            if method is not None:
+                return method(node)
+        # 表达式语句的值被丢弃，其中的 Pipeline 在这里执行
+        return [ast.Expr(call('_discard', self.expr(node)))]
+
+    def stmt_import_stmt(self, node):
+        star = len(node.children) > 1 and node.children[1] is not None and node.children[1].value == '*'
+        name = node.children[0].value
+        if isinstance(self.scope, FunctionScope):
+            # 名字的查找方式已经由 resolver 确定，这里只需加载模块
+            if star:
+                return [ast.Expr(call('_require', const(name)))]
+            return [self.define(name, call('_require', const(name)))]
+        return [ast.Expr(call('_import', load('env'), const(name), const(star)))]
+
+    def stmt_let_stmt(self, node):
+        return [self.define(node.children[0].value, self.expr(node.children[1]), check=True)]
+
+    def stmt_let_multi_stmt(self, node):
+        names = [name.value for name in node.children[:-1]]
+        value = self.expr(node.children[-1])
+        if isinstance(self.scope, FunctionScope):
+            target = ast.Tuple([store(local(name)) for name in names], ast.Store())
+            return [ast.Assign([target], call('_unpack', value, const(len(names))))]
+        return [ast.Expr(call('_let_multi', load('env'), const(tuple(names)), value))]
+
+    def stmt_assign_stmt(self, node):
+        target = node.children[0]
+        value = self.expr(node.children[1])
+        if isinstance(target, Token):  # name
+            return [self.store_name(target.value, value)]
+        if target.data == 'array_access':
+            index = call('_plain', self.expr(target.children[1]))
+            item = ast.Subscript(self.expr(target.children[0]), index, ast.Store())
+        elif target.data == 'prop_access':
+            item = ast.Subscript(self.expr(target.children[0]), const(target.children[1].value), ast.Store())
+        else:
+            raise SyntaxError(f"Cannot assign to '{target.data}'")
+        return [ast.Assign([item], call('_plain', value))]
+
+    def stmt_func_def(self, node, is_async=False):
+        name = node.children[0].value
+        params = [param.value for param in node.children[1].children if param is not None]
+        return [self.define(name, self.function(params, node.children[2], name, is_async))]
+
+    def stmt_async_func_def(self, node):
+        return self.stmt_func_def(node, True)
+
+    # 函数
+
+    def function(self, params, body, name, is_async=False):
+        """翻译函数体，定义放到 self.hoisted 中，返回创建 FuncDef 的表达式"""
+        scope = FunctionScope(self.scope, params, body)
+        self.scope = scope
+        try:
+            stmts = self.function_body(body, tail=not is_async)
+        finally:
+            self.scope = scope.parent
+        self.counter += 1
+        impl, body_name, free_name = f"_f{self.counter}", f"_b{self.counter}", f"_v{self.counter}"
+        self.hoisted.append(function_def(impl, [local(param) for param in params], stmts, is_async))
+        self.hoisted.append(ast.Assign([store(body_name)], call('_body', load(impl), const(name))))
+        # 外层变量的当前值，用于 memo 的缓存键和 pmap 的序列化
+        free_names = tuple(sorted(scope.free))
+        free = const(None)
+        if free_names:
+            values = ast.Tuple([self.load_free(scope, free_name_) for free_name_ in free_names], ast.Load())
+            self.hoisted.append(ast.Assign([store(free_name)], ast.Lambda(arguments(['_']), values)))
+            free = load(free_name)
+        source = const(None) if is_async else self.const_index(('closure', params, body, free_names))
+        vector = self.vector_plan(scope, params, body, is_async)
+        vector = const(None) if vector is None else self.const_index(vector)
+        return call('_FuncDef', self.const_index(params), load(body_name), load('env'), vector, free, source)
+
+    def load_free(self, scope, name):
+        """在定义函数的作用域中读取函数 scope 的外层名字，也查找函数自己星号导入的模块"""
+        stars = star_modules(scope)
+        if stars:
+            try:
+                _, slot, _ = resolve(self.scope, name)
+            except NameError:
+                slot = None
+            if slot is None:
+                return call('_load_star', load('env'), const(stars), const(name))
+        return self.load_name(name)
+
+    def vector_plan(self, scope, params, body, is_async):
+        """
+        借用闭包编译器生成向量化表达式。闭包编译器的栈帧是 ``[(全局 Env, Cell...), ...]``，
+        而这里 func.env 总是全局 Env，所以只处理定义在顶层、没有外层局部变量的函数。
+        """
+        if is_async or len(params) != 1 or not isinstance(scope.parent, GlobalScope):
+            return None
+        compiler = self.vm.compiler
+        outer, compiler.scope = compiler.scope, scope
+        try:
+            vector = vectorize.plan(body, params[0], compiler)
+        finally:
+            compiler.scope = outer
+        if vector is None:
+            return None
+        return lambda frame, x: vector([(frame[0],), None], x)
+
+    # 表达式
+
+    def expr(self, node, tail=False):
+        if node is None:
+            return const(None)
+        if isinstance(node, Token):
+            if node.type == 'NAME':
+                return self.load_name(node.value)
+            if node.type == 'NUMBER':
+                if '.' in node.value or 'e' in node.value or 'E' in node.value:
+                    return const(float(node.value))
+                return const(int(node.value))
+            if node.type == 'STRING':
+                return const(node.value[1:-1])
+            raise SyntaxError(f"Unsupported token '{node.type}'")
+        method = getattr(self, f"expr_{node.data}", None)
+        if method is None:
+            raise SyntaxError(f"Unsupported syntax node '{node.data}'")
+        return method(node, tail)
+
+    def expr_func_expr(self, node, tail, is_async=False):
+        params = [param.value for param in node.children[0].children if param is not None]
+        return self.function(params, node.children[1], lambda_name(node), is_async)
+
+    def expr_short_func_expr(self, node, tail, is_async=False):
+        return self.function([node.children[0].value], node.children[1], lambda_name(node), is_async)
+
+    def expr_async_func_expr(self, node, tail):
+        return self.expr_func_expr(node, tail, True)
+
+    def expr_async_short_func_expr(self, node, tail):
+        return self.expr_short_func_expr(node, tail, True)
+
+    def expr_await_exp(self, node, tail):
+        return ast.Await(self.expr(node.children[0]))
+
+    def expr_func_call(self, node, tail):
+        callee = node.children[0]
+        args = ast.List([self.expr(arg) for arg in node.children[1].children if arg is not None], ast.Load())
+        if isinstance(callee, Tree) and callee.data == 'prop_access':
+            # 方法调用点的内联缓存，见 inlinecache.py
+            site = self.const_index(MethodCache(callee.children[1].value))
+            return call('_method', site, self.expr(callee.children[0]), args, const(tail))
+        func = self.expr(callee)
+        if tail:
+            return call('_tail', func, args)
+        return call('_call', func, args, const(None))
+
+    def expr_array_access(self, node, tail):
+        return ast.Subscript(self.expr(node.children[0]), self.expr(node.children[1]), ast.Load())
+
+    def expr_prop_access(self, node, tail):
+        # 属性访问点的内联缓存，见 inlinecache.py
+        getter = self.const_index(field_getter(node.children[1].value))
+        return ast.Call(getter, [self.expr(node.children[0])], [])
+
+    def expr_list(self, node, tail):
+        items = [call('_plain', self.expr(item)) for item in node.children if item is not None]
+        return ast.List(items, ast.Load())
+
+    def expr_dict(self, node, tail):
+        pairs = [pair for pair in node.children if pair is not None]
+        keys = tuple(pair.children[0].value for pair in pairs)
+        values = ast.Tuple([call('_plain', self.expr(pair.children[1])) for pair in pairs], ast.Load())
+        return call('_record', self.const_index(record_type(keys)), values)
+
+    def expr_const_list(self, node, tail):
+        return call('list', const(node.children[0]))  # 每次求值返回新的列表
+
+    def expr_const_dict(self, node, tail):
+        pairs = node.children[0]
+        return call('_record', self.const_index(record_type(tuple(key for key, _ in pairs))),
+                    ast.Tuple([const(value) for _, value in pairs], ast.Load()))
+
+    def expr_literal(self, node, tail):
+        return const(node.children[0])
+
+    def expr_map_expr(self, node, tail):
+        is_filter = node.children[1].type == 'FILTER'
+        return call('_stage', self.expr(node.children[0]), const(is_filter), self.expr(node.children[2]))
+
+    def expr_conditional_exp(self, node, tail):
+        return ast.IfExp(self.expr(node.children[0]), self.expr(node.children[1], tail),
+                         self.expr(node.children[2], tail))
+
+    def expr_logical_or_exp(self, node, tail):
+        return ast.BoolOp(ast.Or(), [self.expr(node.children[0]), self.expr(node.children[-1], tail)])
+
+    def expr_logical_and_exp(self, node, tail):
+        return ast.BoolOp(ast.And(), [self.expr(node.children[0]), self.expr(node.children[-1], tail)])
+
+    def expr_binary(self, node, tail):
+        left = self.expr(node.children[0])
+        op = node.children[1].value
+        right = self.expr(node.children[2])
+        if op in COMPARE:
+            return ast.Compare(left, [COMPARE[op]()], [right])
+        if op in BITWISE:
+            return ast.BinOp(left, BITWISE[op](), right)
+        return call(ARITHMETIC[op], left, right)
+
+    expr_additive_exp = expr_binary
+    expr_mult_exp = expr_binary
+    expr_bitwise_exp = expr_binary
+    expr_equality_exp = expr_binary
+    expr_relational_exp = expr_binary
+    expr_shift_expression = expr_binary
+    expr_power_exp = expr_binary
+
+    def expr_unary_exp(self, node, tail):
+        return ast.UnaryOp(UNARY[node.children[0].value](), self.expr(node.children[1]))
@@ -0,0 +1,254 @@
+"""
+管道中纯算术 lambda 的 NumPy 向量化执行。
+
+形如 ``x => x * 2 + 1``、``x => x % 2 == 0`` 的单参数函数在编译期被翻译为
+作用于整个数组的表达式。对大数值列表或 NumPy 数组执行 ``|>``/``|?`` 时，
+Pipeline 先用向量化表达式处理能处理的前缀阶段（过滤器变为布尔掩码），其余
+阶段再逐个元素执行。遇到无法向量化的值（非数值的自由变量、可能溢出 int64
+的整数运算、除数为 0 等）时回退到逐元素执行，保证结果与标量路径一致。
+"""
+from lark.lexer import Token
+from lark.tree import Tree
+
+try:
+    import numpy as np
+except ImportError:  # numpy 是可选依赖
+    np = None
+
+# 元素个数少于该值时转换数组的开销大于收益
+VECTORIZE_THRESHOLD = 256
+
+# 整数运算的中间结果超过该界限时放弃向量化，以免 int64 溢出
+INT_LIMIT = 2 ** 62
+
+# 超过该界限的整数转换为 float64 时会舍入，真除法的结果可能与 Python 不同
+EXACT_FLOAT_LIMIT = 2 ** 53
+
+
+class NotVectorizable(Exception):
+    pass
+
+
+def plan(node, param, compiler):
+    """
+    为函数体 node 生成向量化表达式，必须在函数作用域中调用。
+
+    :return: ``fn(frame, x) -> (value, bound)``，x 是 (参数数组, 其绝对值上界)，
+             bound 是结果绝对值的上界；函数体含有无法向量化的语法时返回 None。
+    """
+    if np is None:
+        return None
+    if isinstance(node, Tree) and node.data == 'statements':
+        if len(node.children) != 1:
+            return None
+        node = node.children[0]
+    try:
+        return _plan(node, param, compiler)
+    except NotVectorizable:
+        return None
+
+
+def _check(bound):
+    if not bound < INT_LIMIT:
+        raise NotVectorizable("integer bound exceeded")
+    return bound
+
+
+def _check_exact(bound):
+    if not bound < EXACT_FLOAT_LIMIT:
+        raise NotVectorizable("integer too large for exact division")
+    return bound
+
+
+def _scalar(value):
+    if type(value) not in (int, float):
+        raise NotVectorizable(f"{type(value).__name__} is not a number")
+    return value
+
+
+def _plan(node, param, compiler):
+    if isinstance(node, Token):
+        if node.type == 'NAME' and node.value == param:
+            return lambda frame, x: x
+        if node.type == 'NAME':
+            # 自由变量在运行时必须是数值
+            load = compiler.compile(node)
+
+            def free(frame, x):
+                value = _scalar(load(frame))
+                return value, abs(value)
+            return free
+        if node.type == 'NUMBER':
+            value = compiler.compile(node)(None)
+            return lambda frame, x: (value, abs(value))
+        raise NotVectorizable(node.type)
+    if not isinstance(node, Tree):
+        raise NotVectorizable(node)
+
+    if node.data == 'literal':
+        value = node.children[0]
+        if type(value) not in (int, float, bool):
+            raise NotVectorizable(type(value).__name__)
+        return lambda frame, x: (value, abs(value))
+
+    if node.data == 'unary_exp':
+        op = node.children[0].value
+        operand = _plan(node.children[1], param, compiler)
+        if op == '-':
+            def neg(frame, x):
+                value, bound = operand(frame, x)
+                return -_number(value), bound
+            return neg
+        if op == '+':
+            return operand
+        if op == '~':
+            def invert(frame, x):
+                value, bound = operand(frame, x)
+                return np.invert(_number(value)), _check(bound + 1)
+            return invert
+        raise NotVectorizable(op)
+
+    if node.data == 'conditional_exp':
+        cond, then, else_ = (_plan(child, param, compiler) for child in node.children)
+
+        def where(frame, x):
+            c, _ = cond(frame, x)
+            a, bound_a = then(frame, x)
+            b, bound_b = else_(frame, x)
+            if _kind(a) != _kind(b):
+                # np.where 会把两个分支提升为同一类型，如 1 变为 1.0、True 变为 1
+                raise NotVectorizable("branches of different types")
+            return np.where(c, a, b), max(bound_a, bound_b)
+        return where
+
+    if node.data not in ('additive_exp', 'mult_exp', 'relational_exp', 'equality_exp', 'bitwise_exp'):
+        raise NotVectorizable(node.data)
+
+    left = _plan(node.children[0], param, compiler)
+    op = node.children[1].value
+    right = _plan(node.children[2], param, compiler)
+    if op in ('/', '//', '%') and not _is_scalar(node.children[2], param):
+        # 数组除数可能含 0，标量路径会抛出 ZeroDivisionError 而 NumPy 不会
+        raise NotVectorizable("array divisor")
+    return BINARY[op](left, right)
+
+
+def _is_scalar(node, param):
+    """node 不依赖参数时，其值在整个数组上是同一个标量"""
+    if isinstance(node, Token):
+        return not (node.type == 'NAME' and node.value == param)
+    return all(_is_scalar(child, param) for child in node.children if isinstance(child, (Tree, Token)))
+
+
+def _kind(value):
+    """数组或标量的元素类型：'b' 布尔、'i' 整数或 'f' 浮点数"""
+    kind = value.dtype.kind if isinstance(value, np.ndarray) else np.asarray(value).dtype.kind
+    return 'i' if kind == 'u' else kind
+
+
+def _number(value):
+    """Python 中布尔值参与算术运算时按整数计算，NumPy 的布尔数组则不会"""
+    if isinstance(value, np.ndarray) and value.dtype.kind == 'b':
+        return value.astype(np.int64)
+    return value
+
+
+def _binary(op, bound_of, numeric=True):
+    def make(left, right):
+        def binary(frame, x):
+            a, bound_a = left(frame, x)
+            b, bound_b = right(frame, x)
+            if numeric:
+                a, b = _number(a), _number(b)
+            return op(a, b), bound_of(bound_a, bound_b)
+        return binary
+    return make
+
+
+def _division(op, bound_of):
+    def make(left, right):
+        def division(frame, x):
+            a, bound_a = left(frame, x)
+            b, bound_b = right(frame, x)
+            if b == 0:
+                raise NotVectorizable("division by zero")
+            return op(_number(a), b), bound_of(bound_a, bound_b)
+        return division
+    return make
+
+
+def _comparison(op):
+    return _binary(op, lambda a, b: 1, numeric=False)
+
+
+BINARY = {
+    '+': _binary(lambda a, b: a + b, lambda a, b: _check(a + b)),
+    '-': _binary(lambda a, b: a - b, lambda a, b: _check(a + b)),
+    '*': _binary(lambda a, b: a * b, lambda a, b: _check(a * b)),
+    '/': _division(lambda a, b: a / b, lambda a, b: _check_exact(a)),
+    '//': _division(lambda a, b: a // b, lambda a, b: _check(a + 1)),
+    '%': _division(lambda a, b: a % b, lambda a, b: b),
+    '<': _comparison(lambda a, b: a < b),
+    '>': _comparison(lambda a, b: a > b),
+    '<=': _comparison(lambda a, b: a <= b),
+    '>=': _comparison(lambda a, b: a >= b),
+    '==': _comparison(lambda a, b: a == b),
+    '!=': _comparison(lambda a, b: a != b),
+    # 两个布尔值的位运算在 Python 中仍是布尔值，与 NumPy 一致
+    '&': _binary(lambda a, b: a & b, lambda a, b: _check(2 * max(a, b) + 1), numeric=False),
+    '|': _binary(lambda a, b: a | b, lambda a, b: _check(2 * max(a, b) + 1), numeric=False),
+    '^': _binary(lambda a, b: a ^ b, lambda a, b: _check(2 * max(a, b) + 1), numeric=False),
+}
+
+
+def as_array(source):
+    """把大数值列表或 NumPy 数组转换为数组，不适合向量化时返回 None"""
+    if np is None:
+        return None
+    if isinstance(source, np.ndarray):
+        return source if source.ndim == 1 and source.dtype.kind in 'iuf' else None
+    if not isinstance(source, list) or len(source) < VECTORIZE_THRESHOLD:
+        return None
+    types = set(map(type, source))
+    if types != {int} and types != {float}:
+        return None
+    try:
+        return np.array(source)
+    except OverflowError:
+        return None
+
+
+def apply(source, stages):
+    """
+    用向量化表达式执行 stages 中尽可能长的前缀。
+
+    :return: (新的 source, 剩余的 stages)；无法向量化时原样返回。
+    """
+    if not stages or getattr(stages[0][1], 'vector', None) is None:
+        return source, stages
+    arr = as_array(source)
+    if arr is None:
+        return source, stages
+    done = 0
+    with np.errstate(all='ignore'):
+        for is_filter, func in stages:
+            vector = getattr(func, 'vector', None)
+            if vector is None or not len(arr) or arr.dtype.kind == 'b':
+                break
+            try:
+                bound = max(abs(int(arr.max())), abs(int(arr.min()))) if arr.dtype.kind in 'iu' else 0
+                value, _ = vector([func.env, None], (arr, bound))
+            except (NotVectorizable, TypeError, OverflowError):
+                break
+            value = np.broadcast_to(value, arr.shape)
+            if is_filter:
+                arr = arr[value.astype(bool)]
+            elif value.dtype.kind in 'iufb':
+                arr = np.array(value)
+            else:
+                break
+            done += 1
+    if done == 0:
+        return source, stages
+    result = arr if isinstance(source, np.ndarray) else arr.tolist()
+    return result, stages[done:]